@@ -5,6 +5,7 @@ FastAPI web interface voor email configuratie en connectiviteit testing
 
 import os
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
@@ -16,6 +17,14 @@ from routes.connection_routes import router as connection_router
 from routes.polling_routes import router as polling_router
 from routes.notification_routes import router as notification_router
 from routes.admin_routes import router as admin_router
+from config.app_config import active_handlers
+from core.http_pool import openrouter_pool
+from core.job_workers import job_workers
+from core.smtp_pool import smtp_delivery
+from core.poll_scheduler import poll_scheduler
+from core.mailbox_coordinator import mailbox_coordinator, runs_mail_workers, APP_MODE
+from core.imap_session import session_manager
+from core import blocking_io
 
 # Load environment variables
 load_dotenv()
@@ -23,10 +32,37 @@ load_dotenv()
 # Setup logging
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start en sluit gedeelde resources (HTTP pool, job workers, IMAP sessies, I/O pool).
+    
+    Met APP_MODE=control draait alleen de API; polling en OCR doen losse
+    worker processen (python worker.py).
+    """
+    logger.info(f"Starting in {APP_MODE} mode")
+    if runs_mail_workers():
+        await openrouter_pool.start()
+        await job_workers.start()
+        await poll_scheduler.start()
+        await mailbox_coordinator.start()
+    yield
+    await mailbox_coordinator.stop()
+    for handler in list(active_handlers.values()):
+        await handler.stop_polling()
+    await poll_scheduler.stop()
+    await job_workers.stop()
+    await smtp_delivery.close()
+    await openrouter_pool.close()
+    await blocking_io.run_blocking(session_manager.close_all)
+    blocking_io.shutdown()
+
+
 app = FastAPI(
     title="Remarkable 2 naar Tekst Converter",
     description="Automatische conversie van handgeschreven notities naar tekst",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Setup templates and static files
@@ -0,0 +1,182 @@
+"""
+Benchmark: piekgeheugen bij het doorgeven van grote originelen.
+
+Meet met tracemalloc hoeveel geheugen de twee plekken nodig hebben waar een
+origineel uit de job queue in zijn geheel langskomt:
+
+- OpenRouter request body: de oude route las het bestand als bytes, maakte
+  daar een base64 string, een data URL en een json.dumps kopie van; nu
+  streamt OCRProcessor._build_request_body de body blok voor blok vanuit
+  de spool
+- notificatie met originelen: de oude route las elk bestand als bytes in,
+  maakte er een MIMEApplication van (base64 van het hele bestand in de
+  payload) en bij zip nog een BytesIO kopie; nu gaan de bestanden als
+  spool naar StreamedAttachment en worden ze pas tijdens DATA per blok
+  ge-encodeerd. Gemeten voor de policies originals en zip.
+
+Beide routes versturen naar NullSMTP uit bench_notification_mime, dus
+zonder netwerk. De bestanden zijn willekeurige bytes (niet comprimeerbaar).
+
+Gebruik (vanuit de repo root):
+    python -m benchmarks.bench_attachment_memory [--size-mb 50] [--documents 3]
+"""
+
+import io
+import os
+import json
+import base64
+import asyncio
+import zipfile
+import argparse
+import tempfile
+import tracemalloc
+from email.mime.application import MIMEApplication
+from pathlib import Path
+from typing import Callable, List
+
+from benchmarks.bench_notification_mime import NullSMTP, SMTP_CONFIG
+from core.attachment_spool import SpooledAttachment
+from core.notification_handler import NotificationHandler
+from core.ocr_processor import OCR_MAX_TOKENS, OCR_PROMPT, OCRProcessor
+from core.smtp_pool import stream_message
+
+RECIPIENT = "user@example.com"
+WRITE_CHUNK = 1024 * 1024
+
+
+def write_originals(directory: str, size_mb: int, count: int) -> List[str]:
+    """Schrijf count bestanden van size_mb MB, zoals de job queue ze bewaart"""
+    paths = []
+    for index in range(count):
+        path = str(Path(directory) / f"doc{index}.pdf")
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(WRITE_CHUNK))
+        paths.append(path)
+    return paths
+
+
+def legacy_request_body(processor: OCRProcessor, path: str) -> int:
+    """Oude route: bestand lezen, base64, data URL en json.dumps in geheugen"""
+    with open(path, "rb") as f:
+        file_data = f.read()
+    data_url = f"data:application/pdf;base64,{base64.b64encode(file_data).decode('utf-8')}"
+    payload = {
+        "model": processor.model,
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": OCR_PROMPT},
+            {"type": "file", "file": {"filename": Path(path).name, "file_data": data_url}}
+        ]}],
+        "max_tokens": OCR_MAX_TOKENS,
+        "temperature": 0.0,
+        "data_collection": "deny"
+    }
+    return len(json.dumps(payload).encode())
+
+
+def streamed_request_body(processor: OCRProcessor, path: str) -> int:
+    async def consume() -> int:
+        spool = SpooledAttachment.from_file(path)
+        try:
+            length, body = processor._build_request_body(spool, OCR_PROMPT, "application/pdf", Path(path).name)
+            sent = 0
+            async for chunk in body:
+                sent += len(chunk)
+            assert sent == length
+            return sent
+        finally:
+            spool.close()
+
+    return asyncio.run(consume())
+
+
+async def _digest_message(handler: NotificationHandler, count: int):
+    documents = []
+    for index in range(count):
+        formatted = await handler.format_ocr_result({
+            "success": True,
+            "text": "Regel met tekst uit de notitie.\n" * 40,
+            "filename": f"doc{index}.pdf",
+            "model": "bench-model",
+            "timestamp": "2025-01-01T00:00:00"
+        })
+        documents.append({"filename": f"doc{index}.pdf", "result": formatted})
+    return await handler.prepare_digest_email(RECIPIENT, documents)
+
+
+def legacy_digest(paths: List[str], policy: str) -> int:
+    """Oude route: originelen als bytes, MIMEApplication per bestand of een BytesIO zip"""
+    handler = NotificationHandler(SMTP_CONFIG, RECIPIENT)
+    message = asyncio.run(_digest_message(handler, len(paths)))
+    originals = []
+    for path in paths:
+        with open(path, "rb") as f:
+            originals.append((Path(path).name, f.read()))
+
+    if policy == "zip":
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for filename, data in originals:
+                archive.writestr(filename, data)
+        attachment = MIMEApplication(buffer.getvalue(), "zip")
+        attachment.add_header("Content-Disposition", "attachment", filename="originelen.zip")
+        message.attach(attachment)
+    else:
+        for filename, data in originals:
+            attachment = MIMEApplication(data)
+            attachment.add_header("Content-Disposition", "attachment", filename=filename)
+            message.attach(attachment)
+
+    smtp = NullSMTP()
+    stream_message(smtp, SMTP_CONFIG["email"], RECIPIENT, message)
+    return smtp.bytes_sent
+
+
+def streamed_digest(paths: List[str], policy: str) -> int:
+    """Huidige route: spools uit de job queue, base64 pas tijdens DATA"""
+    handler = NotificationHandler(SMTP_CONFIG, RECIPIENT)
+    message = asyncio.run(_digest_message(handler, len(paths)))
+    spools = [SpooledAttachment.from_file(path) for path in paths]
+    created = []
+    try:
+        created = handler._attach_originals(message, [(Path(path).name, spool) for path, spool in zip(paths, spools)],
+                                            policy)
+        smtp = NullSMTP()
+        stream_message(smtp, SMTP_CONFIG["email"], RECIPIENT, message)
+        return smtp.bytes_sent
+    finally:
+        for spool in spools + created:
+            spool.close()
+
+
+def measure(func: Callable[[], int]) -> float:
+    """Piekgeheugen (MB) van één run onder tracemalloc"""
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=50, help="grootte per origineel (MB)")
+    parser.add_argument("--documents", type=int, default=3, help="originelen in de digest")
+    args = parser.parse_args()
+
+    processor = OCRProcessor(api_key="bench", cache=None)
+    with tempfile.TemporaryDirectory(prefix="remarkable-memory-") as tmp:
+        paths = write_originals(tmp, args.size_mb, args.documents)
+
+        print(f"[OpenRouter request body, {args.size_mb} MB PDF]")
+        for name, func in (("bytes + json.dumps", legacy_request_body), ("gestreamd uit spool", streamed_request_body)):
+            print(f"  {name:<23}: peak {measure(lambda: func(processor, paths[0])):8.1f} MB")
+
+        for policy in ("originals", "zip"):
+            print(f"[digest, {args.documents} x {args.size_mb} MB, policy {policy}]")
+            for name, func in (("bytes + MIMEApplication", legacy_digest), ("StreamedAttachment", streamed_digest)):
+                print(f"  {name:<23}: peak {measure(lambda: func(paths, policy)):8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
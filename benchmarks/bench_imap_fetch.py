@@ -0,0 +1,149 @@
+"""
+Benchmark: header-first IMAP fetch tegen het hele bericht (RFC822) ophalen.
+
+Vult een nep IMAP mailbox (benchmarks/fakes.py, TLS) met een mix van
+berichten: reMarkable exports van de toegestane afzender, dezelfde exports
+van vreemde afzenders (spam), en berichten van de toegestane afzender met
+alleen een grote niet-PDF bijlage. Daarna worden alle berichten op twee
+manieren verwerkt over dezelfde IMAP sessie:
+
+- RFC822: het hele bericht ophalen, dan pas de From header controleren en
+  de attachments uit de MIME boom halen (de oude route)
+- header-first: EmailHandler._process_email, dat eerst From en
+  BODYSTRUCTURE ophaalt en daarna alleen de PDF/PNG secties
+
+Meet per route de bytes die de server stuurde en de tijd (beste van
+--rounds), en controleert dat beide routes dezelfde attachments vinden.
+
+Gebruik (vanuit de repo root, met een tijdelijke DATA_DIR):
+    DATA_DIR=/tmp/bench python -m benchmarks.bench_imap_fetch [--messages 60] [--spam-ratio 0.3]
+        [--other-ratio 0.2] [--other-mb 2] [--rounds 3]
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from email.parser import BytesHeaderParser
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.fakes import FakeIMAPServer, HOST, build_message, create_certificate, server_ssl_context
+from benchmarks.synthetic import DocumentFactory
+from core.blocking_io import run_blocking
+from core.email_handler import EmailConfig, EmailHandler, SPOOL_DECODE_CHUNK
+from core.imap_session import get_ssl_context, session_manager
+from core.mime_stream import extract_attachments
+
+ACCOUNT = "bench@bench.local"
+PASSWORD = "bench"
+ALLOWED_SENDER = "my@remarkable.com"
+
+
+def fill_mailbox(imap: FakeIMAPServer, args: argparse.Namespace) -> List[int]:
+    """Lever --messages berichten af; geeft de UIDs terug"""
+    rng = random.Random(args.seed)
+    factory = DocumentFactory(seed=args.seed, pages=args.pages)
+    uids = []
+    for index in range(args.messages):
+        roll = rng.random()
+        if roll < args.spam_ratio:
+            sender, attachment = f"stranger{index}@elsewhere.org", factory.make(2, index)
+        elif roll < args.spam_ratio + args.other_ratio:
+            sender = ALLOWED_SENDER
+            attachment = (f"archief-{index}.zip", "application/zip", rng.randbytes(args.other_mb * 1024 * 1024))
+        else:
+            sender, attachment = ALLOWED_SENDER, factory.make(1, index)
+        data, bodystructure, sections = build_message(sender, ACCOUNT, f"Bericht {index}",
+                                                      "Verstuurd vanaf mijn reMarkable", [attachment])
+        uids.append(imap.append(ACCOUNT, data, sender, bodystructure, sections))
+    return uids
+
+
+def rfc822_route(handler: EmailHandler, uid: int) -> List[Tuple[str, int]]:
+    """Oude route: alles ophalen, dan afzender controleren en attachments uitpakken (blokkerend)"""
+    raw = handler._fetch_message(uid)
+    if raw is None or not handler.sender_policy.check(BytesHeaderParser().parsebytes(raw)).allowed:
+        return []
+    attachments = extract_attachments(raw, SPOOL_DECODE_CHUNK)
+    found = [(attachment["filename"], attachment["file"].size) for attachment in attachments]
+    for attachment in attachments:
+        attachment["file"].close()
+    return found
+
+
+async def header_first_route(handler: EmailHandler, uid: int) -> List[Tuple[str, int]]:
+    attachments = await handler._process_email(uid)
+    found = [(attachment["filename"], attachment["file"].size) for attachment in attachments]
+    for attachment in attachments:
+        attachment["file"].close()
+    return found
+
+
+async def measure(imap: FakeIMAPServer, uids: List[int], route: Callable[[int], Any],
+                  rounds: int) -> Dict[str, Any]:
+    """Beste tijd over rounds, de bytes van de server per ronde en de gevonden attachments"""
+    best, found = float("inf"), []
+    for _ in range(rounds):
+        imap.bytes_sent = 0
+        start = time.perf_counter()
+        found = [await route(uid) for uid in uids]
+        best = min(best, time.perf_counter() - start)
+    return {"seconds": best, "bytes": imap.bytes_sent, "found": found}
+
+
+async def run(args: argparse.Namespace):
+    with tempfile.TemporaryDirectory(prefix="remarkable-fetch-") as tmp:
+        cert_path, key_path = str(Path(tmp) / "cert.pem"), str(Path(tmp) / "key.pem")
+        create_certificate(cert_path, key_path)
+        # Zelfde effect als SSL_CA_FILE, maar de gedeelde context bestaat al
+        get_ssl_context().load_verify_locations(cafile=cert_path)
+
+        imap = FakeIMAPServer(server_ssl_context(cert_path, key_path))
+        await imap.start()
+        imap.add_account(ACCOUNT, PASSWORD)
+        uids = fill_mailbox(imap, args)
+        stored = sum(len(message.data) for message in imap.mailboxes[ACCOUNT].messages)
+        print(f"mailbox: {len(uids)} berichten, {stored / (1024 * 1024):.1f} MB")
+
+        handler = EmailHandler(EmailConfig(
+            email=ACCOUNT, password=PASSWORD, imap_server=HOST, imap_port=imap.port,
+            smtp_server=HOST, smtp_port=25, allowed_senders=[ALLOWED_SENDER]
+        ))
+        try:
+            # Inloggen en SELECT buiten de meting
+            await run_blocking(handler._connect)
+            legacy = await measure(imap, uids, lambda uid: run_blocking(rfc822_route, handler, uid), args.rounds)
+            header_first = await measure(imap, uids, lambda uid: header_first_route(handler, uid), args.rounds)
+        finally:
+            await run_blocking(session_manager.close_all)
+            await imap.stop()
+
+    for name, result in (("RFC822", legacy), ("header-first", header_first)):
+        attachments = sum(len(found) for found in result["found"])
+        print(f"{name:<13}: {result['bytes'] / (1024 * 1024):8.2f} MB van de server  "
+              f"{result['seconds'] * 1000:8.1f} ms  ({attachments} attachments)")
+    print(f"header-first haalt {header_first['bytes'] / legacy['bytes'] * 100:.1f}% van de bytes op "
+          f"in {header_first['seconds'] / legacy['seconds'] * 100:.1f}% van de tijd")
+    if legacy["found"] != header_first["found"]:
+        print("LET OP: de routes vonden verschillende attachments")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=60)
+    parser.add_argument("--pages", type=int, default=2, help="pagina's per PDF")
+    parser.add_argument("--spam-ratio", type=float, default=0.3, help="aandeel berichten van vreemde afzenders")
+    parser.add_argument("--other-ratio", type=float, default=0.2,
+                        help="aandeel berichten van de toegestane afzender zonder PDF/PNG")
+    parser.add_argument("--other-mb", type=int, default=2, help="grootte van de niet-PDF bijlage (MB)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
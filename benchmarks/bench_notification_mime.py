@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: notificatie email renderen en serialiseren.
+
+Vergelijkt de oude route (message.as_string() + sendmail, dat de string
+naar ASCII bytes codeert, regeleinden fixt en punten quote) met het
+streamen via BytesGenerator zoals core.smtp_pool doet. Meet tijd en
+piekgeheugen (tracemalloc) voor een bijlage van standaard 20 MB. Het
+geheugen van de originelen zelf meet benchmarks/bench_attachment_memory.py.
+
+Gebruik (vanuit de repo root):
+    python -m benchmarks.bench_notification_mime [--size-mb 20] [--rounds 3]
+"""
+
+import re
+import time
+import asyncio
+import argparse
+import tracemalloc
+from email.mime.application import MIMEApplication
+from typing import Callable, Dict
+
+from core.notification_handler import NotificationHandler
+from core.smtp_pool import stream_message
+
+SMTP_CONFIG = {"email": "bench@example.com", "password": "", "smtp_server": "localhost", "smtp_port": 25}
+
+
+class NullSMTP:
+    """Minimale smtplib.SMTP vervanger die alles accepteert en de bytes weggooit"""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def mail(self, sender):
+        return 250, b"ok"
+
+    def rcpt(self, recipient):
+        return 250, b"ok"
+
+    def putcmd(self, cmd):
+        pass
+
+    def getreply(self):
+        return (354, b"go") if self.bytes_sent == 0 else (250, b"queued")
+
+    def send(self, data: bytes):
+        self.bytes_sent += len(data)
+
+
+def build_message(size_mb: int):
+    """Render een notificatie met een origineel van size_mb MB"""
+    handler = NotificationHandler(SMTP_CONFIG, "user@example.com")
+    ocr_result = {
+        "success": True,
+        "text": "Regel met tekst uit de notitie.\n" * 200,
+        "filename": "notitie.pdf",
+        "model": "bench-model",
+        "timestamp": "2025-01-01T00:00:00"
+    }
+
+    async def render():
+        formatted = await handler.format_ocr_result(ocr_result)
+        message = await handler.prepare_email("user@example.com", formatted, "notitie.pdf")
+        # Gewone MIMEApplication: as_string() moet de bijlage ook zien (StreamedAttachment schrijft pas bij DATA)
+        attachment = MIMEApplication(b"%PDF" + b"\0" * (size_mb * 1024 * 1024))
+        attachment.add_header("Content-Disposition", "attachment", filename="notitie.pdf")
+        message.attach(attachment)
+        return message
+
+    return asyncio.run(render())
+
+
+def legacy_serialize(message) -> int:
+    """Wat sendmail(message.as_string()) aan kopieën maakt"""
+    data = message.as_string()
+    data = re.sub(r"(?:\r\n|\n|\r(?!\n))", "\r\n", data).encode("ascii")
+    data = re.sub(rb"(?m)^\.", b"..", data)
+    return len(data)
+
+
+def streaming_serialize(message) -> int:
+    smtp = NullSMTP()
+    stream_message(smtp, SMTP_CONFIG["email"], "user@example.com", message)
+    return smtp.bytes_sent
+
+
+def measure(func: Callable[[], int], rounds: int) -> Dict[str, float]:
+    """Beste tijd over rounds (zonder tracing) en piekgeheugen van één extra run"""
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": peak / (1024 * 1024)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    render = measure(lambda: build_message(args.size_mb) and 0, args.rounds)
+    print(f"render (incl. {args.size_mb} MB bijlage): {render['seconds'] * 1000:8.1f} ms  peak {render['peak_mb']:7.1f} MB")
+
+    message = build_message(args.size_mb)
+    for name, func in (("as_string + sendmail", legacy_serialize), ("BytesGenerator stream", streaming_serialize)):
+        result = measure(lambda: func(message), args.rounds)
+        print(f"{name:<22}: {result['seconds'] * 1000:8.1f} ms  peak {result['peak_mb']:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
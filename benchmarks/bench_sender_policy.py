@@ -0,0 +1,110 @@
+"""
+Micro-benchmark: afzender whitelist met grote allowlists.
+
+Vergelijkt de oude route (From header met de hand parsen, bij elk bericht
+een lowercase lijst opbouwen en lineair zoeken) met core.sender_policy:
+één keer compileren, daarna set lookups, parent-domeinen en één regex.
+Meet bouwtijd en tijd per lookup voor een mix van toegestane en vreemde
+afzenders, inclusief quoted namen met < erin.
+
+Gebruik (vanuit de repo root):
+    python -m benchmarks.bench_sender_policy [--entries 10000] [--lookups 20000] [--rounds 3]
+"""
+
+import time
+import random
+import argparse
+from email.message import Message
+from typing import Callable, List, Tuple
+
+from core.sender_policy import SenderPolicy
+
+
+def build_allowlist(entries: int, rng: random.Random) -> List[str]:
+    """90% adressen, 9% domeinen, 1% subdomein wildcards en een paar patronen"""
+    allowlist = [f"*@org{index}.nl" for index in range(entries * 9 // 100)]
+    allowlist += [f"*@*.corp{index}.com" for index in range(entries // 100)]
+    allowlist += [f"scan-*@office{index}.nl" for index in range(10)]
+    allowlist += [f"User.{index}@Example{index % 500}.com" for index in range(entries - len(allowlist))]
+    rng.shuffle(allowlist)
+    return allowlist
+
+
+def build_headers(count: int, entries: int, rng: random.Random) -> List[str]:
+    """From headers: de helft op de whitelist via adres, domein, subdomein of patroon; de rest vreemd"""
+    headers = []
+    for _ in range(count):
+        kind = rng.randrange(8)
+        if kind == 0:
+            index = rng.randrange(entries // 2, entries)
+            address = f"user.{index}@example{index % 500}.com"
+        elif kind == 1:
+            address = f"jan@org{rng.randrange(entries * 9 // 100)}.nl"
+        elif kind == 2:
+            address = f"piet@mail.corp{rng.randrange(entries // 100)}.com"
+        elif kind == 3:
+            address = f"scan-{rng.randrange(100)}@office{rng.randrange(10)}.nl"
+        else:
+            address = f"stranger{rng.randrange(10 ** 6)}@elsewhere{rng.randrange(1000)}.org"
+        # Quoted namen met < en komma's breken de oude parser
+        name = '"Doe, John <sales>"' if rng.random() < 0.2 else "reMarkable"
+        headers.append(f"{name} <{address}>")
+    return headers
+
+
+def legacy_check(allowed_senders: List[str], header: str) -> bool:
+    """Oude EmailHandler._extract_email_address + _is_allowed_sender"""
+    if "<" in header and ">" in header:
+        sender = header[header.find("<") + 1:header.find(">")].lower().strip()
+    else:
+        sender = header.lower().strip()
+    return sender in [s.lower().strip() for s in allowed_senders]
+
+
+def measure(func: Callable[[], int], rounds: int) -> Tuple[float, int]:
+    """Beste tijd over rounds en het resultaat (aantal toegestaan)"""
+    best, result = float("inf"), 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--legacy-lookups", type=int, default=500, help="de oude route is O(n) per bericht")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    allowlist = build_allowlist(args.entries, rng)
+    headers = build_headers(args.lookups, args.entries, rng)
+    messages = []
+    for value in headers:
+        message = Message()
+        message["From"] = value
+        messages.append(message)
+
+    build, _ = measure(lambda: SenderPolicy(allowlist, require_auth=()) and 0, args.rounds)
+    policy = SenderPolicy(allowlist, require_auth=())
+    print(f"allowlist: {args.entries} regels ({policy.get_stats()})")
+    print(f"SenderPolicy bouwen       : {build * 1000:9.2f} ms")
+
+    legacy_headers = headers[:args.legacy_lookups]
+    legacy, legacy_allowed = measure(lambda: sum(legacy_check(allowlist, h) for h in legacy_headers), args.rounds)
+    compiled, allowed = measure(lambda: sum(policy.check(m).allowed for m in messages), args.rounds)
+    lookups, _ = measure(lambda: sum(policy.is_allowed(h.rpartition("<")[2].rstrip(">")) for h in headers), args.rounds)
+
+    print(f"oud (lijst + lineair)     : {legacy / len(legacy_headers) * 1e6:9.2f} µs/bericht  "
+          f"({legacy_allowed}/{len(legacy_headers)} toegestaan)")
+    print(f"SenderPolicy.check        : {compiled / len(messages) * 1e6:9.2f} µs/bericht  "
+          f"({allowed}/{len(messages)} toegestaan)")
+    print(f"SenderPolicy.is_allowed   : {lookups / len(headers) * 1e6:9.2f} µs/adres")
+
+
+if __name__ == "__main__":
+    main()
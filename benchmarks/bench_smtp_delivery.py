@@ -0,0 +1,124 @@
+"""
+Benchmark: notificaties per seconde tegen een lokale aiosmtpd server.
+
+Vergelijkt de oude route (per bericht een nieuwe smtplib verbinding met
+STARTTLS, login, sendmail(as_string()) en QUIT) met core.smtp_pool: één
+warme sessie per account met een begrensde send queue. Beide routes
+versturen --messages berichten verdeeld over --accounts accounts, die
+tegelijk versturen; de oude route met een thread per account.
+
+De server is de SMTPSink uit benchmarks/fakes.py (STARTTLS + AUTH).
+
+Gebruik (vanuit de repo root, met een tijdelijke DATA_DIR):
+    DATA_DIR=/tmp/bench python -m benchmarks.bench_smtp_delivery [--messages 200] [--accounts 1,4]
+"""
+
+import re
+import time
+import asyncio
+import smtplib
+import argparse
+import tempfile
+from email.message import Message
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.fakes import SMTPSink, HOST, create_certificate, server_ssl_context
+from core.imap_session import get_ssl_context
+from core.notification_handler import NotificationHandler
+from core.smtp_pool import SMTPDeliveryService
+
+RECIPIENT = "notes@bench.local"
+
+
+def smtp_config(account: int, port: int) -> Dict[str, Any]:
+    return {"email": f"user{account:03d}@bench.local", "password": "bench", "smtp_server": HOST, "smtp_port": port}
+
+
+async def build_message(config: Dict[str, Any]) -> Message:
+    """Gewone notificatie zonder bijlage, zoals de workers die versturen"""
+    handler = NotificationHandler(config, RECIPIENT)
+    formatted = await handler.format_ocr_result({
+        "success": True,
+        "text": "Regel met tekst uit de notitie.\n" * 40,
+        "filename": "bench-notitie.pdf",
+        "model": "bench-model",
+        "timestamp": "2025-01-01T00:00:00"
+    })
+    return await handler.prepare_email(RECIPIENT, formatted, "bench-notitie.pdf")
+
+
+def legacy_send(config: Dict[str, Any], message: Message, count: int):
+    """Oude NotificationHandler: elke notificatie een eigen verbinding (blokkerend)"""
+    for _ in range(count):
+        with smtplib.SMTP(config["smtp_server"], config["smtp_port"]) as smtp:
+            smtp.starttls(context=get_ssl_context())
+            smtp.login(config["email"], config["password"])
+            smtp.sendmail(config["email"], RECIPIENT, message.as_string())
+
+
+async def run_legacy(configs: List[Dict[str, Any]], messages: List[Message], per_account: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        asyncio.to_thread(legacy_send, config, message, per_account) for config, message in zip(configs, messages)
+    ))
+    return time.perf_counter() - start
+
+
+async def run_pooled(configs: List[Dict[str, Any]], messages: List[Message], per_account: int) -> Dict[str, Any]:
+    service = SMTPDeliveryService()
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            service.send(config, message, RECIPIENT)
+            for config, message in zip(configs, messages) for _ in range(per_account)
+        ))
+        seconds = time.perf_counter() - start
+        handshakes = sum(session["handshakes"] for session in service.get_stats()["sessions"].values())
+    finally:
+        await service.close()
+    return {"seconds": seconds, "handshakes": handshakes}
+
+
+async def run(args: argparse.Namespace):
+    with tempfile.TemporaryDirectory(prefix="remarkable-smtp-") as tmp:
+        cert_path, key_path = str(Path(tmp) / "cert.pem"), str(Path(tmp) / "key.pem")
+        create_certificate(cert_path, key_path)
+        # Zelfde effect als SSL_CA_FILE, maar de gedeelde context bestaat al
+        get_ssl_context().load_verify_locations(cafile=cert_path)
+
+        sink = SMTPSink(server_ssl_context(cert_path, key_path), re.compile(r"bench-notitie\.pdf"))
+        await asyncio.to_thread(sink.start)
+        try:
+            for accounts in args.accounts:
+                configs = [smtp_config(account, sink.port) for account in range(1, accounts + 1)]
+                messages = [await build_message(config) for config in configs]
+                per_account = max(args.messages // accounts, 1)
+                total = per_account * accounts
+
+                received = sink.messages
+                legacy = await run_legacy(configs, messages, per_account)
+                pooled = await run_pooled(configs, messages, per_account)
+                if sink.messages - received != 2 * total:
+                    print(f"LET OP: sink ontving {sink.messages - received} van {2 * total} berichten")
+
+                print(f"[{accounts} account(s), {total} berichten]")
+                print(f"  verbinding per bericht : {total / legacy:8.1f} berichten/s  ({total} handshakes)")
+                print(f"  smtp_pool              : {total / pooled['seconds']:8.1f} berichten/s  "
+                      f"({pooled['handshakes']} handshakes)")
+        finally:
+            await asyncio.to_thread(sink.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200, help="berichten per route")
+    parser.add_argument("--accounts", type=lambda value: [int(n) for n in value.split(",")], default=[1, 4],
+                        help="aantallen accounts, komma gescheiden (standaard 1,4)")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
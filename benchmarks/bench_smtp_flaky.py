@@ -0,0 +1,128 @@
+"""
+Check: één mislukte notificatie vertraagt de volgende niet.
+
+Verstuurt notificaties via NotificationHandler naar een lokale aiosmtpd
+sink (benchmarks/fakes.py, met STARTTLS en AUTH). Eerst een reeks zonder
+fouten als referentie, dan weigert de sink één DATA met een 451 (tijdelijk)
+en later één met een 550 (permanent), telkens gevolgd door gewone 250's.
+
+Vroeger verdubbelde een mislukte verzending de retry delay van de hele
+handler en wachtte elke volgende notificatie die delay uit. Nu hoort de
+fout direct terug te komen (als NotificationError, permanent alleen bij de
+550) en zijn de verzendingen daarna net zo snel als de referentie. Ook
+hoort de sessie na de fout hergebruikt te worden (RSET, geen nieuwe login).
+
+Faalt (exit code 1) als een verzending na de fout meer dan --max-slowdown
+seconden langzamer is dan de mediaan van de referentie.
+
+Gebruik (vanuit de repo root):
+    python -m benchmarks.bench_smtp_flaky [--messages 20] [--max-slowdown 0.25]
+"""
+
+import re
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from benchmarks.fakes import SMTPSink, HOST, create_certificate, server_ssl_context
+from core.imap_session import get_ssl_context
+from core.notification_handler import NotificationError, NotificationHandler
+from core.smtp_pool import smtp_delivery
+
+ACCOUNT = "bench@bench.local"
+RECIPIENT = "notes@bench.local"
+
+
+def ocr_result(number: int) -> dict:
+    return {
+        "success": True,
+        "text": f"Notitie {number}\n\n" + "Regel met tekst uit de notitie.\n" * 20,
+        "filename": f"bench-{number:04d}.pdf",
+        "model": "bench-model",
+        "timestamp": "2025-01-01T00:00:00"
+    }
+
+
+async def send(handler: NotificationHandler, number: int) -> Tuple[float, Optional[NotificationError]]:
+    """Duur van één verzending en de fout (None bij succes)"""
+    start = time.perf_counter()
+    try:
+        await handler.send_ocr_result(ocr_result(number))
+        error = None
+    except NotificationError as e:
+        error = e
+    return time.perf_counter() - start, error
+
+
+async def send_series(handler: NotificationHandler, first: int, count: int) -> List[float]:
+    durations = []
+    for number in range(first, first + count):
+        duration, error = await send(handler, number)
+        if error is not None:
+            raise RuntimeError(f"Verzending {number} mislukte onverwacht: {error}")
+        durations.append(duration)
+    return durations
+
+
+async def run(args: argparse.Namespace) -> bool:
+    with tempfile.TemporaryDirectory(prefix="remarkable-smtp-") as tmp:
+        cert_path, key_path = str(Path(tmp) / "cert.pem"), str(Path(tmp) / "key.pem")
+        create_certificate(cert_path, key_path)
+        # Zelfde effect als SSL_CA_FILE, maar de gedeelde context bestaat al
+        get_ssl_context().load_verify_locations(cafile=cert_path)
+
+        sink = SMTPSink(server_ssl_context(cert_path, key_path), re.compile(r"bench-\d{4}\.pdf"))
+        await asyncio.to_thread(sink.start)
+        handler = NotificationHandler(
+            {"email": ACCOUNT, "password": "bench", "smtp_server": HOST, "smtp_port": sink.port}, RECIPIENT
+        )
+        ok = True
+        try:
+            baseline = await send_series(handler, 0, args.messages)
+            reference = statistics.median(baseline)
+            print(f"referentie          : mediaan {reference * 1000:7.2f} ms over {len(baseline)} berichten")
+
+            number = args.messages
+            for reply, permanent in (("451 4.3.0 Try again later", False), ("550 5.1.1 Mailbox unavailable", True)):
+                sink.reject_next(reply)
+                duration, error = await send(handler, number)
+                number += 1
+                if error is None or error.permanent != permanent:
+                    print(f"FAIL: {reply[:3]} gaf {error!r}, verwacht NotificationError(permanent={permanent})")
+                    ok = False
+                after = await send_series(handler, number, args.messages)
+                number += args.messages
+                slowest = max(after)
+                print(f"na {reply[:3]} ({duration * 1000:6.2f} ms): mediaan {statistics.median(after) * 1000:7.2f} ms, "
+                      f"langzaamste {slowest * 1000:7.2f} ms")
+                if slowest > reference + args.max_slowdown:
+                    print(f"FAIL: verzending na {reply[:3]} {slowest - reference:.3f}s trager dan de referentie")
+                    ok = False
+
+            stats = smtp_delivery.get_stats()["sessions"].get(ACCOUNT, {})
+            print(f"sessie: {stats.get('handshakes')} handshake(s), {stats.get('reconnects')} reconnect(s), "
+                  f"sink: {sink.messages} afgeleverd, {sink.rejected} geweigerd")
+        finally:
+            await smtp_delivery.close()
+            await asyncio.to_thread(sink.stop)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20, help="berichten per reeks")
+    parser.add_argument("--max-slowdown", type=float, default=0.25,
+                        help="toegestane extra tijd (s) per verzending na een fout")
+    args = parser.parse_args()
+
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
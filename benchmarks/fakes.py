@@ -0,0 +1,541 @@
+"""
+Nep servers voor de load test: IMAP (TLS + IDLE), SMTP sink en OpenRouter.
+
+- FakeIMAPServer: in-memory mailboxes met precies de commando's die
+  EmailHandler gebruikt (LOGIN, SELECT, UID SEARCH/FETCH/STORE, IDLE, NOOP);
+  accounts kunnen "hangen": na LOGIN komt er nooit meer een antwoord
+- SMTPSink: aiosmtpd met STARTTLS en AUTH; noteert per notificatie welke
+  documenten erin staan en wanneer hij binnenkwam, en kan DATA met vooraf
+  ingestelde antwoorden (bijv. een 451) weigeren
+- MockOpenRouter: /chat/completions met instelbare latency, foutpercentage
+  en 429's (met Retry-After)
+
+IMAP en OpenRouter draaien als asyncio servers in de event loop van de
+harness, de SMTP sink in zijn eigen thread (aiosmtpd Controller).
+"""
+
+import re
+import ssl
+import json
+import time
+import email
+import random
+import socket
+import logging
+import asyncio
+import datetime
+import ipaddress
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+try:
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+except ImportError:
+    Controller = AuthResult = None
+
+HOST = "127.0.0.1"
+
+
+def create_certificate(cert_path: str, key_path: str):
+    """Self-signed certificaat voor 127.0.0.1/localhost (voor SSL_CA_FILE van de worker)"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([
+            x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address(HOST))
+        ]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+
+
+def free_port() -> int:
+    """Vrije TCP poort (aiosmtpd's Controller kan niet zelf op poort 0 binden)"""
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def server_ssl_context(cert_path: str, key_path: str) -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+@dataclass
+class FakeMessage:
+    uid: int
+    data: bytes
+    sender: str
+    bodystructure: str
+    sections: Dict[str, bytes]
+    seen: bool = False
+
+
+def build_message(sender: str, recipient: str, subject: str, text: str,
+                  attachments: List[Tuple[str, str, bytes]]) -> Tuple[bytes, str, Dict[str, bytes]]:
+    """multipart/mixed bericht met een tekst part en base64 attachments.
+
+    Returns:
+        tuple: (RFC822 bytes, BODYSTRUCTURE, {sectie: body bytes})
+    """
+    boundary = f"=_bench_{random.getrandbits(64):016x}"
+    text_body = text.replace("\n", "\r\n").encode("utf-8")
+    lines = text_body.count(b"\n") + 1
+    parts = [(
+        b"Content-Type: text/plain; charset=utf-8\r\nContent-Transfer-Encoding: 7bit\r\n",
+        text_body,
+        f'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" {len(text_body)} {lines} NIL NIL NIL NIL)'
+    )]
+    for filename, content_type, data in attachments:
+        encoded = email.base64mime.body_encode(data, maxlinelen=76).replace("\n", "\r\n").encode("ascii")
+        main_type, sub_type = content_type.upper().split("/")
+        parts.append((
+            f'Content-Type: {content_type}; name="{filename}"\r\n'
+            f'Content-Disposition: attachment; filename="{filename}"\r\n'
+            f"Content-Transfer-Encoding: base64\r\n".encode("ascii"),
+            encoded,
+            f'("{main_type}" "{sub_type}" ("NAME" {_quote(filename)}) NIL NIL "BASE64" {len(encoded)} NIL '
+            f'("ATTACHMENT" ("FILENAME" {_quote(filename)})) NIL NIL)'
+        ))
+
+    headers = (
+        f"From: reMarkable <{sender}>\r\n"
+        f"To: {recipient}\r\n"
+        f"Subject: {subject}\r\n"
+        f"Date: {email.utils.formatdate(localtime=True)}\r\n"
+        f"Message-ID: {email.utils.make_msgid(domain='bench.local')}\r\n"
+        f"MIME-Version: 1.0\r\n"
+        f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'
+    ).encode("ascii")
+    chunks = [headers]
+    for part_headers, body, _ in parts:
+        chunks.append(f"--{boundary}\r\n".encode("ascii") + part_headers + b"\r\n" + body + b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+
+    bodystructure = "(" + "".join(structure for _, _, structure in parts) + f' "MIXED" ("BOUNDARY" {_quote(boundary)}) NIL NIL NIL)'
+    sections = {str(index): body for index, (_, body, _) in enumerate(parts, start=1)}
+    return b"".join(chunks), bodystructure, sections
+
+
+class _Mailbox:
+    def __init__(self, password: str):
+        self.password = password
+        self.uidvalidity = 1
+        self.messages: List[FakeMessage] = []
+        self.next_uid = 1
+        self.idlers: Set[asyncio.StreamWriter] = set()
+
+    def seq(self, uid: int) -> Tuple[int, Optional[FakeMessage]]:
+        for index, message in enumerate(self.messages, start=1):
+            if message.uid == uid:
+                return index, message
+        return 0, None
+
+
+_ARG_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+_SECTION_PATTERN = re.compile(r"BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", re.IGNORECASE)
+
+
+class FakeIMAPServer:
+    """IMAP4rev1 server (alleen INBOX) voor de commando's van EmailHandler"""
+
+    def __init__(self, ssl_context: ssl.SSLContext):
+        self.ssl_context = ssl_context
+        self.mailboxes: Dict[str, _Mailbox] = {}
+        self.hanging: Set[str] = set()
+        self.port = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # Statistieken
+        self.connections = 0
+        self.logins = 0
+        self.hung_sessions = 0
+        self.bytes_sent = 0  # antwoorden op commando's (zonder TLS overhead)
+        self.commands: Counter = Counter()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, HOST, 0, ssl=self.ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for mailbox in self.mailboxes.values():
+                for writer in list(mailbox.idlers):
+                    writer.close()
+
+    def add_account(self, user: str, password: str, hang: bool = False):
+        """Account toevoegen; met hang=True blijft elke sessie na LOGIN zonder antwoord"""
+        self.mailboxes[user] = _Mailbox(password)
+        if hang:
+            self.hanging.add(user)
+
+    def idling(self) -> Set[str]:
+        """Accounts met minstens één verbinding in IDLE"""
+        return {user for user, mailbox in self.mailboxes.items() if mailbox.idlers}
+
+    def append(self, user: str, data: bytes, sender: str, bodystructure: str, sections: Dict[str, bytes]) -> int:
+        """Lever een bericht af (ongelezen) en meld het aan verbindingen in IDLE"""
+        mailbox = self.mailboxes[user]
+        message = FakeMessage(mailbox.next_uid, data, sender, bodystructure, sections)
+        mailbox.next_uid += 1
+        mailbox.messages.append(message)
+        for writer in list(mailbox.idlers):
+            writer.write(f"* {len(mailbox.messages)} EXISTS\r\n".encode("ascii"))
+        return message.uid
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        session = {"user": None, "exists": 0}
+        writer.write(b"* OK [CAPABILITY IMAP4rev1 IDLE AUTH=PLAIN] Fake IMAP ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tag, _, rest = line.decode("utf-8", "replace").rstrip("\r\n").partition(" ")
+                command, _, arguments = rest.partition(" ")
+                command = command.upper()
+                if command == "UID":
+                    sub_command, _, arguments = arguments.partition(" ")
+                    command = f"UID {sub_command.upper()}"
+                self.commands[command] += 1
+
+                if command == "LOGOUT":
+                    writer.write(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n".encode("ascii"))
+                    await writer.drain()
+                    break
+                if command == "IDLE":
+                    await self._idle(tag, session, reader, writer)
+                else:
+                    response = self._dispatch(tag, command, arguments, session)
+                    self.bytes_sent += len(response)
+                    writer.write(response)
+                await writer.drain()
+                if session["user"] in self.hanging:
+                    await self._hang(reader)
+                    break
+        except (ConnectionError, ssl.SSLError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            mailbox = self.mailboxes.get(session["user"])
+            if mailbox is not None:
+                mailbox.idlers.discard(writer)
+            writer.close()
+
+    async def _hang(self, reader: asyncio.StreamReader):
+        """Lees alles en antwoord nooit meer, tot de client de verbinding sluit"""
+        self.hung_sessions += 1
+        while await reader.read(65536):
+            pass
+
+    async def _idle(self, tag: str, session: Dict[str, Any], reader: asyncio.StreamReader,
+                    writer: asyncio.StreamWriter):
+        mailbox = self.mailboxes[session["user"]]
+        writer.write(b"+ idling\r\n")
+        pending = self._pending_exists(session)
+        if pending:
+            writer.write(pending)
+        mailbox.idlers.add(writer)
+        try:
+            line = await reader.readline()
+        finally:
+            mailbox.idlers.discard(writer)
+        session["exists"] = len(mailbox.messages)
+        if line.strip().upper() == b"DONE":
+            writer.write(f"{tag} OK IDLE terminated\r\n".encode("ascii"))
+        else:
+            writer.write(f"{tag} BAD expected DONE\r\n".encode("ascii"))
+
+    def _pending_exists(self, session: Dict[str, Any]) -> bytes:
+        """Untagged EXISTS voor berichten die na het vorige commando binnenkwamen"""
+        mailbox = self.mailboxes.get(session["user"])
+        if mailbox is None or len(mailbox.messages) == session["exists"]:
+            return b""
+        session["exists"] = len(mailbox.messages)
+        return f"* {session['exists']} EXISTS\r\n".encode("ascii")
+
+    def _dispatch(self, tag: str, command: str, arguments: str, session: Dict[str, Any]) -> bytes:
+        if command == "CAPABILITY":
+            return f"* CAPABILITY IMAP4rev1 IDLE AUTH=PLAIN\r\n{tag} OK CAPABILITY completed\r\n".encode("ascii")
+        if command == "NOOP":
+            return self._pending_exists(session) + f"{tag} OK NOOP completed\r\n".encode("ascii")
+        if command == "LOGIN":
+            args = [quoted or plain for quoted, plain in _ARG_PATTERN.findall(arguments)]
+            mailbox = self.mailboxes.get(args[0]) if len(args) == 2 else None
+            if mailbox is None or mailbox.password != args[1].replace('\\"', '"').replace("\\\\", "\\"):
+                return f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n".encode("ascii")
+            self.logins += 1
+            session["user"] = args[0]
+            return f"{tag} OK LOGIN completed\r\n".encode("ascii")
+        if session["user"] is None:
+            return f"{tag} BAD not authenticated\r\n".encode("ascii")
+
+        mailbox = self.mailboxes[session["user"]]
+        if command in ("SELECT", "EXAMINE"):
+            session["exists"] = len(mailbox.messages)
+            return (
+                f"* FLAGS (\\Seen)\r\n* {session['exists']} EXISTS\r\n* 0 RECENT\r\n"
+                f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                f"* OK [UIDNEXT {mailbox.next_uid}] Predicted next UID\r\n"
+                f"{tag} OK [READ-WRITE] SELECT completed\r\n"
+            ).encode("ascii")
+        if command == "UID SEARCH":
+            return self._pending_exists(session) + self._search(tag, mailbox, arguments.upper())
+        if command == "UID FETCH":
+            return self._pending_exists(session) + self._fetch(tag, mailbox, arguments)
+        if command == "UID STORE":
+            uid, _, flags = arguments.partition(" ")
+            seq, message = mailbox.seq(int(uid))
+            if message is None:
+                return f"{tag} OK STORE completed\r\n".encode("ascii")
+            if "\\SEEN" in flags.upper():
+                message.seen = not flags.startswith("-")
+            flags = "\\Seen" if message.seen else ""
+            return f"* {seq} FETCH (UID {message.uid} FLAGS ({flags}))\r\n{tag} OK STORE completed\r\n".encode("ascii")
+        if command == "CLOSE":
+            return f"{tag} OK CLOSE completed\r\n".encode("ascii")
+        return f"{tag} BAD unsupported command {command}\r\n".encode("ascii")
+
+    def _search(self, tag: str, mailbox: _Mailbox, criteria: str) -> bytes:
+        messages = mailbox.messages
+        if criteria == "UNSEEN":
+            uids = [message.uid for message in messages if not message.seen]
+        elif criteria.startswith("UID "):
+            low = int(criteria[4:].split(":", 1)[0])
+            uids = [message.uid for message in messages if message.uid >= low]
+            # RFC 3501: n:* bevat altijd het hoogste bericht
+            if not uids and messages:
+                uids = [messages[-1].uid]
+        else:
+            uids = [message.uid for message in messages]
+        result = "".join(f" {uid}" for uid in uids)
+        return f"* SEARCH{result}\r\n{tag} OK SEARCH completed\r\n".encode("ascii")
+
+    def _fetch(self, tag: str, mailbox: _Mailbox, arguments: str) -> bytes:
+        uid, _, items = arguments.partition(" ")
+        seq, message = mailbox.seq(int(uid))
+        if message is None:
+            return f"{tag} OK FETCH completed\r\n".encode("ascii")
+
+        chunks = [f"* {seq} FETCH (UID {message.uid}".encode("ascii")]
+        for section, start, length in _SECTION_PATTERN.findall(items):
+            if section.upper().startswith("HEADER.FIELDS"):
+                data = f"From: reMarkable <{message.sender}>\r\n\r\n".encode("ascii")
+            elif section == "":
+                data = message.data
+            else:
+                data = message.sections.get(section, b"")
+            origin = ""
+            if start:
+                # Partial fetch: BODY[2]<0.12> geeft BODY[2]<0> terug
+                data = data[int(start):int(start) + int(length)]
+                origin = f"<{start}>"
+            chunks.append(f" BODY[{section}]{origin} {{{len(data)}}}\r\n".encode("ascii") + data)
+        if "BODYSTRUCTURE" in items.upper():
+            chunks.append(f" BODYSTRUCTURE {message.bodystructure}".encode("ascii"))
+        if re.search(r"\bRFC822\b", items, re.IGNORECASE):
+            chunks.append(f" RFC822 {{{len(message.data)}}}\r\n".encode("ascii") + message.data)
+            message.seen = True
+        chunks.append(f")\r\n{tag} OK FETCH completed\r\n".encode("ascii"))
+        return b"".join(chunks)
+
+
+class MockOpenRouter:
+    """HTTP/1.1 keep-alive server die OpenRouter chat completions nadoet"""
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.25, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.port = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # Statistieken
+        self.connections = 0
+        self.requests = 0
+        self.request_bytes = 0
+        self.responses: Counter = Counter()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{HOST}:{self.port}/api/v1"
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, HOST, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                if headers.get("transfer-encoding", "").lower() == "chunked":
+                    while True:
+                        size = int((await reader.readline()).split(b";")[0], 16)
+                        await reader.readexactly(size + 2)
+                        self.request_bytes += size
+                        if size == 0:
+                            break
+                else:
+                    length = int(headers.get("content-length", "0"))
+                    await reader.readexactly(length)
+                    self.request_bytes += length
+
+                self.requests += 1
+                status, extra_headers, body = await self._respond()
+                self.responses[status] += 1
+                head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                        "Content-Type: application/json", f"Content-Length: {len(body)}"]
+                head.extend(f"{name}: {value}" for name, value in extra_headers.items())
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("ascii") + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self) -> Tuple[int, Dict[str, str], bytes]:
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            body = {"error": {"code": 429, "message": "Rate limit exceeded"}}
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, json.dumps(body).encode("utf-8")
+
+        await asyncio.sleep(max(self.random.gauss(self.latency, self.latency * self.jitter), 0.0))
+        if roll < self.rate_limit_rate + self.error_rate:
+            body = {"error": {"code": 502, "message": "Upstream provider error"}}
+            return 502, {}, json.dumps(body).encode("utf-8")
+
+        text = "Boodschappen voor het weekend\n\n" + "Melk, brood, kaas en appels.\n" * self.random.randint(3, 12)
+        body = {
+            "id": f"gen-bench-{self.requests}",
+            "model": "google/gemini-2.5-flash",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": 1290, "completion_tokens": len(text) // 4, "total_tokens": 1290 + len(text) // 4}
+        }
+        return 200, {}, json.dumps(body).encode("utf-8")
+
+
+class _SinkHandler:
+    def __init__(self, sink: "SMTPSink"):
+        self.sink = sink
+
+    async def handle_DATA(self, server, session, envelope):
+        reply = self.sink.next_reply()
+        if reply is not None:
+            return reply
+        self.sink.record(envelope.content)
+        return "250 Message accepted"
+
+
+class SMTPSink:
+    """aiosmtpd server die notificaties accepteert en per document de ontvangsttijd noteert"""
+
+    def __init__(self, ssl_context: ssl.SSLContext, document_pattern: "re.Pattern[str]"):
+        if Controller is None:
+            raise RuntimeError("aiosmtpd is niet geïnstalleerd (pip install -r requirements-dev.txt)")
+        self.ssl_context = ssl_context
+        self.document_pattern = document_pattern
+        self.received: Dict[str, float] = {}  # document → eerste notificatie (epoch)
+        self.replies: Deque[str] = deque()  # antwoorden op de volgende DATA commando's, bijv. "451 4.3.0 Try again"
+        self.messages = 0
+        self.rejected = 0
+        self.bytes = 0
+        self.port = 0
+        self._lock = threading.Lock()
+        self._controller = None
+
+    def start(self) -> int:
+        # aiosmtpd waarschuwt bij elke AUTH over zijn eigen (deprecated) login_data
+        logging.getLogger("mail.log").setLevel(logging.ERROR)
+        self.port = free_port()
+        self._controller = Controller(
+            _SinkHandler(self), hostname=HOST, port=self.port,
+            tls_context=self.ssl_context, require_starttls=True,
+            authenticator=lambda *args: AuthResult(success=True), auth_require_tls=True
+        )
+        self._controller.start()
+        return self.port
+
+    def stop(self):
+        if self._controller is not None:
+            self._controller.stop()
+
+    def reject_next(self, *replies: str):
+        """Beantwoord de volgende DATA commando's met deze antwoorden in plaats van 250"""
+        with self._lock:
+            self.replies.extend(replies)
+
+    def next_reply(self) -> Optional[str]:
+        with self._lock:
+            if not self.replies:
+                return None
+            self.rejected += 1
+            return self.replies.popleft()
+
+    def record(self, content: bytes):
+        received = time.time()
+        message = email.message_from_bytes(content)
+        found = set(self.document_pattern.findall(str(message.get("Subject", ""))))
+        for part in message.walk():
+            filename = part.get_filename()
+            if filename:
+                found.update(self.document_pattern.findall(filename))
+            elif part.get_content_maintype() == "text":
+                found.update(self.document_pattern.findall(part.get_payload(decode=True).decode("utf-8", "replace")))
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(content)
+            for document in found:
+                self.received.setdefault(document, received)
+
+    def delivered(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.received)
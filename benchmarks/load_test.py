@@ -0,0 +1,454 @@
+"""
+Load test: de volledige pijplijn (worker.py) tegen nep IMAP, SMTP en OpenRouter.
+
+Per scenario (aantal gebruikers) draait een vers worker proces met een eigen
+DATA_DIR. De harness levert synthetische reMarkable PDF's/PNG's af in de nep
+IMAP mailboxes (benchmarks/fakes.py) en meet per document de tijd van
+aflevering tot de notificatie bij de SMTP sink binnen is. Daarnaast worden
+RSS, open sockets en file descriptors van het worker proces bemonsterd.
+
+Met --rate 0 (standaard) staat alles al in de mailboxes voordat de worker
+start (achterstand wegwerken, inclusief opstarten en inloggen); met --rate N
+komen er N documenten per minuut binnen nadat alle mailboxes in IDLE staan.
+
+Met --hanging-accounts N komen er N accounts bij waarvan de nep IMAP server
+na LOGIN nooit meer antwoordt. Zij krijgen geen documenten; de meting laat
+zien of zo'n mailbox de checks van de andere accounts ophoudt. Met
+--max-latency S faalt de run (exit code 1) als een document niet aankomt of
+er langer dan S seconden over doet.
+
+Het resultaat gaat als JSON naar benchmarks/results/ (of --output); geef met
+--compare een eerder resultaat mee voor een vergelijking per scenario.
+Instellingen van de worker (JOB_WORKERS, OPENROUTER_RATE, OCR_MAX_CONCURRENCY,
+NOTIFICATION_DIGEST, ...) gaan gewoon via de omgeving.
+
+Gebruik (vanuit de repo root):
+    python -m benchmarks.load_test [--users 1,10,100] [--docs-per-user 10] [--rate 0]
+        [--ocr-latency 1.0] [--error-rate 0.0] [--rate-limit-rate 0.0] [--compare vorige.json]
+        [--hanging-accounts 0] [--max-latency S]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.fakes import FakeIMAPServer, MockOpenRouter, SMTPSink, build_message, create_certificate, HOST, server_ssl_context
+from benchmarks.synthetic import DocumentFactory
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+
+ALLOWED_SENDER = "my@remarkable.com"
+DOCUMENT_PATTERN = re.compile(r"bench-u\d{3}-d\d{4}\.(?:pdf|png)")
+
+SAMPLE_INTERVAL = 0.25  # seconds
+READY_TIMEOUT = 120  # seconds, tot alle mailboxes in IDLE staan (--rate)
+SHUTDOWN_TIMEOUT = 30  # seconds
+
+# Worker instellingen die in het resultaat komen (als ze gezet zijn)
+REPORTED_ENV = (
+    "JOB_WORKERS", "OCR_MAX_CONCURRENCY", "OCR_MAX_PER_KEY", "OPENROUTER_RATE", "OPENROUTER_BURST",
+    "OCR_SPLIT_PDF", "OCR_CACHE_ENABLED", "NOTIFICATION_DIGEST", "NOTIFICATION_ATTACHMENTS",
+    "IO_MAX_WORKERS", "HTTP_MAX_CONNECTIONS", "SMTP_MAX_CONNECTIONS", "IMAP_TIMEOUT", "POLL_HOST_MAX_CONCURRENCY"
+)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentiel met lineaire interpolatie (q tussen 0 en 100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def sample_process(pid: int) -> Dict[str, int]:
+    """RSS (bytes), open sockets, file descriptors en threads van een proces"""
+    if psutil is not None:
+        process = psutil.Process(pid)
+        connections = getattr(process, "net_connections", None) or process.connections
+        return {
+            "rss": process.memory_info().rss,
+            "sockets": len(connections(kind="inet")),
+            "fds": process.num_fds() if hasattr(process, "num_fds") else process.num_handles(),
+            "threads": process.num_threads()
+        }
+
+    status = _proc_status(pid)
+    fd_dir = f"/proc/{pid}/fd"
+    targets = []
+    for fd in os.listdir(fd_dir):
+        try:
+            targets.append(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            pass
+    return {
+        "rss": status.get("VmRSS", 0),
+        "sockets": sum(1 for target in targets if target.startswith("socket:")),
+        "fds": len(targets),
+        "threads": status.get("Threads", 0)
+    }
+
+
+def _proc_status(pid: int) -> Dict[str, int]:
+    """Numerieke velden uit /proc/<pid>/status (kB velden als bytes); leeg buiten Linux"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                fields = value.split()
+                if fields and fields[0].isdigit():
+                    values[key] = int(fields[0]) * (1024 if fields[-1] == "kB" else 1)
+    except OSError:
+        pass
+    return values
+
+
+class ResourceSampler:
+    """Bemonstert een proces periodiek en houdt de pieken bij"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peaks = {"rss": 0, "sockets": 0, "fds": 0, "threads": 0}
+        self.samples = 0
+
+    async def run(self):
+        while True:
+            try:
+                sample = await asyncio.to_thread(sample_process, self.pid)
+            except Exception:
+                return  # proces is weg
+            self.samples += 1
+            for key, value in sample.items():
+                self.peaks[key] = max(self.peaks[key], value)
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def finish(self):
+        """Neem de echte RSS piek (VmHWM) mee zolang het proces nog leeft"""
+        self.peaks["rss"] = max(self.peaks["rss"], _proc_status(self.pid).get("VmHWM", 0))
+
+
+def setup_accounts(path: str):
+    """Zet de bench accounts in de state store van DATA_DIR en zet polling aan (in een subprocess)"""
+    from config.app_config import set_polling_active, set_user_config
+
+    with open(path) as f:
+        accounts = json.load(f)
+    for config in accounts:
+        set_user_config(config["email"], config)
+        set_polling_active(config["email"], True)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_scenario(args: argparse.Namespace, users: int, workdir: Path) -> Dict[str, Any]:
+    """Eén scenario: servers starten, worker draaien tot alles afgeleverd is, resultaten verzamelen"""
+    data_dir = workdir / f"users-{users}"
+    data_dir.mkdir(parents=True)
+    cert_path, key_path = str(workdir / "cert.pem"), str(workdir / "key.pem")
+    ssl_context = server_ssl_context(cert_path, key_path)
+
+    imap = FakeIMAPServer(ssl_context)
+    openrouter = MockOpenRouter(
+        latency=args.ocr_latency, jitter=args.ocr_jitter, error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed
+    )
+    sink = SMTPSink(ssl_context, DOCUMENT_PATTERN)
+    await imap.start()
+    await openrouter.start()
+    await asyncio.to_thread(sink.start)
+
+    accounts = []
+    for user in range(1, users + args.hanging_accounts + 1):
+        address = f"user{user:03d}@bench.local"
+        imap.add_account(address, f"bench-{user}", hang=user > users)
+        accounts.append({
+            "email": address,
+            "password": f"bench-{user}",
+            "imap_server": HOST,
+            "imap_port": imap.port,
+            "smtp_server": HOST,
+            "smtp_port": sink.port,
+            "allowed_senders": [ALLOWED_SENDER],
+            "openrouter_api_key": f"sk-bench-{user}",
+            "notification_email": f"notes{user:03d}@bench.local",
+            "status": "polling"
+        })
+    accounts_path = data_dir / "accounts.json"
+    accounts_path.write_text(json.dumps(accounts))
+
+    env = dict(os.environ)
+    env.update(
+        DATA_DIR=str(data_dir),
+        APP_MODE="worker",
+        SSL_CA_FILE=cert_path,
+        OPENROUTER_BASE_URL=openrouter.base_url
+    )
+    setup = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.load_test", "--setup-accounts", str(accounts_path), cwd=REPO_ROOT, env=env
+    )
+    if await setup.wait() != 0:
+        raise RuntimeError("Accounts aanmaken in de state store mislukt")
+
+    # Berichten vooraf opbouwen, zodat het genereren niet in de meting zit
+    factory = DocumentFactory(seed=args.seed, pages=args.pages, png_ratio=args.png_ratio)
+    deliveries: List[Tuple[str, str, Tuple[bytes, str, Dict[str, bytes]]]] = []
+    for index in range(args.docs_per_user):
+        for user, account in enumerate(accounts[:users], start=1):
+            filename, content_type, data = factory.make(user, index)
+            message = build_message(ALLOWED_SENDER, account["email"], f"reMarkable: {filename}",
+                                    "Verstuurd vanaf mijn reMarkable", [(filename, content_type, data)])
+            deliveries.append((account["email"], filename, message))
+
+    arrivals: Dict[str, float] = {}
+
+    def deliver(address: str, filename: str, message: Tuple[bytes, str, Dict[str, bytes]]):
+        arrivals[filename] = time.time()
+        imap.append(address, message[0], ALLOWED_SENDER, message[1], message[2])
+
+    if not args.rate:
+        for delivery in deliveries:
+            deliver(*delivery)
+
+    log_path = data_dir / "worker.log"
+    with open(log_path, "wb") as log:
+        worker = await asyncio.create_subprocess_exec(
+            sys.executable, "worker.py", cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    sampler = ResourceSampler(worker.pid)
+    sampler_task = asyncio.create_task(sampler.run())
+    print(f"[{users} users] worker pid {worker.pid}, {len(deliveries)} documents, log {log_path}", flush=True)
+
+    try:
+        if args.rate:
+            deadline = time.monotonic() + READY_TIMEOUT
+            while len(imap.idling()) < users:
+                if time.monotonic() > deadline or worker.returncode is not None:
+                    raise RuntimeError(f"Only {len(imap.idling())}/{users} mailboxes reached IDLE")
+                await asyncio.sleep(SAMPLE_INTERVAL)
+            interval = 60.0 / args.rate
+            started = time.monotonic()
+            for number, delivery in enumerate(deliveries):
+                await asyncio.sleep(max(started + number * interval - time.monotonic(), 0))
+                deliver(*delivery)
+
+        # Wachten tot alles afgeleverd is, de worker stopt of er te lang niets gebeurt
+        deadline = time.monotonic() + args.timeout
+        last_progress, delivered = time.monotonic(), 0
+        while delivered < len(deliveries) and worker.returncode is None:
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            count = len(sink.delivered())
+            if count > delivered:
+                last_progress, delivered = time.monotonic(), count
+            if time.monotonic() > deadline or time.monotonic() - last_progress > args.stall_timeout:
+                print(f"[{users} users] giving up with {delivered}/{len(deliveries)} delivered", flush=True)
+                break
+    finally:
+        sampler.finish()
+        sampler_task.cancel()
+        if worker.returncode is None:
+            worker.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(worker.wait(), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                worker.kill()
+                await worker.wait()
+        await imap.stop()
+        await openrouter.stop()
+        await asyncio.to_thread(sink.stop)
+
+    received = sink.delivered()
+    latencies = [received[name] - arrivals[name] for name in received if name in arrivals]
+    duration = (max(received.values()) - min(arrivals.values())) if received else 0.0
+    return {
+        "users": users,
+        "hanging_accounts": args.hanging_accounts,
+        "documents": len(deliveries),
+        "delivered": len(latencies),
+        "missing": len(deliveries) - len(latencies),
+        "duration_seconds": round(duration, 3),
+        "documents_per_minute": round(len(latencies) / duration * 60, 2) if duration else 0.0,
+        "latency_seconds": {
+            "p50": _round(percentile(latencies, 50)),
+            "p95": _round(percentile(latencies, 95)),
+            "p99": _round(percentile(latencies, 99)),
+            "mean": _round(sum(latencies) / len(latencies) if latencies else None),
+            "max": _round(max(latencies, default=None))
+        },
+        "peak_rss_mb": round(sampler.peaks["rss"] / (1024 * 1024), 1),
+        "peak_open_sockets": sampler.peaks["sockets"],
+        "peak_open_files": sampler.peaks["fds"],
+        "peak_threads": sampler.peaks["threads"],
+        "openrouter": {
+            "requests": openrouter.requests,
+            "connections": openrouter.connections,
+            "request_mb": round(openrouter.request_bytes / (1024 * 1024), 1),
+            "responses": {str(status): count for status, count in sorted(openrouter.responses.items())}
+        },
+        "imap": {"connections": imap.connections, "logins": imap.logins, "hung_sessions": imap.hung_sessions,
+                 "commands": dict(imap.commands)},
+        "smtp": {"messages": sink.messages, "mb": round(sink.bytes / (1024 * 1024), 1)},
+        "worker_exit_code": worker.returncode,
+        "worker_log": str(log_path)
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+def check_latency(scenario: Dict[str, Any], max_latency: float) -> List[str]:
+    """Overtredingen van --max-latency: ontbrekende documenten of een te trage aflevering"""
+    problems = []
+    if scenario["missing"]:
+        problems.append(f"{scenario['missing']} documents not delivered")
+    slowest = scenario["latency_seconds"]["max"]
+    if slowest is not None and slowest > max_latency:
+        problems.append(f"max latency {slowest}s > {max_latency:g}s")
+    return problems
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print per scenario de verschillen met een eerder resultaat"""
+    previous = {scenario["users"]: scenario for scenario in baseline.get("scenarios", [])}
+
+    def change(old: Optional[float], new: Optional[float]) -> str:
+        if old is None or new is None:
+            return f"{old} -> {new}"
+        delta = f" ({(new - old) / old * 100:+.1f}%)" if old else ""
+        return f"{old:g} -> {new:g}{delta}"
+
+    print(f"\nCompared to {baseline.get('created')} ({baseline.get('git_commit')}):")
+    for scenario in report["scenarios"]:
+        old = previous.get(scenario["users"])
+        if old is None:
+            print(f"  {scenario['users']:>3} users: no baseline")
+            continue
+        print(f"  {scenario['users']:>3} users: docs/min {change(old['documents_per_minute'], scenario['documents_per_minute'])}, "
+              f"p95 {change(old['latency_seconds']['p95'], scenario['latency_seconds']['p95'])} s, "
+              f"peak RSS {change(old['peak_rss_mb'], scenario['peak_rss_mb'])} MB, "
+              f"sockets {change(old['peak_open_sockets'], scenario['peak_open_sockets'])}")
+
+
+def print_summary(scenario: Dict[str, Any]):
+    latency = scenario["latency_seconds"]
+    print(
+        f"[{scenario['users']} users] {scenario['delivered']}/{scenario['documents']} delivered in "
+        f"{scenario['duration_seconds']:.1f}s: {scenario['documents_per_minute']:.1f} docs/min, "
+        f"latency p50 {latency['p50']}s p95 {latency['p95']}s p99 {latency['p99']}s, "
+        f"peak RSS {scenario['peak_rss_mb']} MB, peak sockets {scenario['peak_open_sockets']}",
+        flush=True
+    )
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            key: getattr(args, key) for key in (
+                "docs_per_user", "pages", "png_ratio", "rate", "ocr_latency", "ocr_jitter",
+                "error_rate", "rate_limit_rate", "retry_after", "seed", "hanging_accounts", "max_latency"
+            )
+        },
+        "env": {key: os.environ[key] for key in REPORTED_ENV if key in os.environ},
+        "scenarios": []
+    }
+    with tempfile.TemporaryDirectory(prefix="remarkable-load-") as tmp:
+        workdir = Path(tmp)
+        create_certificate(str(workdir / "cert.pem"), str(workdir / "key.pem"))
+        for users in args.users:
+            scenario = await run_scenario(args, users, workdir)
+            if args.keep_logs:
+                scenario["worker_log"] = _keep_log(scenario["worker_log"], users)
+            report["scenarios"].append(scenario)
+            print_summary(scenario)
+    return report
+
+
+def _keep_log(path: str, users: int) -> str:
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    target = RESULTS_DIR / f"worker-{users}-users.log"
+    target.write_bytes(Path(path).read_bytes())
+    return str(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=lambda value: [int(n) for n in value.split(",")], default=[1, 10, 100],
+                        help="scenario's als aantallen gebruikers, komma gescheiden (standaard 1,10,100)")
+    parser.add_argument("--docs-per-user", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=2, help="pagina's per PDF")
+    parser.add_argument("--png-ratio", type=float, default=0.25, help="aandeel PNG's (rest is PDF)")
+    parser.add_argument("--rate", type=float, default=0, help="documenten per minuut; 0 = alles vooraf in de mailbox")
+    parser.add_argument("--ocr-latency", type=float, default=1.0, help="gemiddelde OpenRouter latency (s)")
+    parser.add_argument("--ocr-jitter", type=float, default=0.25, help="standaardafwijking als fractie van de latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fractie 502 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fractie 429 responses")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After bij 429 (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--hanging-accounts", type=int, default=0,
+                        help="extra accounts waarvan de IMAP server na LOGIN niet meer antwoordt")
+    parser.add_argument("--max-latency", type=float,
+                        help="faal als een document niet of pas na zoveel seconden afgeleverd is")
+    parser.add_argument("--timeout", type=float, default=900, help="maximale duur per scenario (s)")
+    parser.add_argument("--stall-timeout", type=float, default=120, help="opgeven na zo lang zonder nieuwe aflevering (s)")
+    parser.add_argument("--output", help="JSON resultaat (standaard benchmarks/results/load_test-<tijd>.json)")
+    parser.add_argument("--compare", help="eerder JSON resultaat om mee te vergelijken")
+    parser.add_argument("--keep-logs", action="store_true", help="worker logs naar benchmarks/results/ kopiëren")
+    parser.add_argument("--setup-accounts", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.setup_accounts:
+        setup_accounts(args.setup_accounts)
+        return
+
+    report = asyncio.run(run(args))
+    output = Path(args.output) if args.output else RESULTS_DIR / f"load_test-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    if args.max_latency is not None:
+        failed = False
+        for scenario in report["scenarios"]:
+            for problem in check_latency(scenario, args.max_latency):
+                print(f"[{scenario['users']} users] FAIL: {problem}", flush=True)
+                failed = True
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
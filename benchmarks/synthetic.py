@@ -0,0 +1,143 @@
+"""
+Synthetische reMarkable exports voor de benchmarks.
+
+PDF's zoals de tablet ze exporteert (vectorstrepen per pagina, FlateDecode)
+en PNG's op schermresolutie (1404x1872, grijswaarden). De strepen worden per
+variant één keer gegenereerd; elk document (en elke PDF pagina) krijgt
+daarnaast een eigen ID, zodat de bytes en dus de OCR cache keys verschillen.
+"""
+
+import zlib
+import struct
+import random
+from typing import Dict, List, Tuple
+
+# reMarkable 2 PDF export (punten) en schermresolutie (pixels)
+PDF_PAGE_SIZE = (445, 594)
+PNG_SIZE = (1404, 1872)
+
+STROKES_PER_PAGE = 120
+POINTS_PER_STROKE = 40
+
+
+def _strokes(rng: random.Random, width: float, height: float) -> List[List[Tuple[float, float]]]:
+    """Willekeurige 'handschrift' strepen als random walks, regel voor regel over de pagina"""
+    strokes = []
+    lines = max(STROKES_PER_PAGE // 8, 1)
+    for index in range(STROKES_PER_PAGE):
+        line = index % lines
+        x = rng.uniform(0.08, 0.85) * width
+        y = (0.08 + 0.84 * line / lines) * height + rng.uniform(-4, 4)
+        points = [(x, y)]
+        for _ in range(POINTS_PER_STROKE - 1):
+            x = min(max(x + rng.uniform(-2, 4), 0), width - 1)
+            y = min(max(y + rng.uniform(-3, 3), 0), height - 1)
+            points.append((x, y))
+        strokes.append(points)
+    return strokes
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+class DocumentFactory:
+    """Maakt unieke PDF/PNG documenten met een vaste seed (reproduceerbaar)"""
+
+    def __init__(self, seed: int = 1, pages: int = 2, png_ratio: float = 0.25, variants: int = 8):
+        self.seed = seed
+        self.pages = max(pages, 1)
+        self.png_ratio = png_ratio
+        self.variants = max(variants, 1)
+        self._pdf_pages: Dict[int, bytes] = {}
+        self._png_idat: Dict[int, bytes] = {}
+
+    def make(self, user: int, index: int) -> Tuple[str, str, bytes]:
+        """Document index van gebruiker user: (filename, content_type, data)"""
+        rng = random.Random(f"{self.seed}:{user}:{index}")
+        document_id = f"u{user:03d}-d{index:04d}"
+        if rng.random() < self.png_ratio:
+            return f"bench-{document_id}.png", "image/png", self._png(document_id, rng.randrange(self.variants))
+        first = rng.randrange(self.variants)
+        variants = [(first + page) % self.variants for page in range(self.pages)]
+        return f"bench-{document_id}.pdf", "application/pdf", self._pdf(document_id, variants)
+
+    def _pdf_page(self, document_id: str, page: int, variant: int) -> bytes:
+        commands = self._pdf_pages.get(variant)
+        if commands is None:
+            rng = random.Random(f"{self.seed}:pdf:{variant}")
+            width, height = PDF_PAGE_SIZE
+            lines = ["1 J 1 j 1.2 w 0 g"]
+            for points in _strokes(rng, width, height):
+                # PDF y-as loopt omhoog
+                lines.append(f"{points[0][0]:.2f} {height - points[0][1]:.2f} m")
+                lines.extend(f"{x:.2f} {height - y:.2f} l" for x, y in points[1:])
+                lines.append("S")
+            commands = self._pdf_pages[variant] = "\n".join(lines).encode("ascii")
+        # Eigen commentaar per pagina: ook losse pagina's (OCR_SPLIT_PDF) zijn uniek
+        return zlib.compress(f"% {document_id} p{page}\n".encode("ascii") + commands)
+
+    def _pdf(self, document_id: str, variants: List[int]) -> bytes:
+        width, height = PDF_PAGE_SIZE
+        page_ids = [3 + 2 * page for page in range(len(variants))]
+        info_id = 3 + 2 * len(variants)
+
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            f"<< /Type /Pages /Kids [{' '.join(f'{pid} 0 R' for pid in page_ids)}] /Count {len(page_ids)} >>".encode("ascii")
+        ]
+        for page, (page_id, variant) in enumerate(zip(page_ids, variants), start=1):
+            stream = self._pdf_page(document_id, page, variant)
+            objects.append(
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                f"/Resources << >> /Contents {page_id + 1} 0 R >>".encode("ascii")
+            )
+            objects.append(
+                f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode("ascii")
+                + stream + b"\nendstream"
+            )
+        objects.append(f"<< /Producer (reMarkable) /Title ({document_id}) >>".encode("ascii"))
+
+        output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += f"{number} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+        xref = len(output)
+        output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+        output += b"".join(f"{offset:010d} 00000 n \n".encode("ascii") for offset in offsets)
+        output += (
+            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R /Info {info_id} 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n"
+        ).encode("ascii")
+        return bytes(output)
+
+    def _png(self, document_id: str, variant: int) -> bytes:
+        idat = self._png_idat.get(variant)
+        if idat is None:
+            rng = random.Random(f"{self.seed}:png:{variant}")
+            width, height = PNG_SIZE
+            pixels = bytearray(b"\xff" * (width * height))
+            for points in _strokes(rng, width, height):
+                for (x0, y0), (x1, y1) in zip(points, points[1:]):
+                    steps = int(max(abs(x1 - x0), abs(y1 - y0))) + 1
+                    for step in range(steps + 1):
+                        x = min(int(x0 + (x1 - x0) * step / steps), width - 2)
+                        y = int(y0 + (y1 - y0) * step / steps)
+                        # Pen van 2x2 pixels
+                        offset = y * width + x
+                        pixels[offset] = pixels[offset + 1] = 0
+                        if y + 1 < height:
+                            pixels[offset + width] = pixels[offset + width + 1] = 0
+            # Filter byte 0 voor elke scanline
+            raw = b"".join(b"\x00" + pixels[row * width:(row + 1) * width] for row in range(height))
+            idat = self._png_idat[variant] = zlib.compress(raw, 6)
+
+        width, height = PNG_SIZE
+        return b"".join((
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+            _png_chunk(b"tEXt", b"Title\x00" + document_id.encode("ascii")),
+            _png_chunk(b"IDAT", idat),
+            _png_chunk(b"IEND", b"")
+        ))
@@ -3,14 +3,15 @@ Application configuration and storage management
 Centralized storage voor user configs en active handlers
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, List
 from core.email_handler import EmailHandler
 from core.notification_handler import NotificationHandler
+from core.storage import state_store
 
-# In-memory storage voor MVP (later vervangen door SQLite in Stap 4)
+# User configs; de SQLite store (core/storage.py) is leidend, dit is een cache van dit proces
 user_configs: Dict[str, Dict[str, Any]] = {}
 
-# Active email handlers
+# Active email handlers (alleen mailboxes die dit proces bewaakt)
 active_handlers: Dict[str, EmailHandler] = {}
 
 # Active notification handlers
@@ -18,18 +19,22 @@ notification_handlers: Dict[str, NotificationHandler] = {}
 
 
 def get_user_config(email: str) -> Dict[str, Any]:
-    """Get user configuration by email"""
+    """Get user configuration by email (credentials ontsleuteld)"""
+    config = state_store.load_account(email)
+    if config is not None:
+        user_configs[email] = config
     return user_configs.get(email, {})
 
 
 def set_user_config(email: str, config: Dict[str, Any]) -> None:
-    """Set user configuration"""
+    """Set user configuration (persistent, credentials versleuteld)"""
     user_configs[email] = config
+    state_store.save_account(email, config)
 
 
 def is_user_configured(email: str) -> bool:
     """Check if user is configured"""
-    return email in user_configs
+    return bool(get_user_config(email))
 
 
 def get_active_handler(email: str) -> EmailHandler:
@@ -49,8 +54,13 @@ def remove_active_handler(email: str) -> None:
 
 
 def is_polling_active(email: str) -> bool:
-    """Check if polling is active for email"""
-    return email in active_handlers
+    """Check if polling is active for email (in welk proces dan ook)"""
+    return state_store.is_polling(email)
+
+
+def set_polling_active(email: str, polling: bool) -> None:
+    """Zet polling aan/uit; de mailbox coordinator van een worker pakt het op"""
+    state_store.set_polling(email, polling)
 
 
 def get_notification_handler(email: str) -> NotificationHandler:
@@ -63,11 +73,19 @@ def set_notification_handler(email: str, handler: NotificationHandler) -> None:
     notification_handlers[email] = handler
 
 
+def get_history(email: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Recente verwerkingsgeschiedenis voor een gebruiker"""
+    return state_store.get_history(email, limit)
+
+
 def get_stats() -> Dict[str, Any]:
     """Get application statistics"""
+    configured, polling = state_store.account_counts()
     return {
-        "configured_users": len(user_configs),
+        "configured_users": configured,
+        "polling_users": polling,
         "active_handlers": len(active_handlers),
         "notification_handlers": len(notification_handlers),
-        "users": list(user_configs.keys())
+        "users": state_store.account_emails(),
+        "history": state_store.history_counts()
     }
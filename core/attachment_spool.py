@@ -0,0 +1,173 @@
+"""
+Attachment spooling voor Remarkable 2 naar Tekst Converter.
+
+Attachments worden niet als één grote bytes string doorgegeven maar in een
+SpooledTemporaryFile gezet: kleine bestanden blijven in RAM, grote gaan naar
+disk. De SHA-256 wordt tijdens het schrijven berekend, zodat de OCR cache
+het bestand niet opnieuw hoeft te lezen.
+"""
+
+import io
+import os
+import hashlib
+import binascii
+import tempfile
+import threading
+from typing import Iterator, Optional, Union
+
+# Bestanden boven deze grootte gaan naar disk
+SPOOL_MAX_MEMORY = int(os.getenv("SPOOL_MAX_MEMORY", str(1024 * 1024)))
+SPOOL_DIR = os.getenv("SPOOL_DIR") or None
+
+# Leesblokken bij streamen; veelvoud van 3 zodat base64 chunks aaneensluiten
+CHUNK_SIZE = 3 * 256 * 1024
+
+_BASE64_WHITESPACE = b" \t\r\n"
+
+
+class SpooledAttachment:
+    """Bestandsinhoud in RAM of op disk, met lengte en hash"""
+
+    def __init__(self, max_memory: int = SPOOL_MAX_MEMORY):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory, dir=SPOOL_DIR)
+        self._lock = threading.Lock()
+        self._hash = hashlib.sha256()
+        self._base64_rest = b""
+        self.size = 0
+        self.path: Optional[str] = None  # alleen bij from_file: bestand dat libraries zelf kunnen openen
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SpooledAttachment":
+        """Maak een spool van bytes die al in geheugen staan"""
+        spool = cls()
+        spool.write(data)
+        return spool
+
+    def write(self, chunk: bytes):
+        """Voeg bytes toe aan het einde van de spool"""
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def write_base64(self, chunk: bytes):
+        """Decodeer een stuk base64 tekst (mag op willekeurige grenzen afbreken)"""
+        data = self._base64_rest + chunk.translate(None, _BASE64_WHITESPACE)
+        usable = len(data) - len(data) % 4
+        self._base64_rest = data[usable:]
+        if usable:
+            self.write(binascii.a2b_base64(data[:usable]))
+
+    def finish_base64(self):
+        """Verwerk een eventuele rest na de laatste write_base64"""
+        if self._base64_rest:
+            rest = self._base64_rest.rstrip(b"=")
+            self._base64_rest = b""
+            if rest:
+                self.write(binascii.a2b_base64(rest + b"=" * (-len(rest) % 4)))
+
+    @classmethod
+    def from_file(cls, path: str) -> "SpooledAttachment":
+        """Open een eerder opgeslagen bestand (bijv. uit de job queue) als spool"""
+        spool = cls.__new__(cls)
+        spool._file = open(path, "rb")
+        spool._lock = threading.Lock()
+        spool._hash = hashlib.sha256()
+        spool._base64_rest = b""
+        spool.size = os.fstat(spool._file.fileno()).st_size
+        spool.path = path
+        for chunk in spool.iter_chunks():
+            spool._hash.update(chunk)
+        return spool
+
+    def save(self, path: str):
+        """Schrijf de inhoud atomair naar path (met fsync, overleeft een crash)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for chunk in self.iter_chunks():
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @property
+    def sha256(self) -> str:
+        """SHA-256 hex digest van de inhoud"""
+        return self._hash.hexdigest()
+
+    @property
+    def on_disk(self) -> bool:
+        """True als de spool naar een tijdelijk bestand is overgelopen"""
+        return bool(getattr(self._file, "_rolled", True))
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """Lees een blok vanaf offset (thread-safe)"""
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Itereer over de inhoud in blokken"""
+        offset = 0
+        while offset < self.size:
+            chunk = self.read_at(offset, chunk_size)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def reader(self) -> io.BufferedReader:
+        """Seekable file object over de spool (eigen positie), voor libraries die een stream lezen"""
+        return io.BufferedReader(_SpoolReader(self), CHUNK_SIZE)
+
+    def read_bytes(self) -> bytes:
+        """Volledige inhoud als bytes (alleen voor kleine bestanden of libraries die bytes eisen)"""
+        return self.read_at(0, self.size)
+
+    def close(self):
+        """Geef geheugen/tijdelijk bestand vrij"""
+        self._file.close()
+
+
+class _SpoolReader(io.RawIOBase):
+    """Read-only raw stream via read_at, zodat meerdere lezers de spool delen"""
+
+    def __init__(self, spool: SpooledAttachment):
+        self._spool = spool
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._spool.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        data = self._spool.read_at(self._position, len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def base64_length(size: int) -> int:
+    """Lengte van de base64 encoding van size bytes (met padding)"""
+    return 4 * ((size + 2) // 3)
+
+
+def ensure_spooled(data: Union[bytes, SpooledAttachment]) -> SpooledAttachment:
+    """Accepteer bytes of een SpooledAttachment en geef altijd een spool terug"""
+    if isinstance(data, SpooledAttachment):
+        return data
+    return SpooledAttachment.from_bytes(data)
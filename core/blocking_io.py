@@ -0,0 +1,107 @@
+"""
+Blocking I/O layer voor Remarkable 2 naar Tekst Converter.
+
+imaplib en smtplib zijn blokkerend. Alle protocol calls gaan via deze module
+zodat de uvicorn event loop vrij blijft:
+- Begrensde thread pool voor korte protocol calls (search, fetch, send)
+- Dedicated threads voor langlopende wachters (IDLE)
+- Socket timeouts per server en een harde timeout per call
+"""
+
+import os
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+IO_MAX_WORKERS = int(os.getenv("IO_MAX_WORKERS", "32"))
+
+# Socket timeouts (per blocking operatie) voor IMAP/SMTP servers
+IMAP_TIMEOUT = float(os.getenv("IMAP_TIMEOUT", "30"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Harde bovengrens voor één volledige call (bijv. fetch van een groot bericht)
+IO_CALL_TIMEOUT = float(os.getenv("IO_CALL_TIMEOUT", "120"))
+
+
+def _parse_server_timeouts(value: str) -> Dict[str, float]:
+    """Parse overrides in de vorm "imap.gmail.com=20,smtp.example.nl=60" """
+    timeouts = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        host, seconds = item.split("=", 1)
+        try:
+            timeouts[host.strip().lower()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ongeldige timeout voor {host.strip()}: {seconds}")
+    return timeouts
+
+
+# Per-server socket timeout overrides
+SERVER_TIMEOUTS = _parse_server_timeouts(os.getenv("IO_SERVER_TIMEOUTS", ""))
+
+_executor = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS, thread_name_prefix="blocking-io")
+
+
+def get_server_timeout(host: str, default: float) -> float:
+    """Socket timeout voor een specifieke server"""
+    return SERVER_TIMEOUTS.get(host.lower(), default)
+
+
+async def run_blocking(func: Callable[..., Any], *args, timeout: Optional[float] = IO_CALL_TIMEOUT, **kwargs) -> Any:
+    """Voer een blokkerende protocol call uit in de begrensde I/O pool.
+
+    Bij een timeout wordt asyncio.TimeoutError opgegooid; de thread zelf loopt
+    door tot de socket timeout hem afbreekt.
+    """
+    loop = asyncio.get_running_loop()
+    # Context meegeven (zoals asyncio.to_thread), zodat bijv. de huidige trace span doorloopt
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+    if timeout is None:
+        return await future
+    return await asyncio.wait_for(future, timeout)
+
+
+async def run_watcher(func: Callable[..., Any], *args, name: str = "watcher", **kwargs) -> Any:
+    """Voer een langlopende blokkerende wachter uit in een eigen daemon thread.
+
+    Bedoeld voor IDLE: zo bezet een wachtende mailbox nooit een plek in de
+    begrensde pool die andere mailboxes nodig hebben.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def _set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def _set_exception(exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    def _target():
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            callback, value = _set_exception, e
+        else:
+            callback, value = _set_result, result
+        try:
+            loop.call_soon_threadsafe(callback, value)
+        except RuntimeError:
+            pass  # Event loop is al gesloten
+
+    threading.Thread(target=_target, name=name, daemon=True).start()
+    return await future
+
+
+def shutdown():
+    """Stop de I/O pool (bij afsluiten van de applicatie)"""
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -4,25 +4,47 @@ Email Handler Module voor Remarkable 2 naar Tekst Converter.
 Verantwoordelijk voor:
 - IMAP mailbox monitoring 
 - Afzender whitelist validatie
-- PDF/PNG attachment filtering en download
-- Background polling met configureerbare intervallen
+- PDF/PNG attachment filtering en download naar de job queue
+- IMAP IDLE push met adaptieve polling als fallback
 """
 
-import ssl
-import email
 import imaplib
+import binascii
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Set
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
+from email.errors import MessageError
+from email.parser import BytesHeaderParser
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 # Import OCR processor
 from .ocr_processor import OCRProcessor
+from .imap_idle import IDLE_RENEW_SECONDS, supports_idle, has_pending_activity, idle_wait
+from .imap_session import IMAPSession, session_manager
+from .blocking_io import run_blocking, run_watcher
+from .sync_state import MailboxState, sync_state
+from .imap_bodystructure import BodyPart, FetchParseError, parse_fetch_items, walk_parts, decode_section
+from .attachment_spool import SpooledAttachment
+from .mime_stream import SNIFF_BYTES, attachment_filename, classify_part, extract_attachments, sniff_content_type
+from .job_queue import job_queue
+from .job_workers import job_workers
+from .poll_scheduler import poll_scheduler
+from .sender_policy import SenderPolicy
+from .metrics import attachments_queued, messages_processed, stage_duration, stage_errors
+from .tracing import new_trace_id, tracer
 
 logger = logging.getLogger(__name__)
 
+# Header-first fetch: eerst afzender + structuur, daarna alleen de gewenste parts
+HEADER_FETCH_ITEMS = "(BODY.PEEK[HEADER.FIELDS (FROM AUTHENTICATION-RESULTS)] BODYSTRUCTURE)"
+HEADER_FETCH_KEY = "BODY[HEADER.FIELDS (FROM AUTHENTICATION-RESULTS)]"
+
+# Blokgrootte bij het decoderen van base64 secties naar een spool
+SPOOL_DECODE_CHUNK = 256 * 1024
+
 
 @dataclass
 class EmailConfig:
@@ -71,199 +93,392 @@ class EmailHandler:
     def __init__(self, config: EmailConfig):
         self.config = config
         self.is_polling = False
-        self.processed_messages: Set[str] = set()
-        self._polling_task: Optional[asyncio.Task] = None
+        self.processed_count = 0
+        
+        # Whitelist één keer compileren; een gewijzigde config geeft een nieuwe handler
+        self.sender_policy = SenderPolicy(config.allowed_senders)
+        
+        # UID high-water mark (persistent, overleeft herstarts)
+        self.mailbox_state: Optional[MailboxState] = sync_state.get(config.email)
+        # Na een (re)sync: hoogste UID die na het verwerken van alle ongelezen mail als gezien telt
+        self._resync_last_uid: Optional[int] = None
+        self._idle_task: Optional[asyncio.Task] = None
+        
+        # Persistente IMAP sessie voor IDLE/polling
+        self.watch_mode: Optional[str] = None  # "idle" of "polling"
+        self.use_idle = True
+        self.session: IMAPSession = session_manager.get_session(
+            config.imap_server, config.imap_port, config.email, config.password
+        )
+        self._stop_event = threading.Event()
         
         # Initialize OCR processor if API key is available
         self.ocr_processor: Optional[OCRProcessor] = None
         if config.openrouter_api_key:
             self.ocr_processor = OCRProcessor(
                 api_key=config.openrouter_api_key,
-                model="google/gemini-2.5-flash"  # Werkende model
+                model="google/gemini-2.5-flash",  # Werkende model
+                account=config.email
             )
             logger.info(f"OCR processor initialized for {config.email}")
         else:
             logger.warning(f"No OpenRouter API key provided for {config.email}, OCR disabled")
         
-    async def start_polling(self, interval_seconds: int = 30):
-        """Start background polling van mailbox"""
+    async def start_polling(self, interval_seconds: int = 30, use_idle: bool = True):
+        """Start background monitoring van mailbox.
+        
+        Gebruikt IDLE als de server dat ondersteunt, anders adaptieve polling
+        met interval_seconds als basis interval.
+        """
         if self.is_polling:
             logger.warning(f"Polling already active for {self.config.email}")
             return
             
         self.is_polling = True
-        logger.info(f"Starting email polling for {self.config.email} every {interval_seconds}s")
+        self.use_idle = use_idle
+        self._stop_event.clear()
+        logger.info(f"Starting email monitoring for {self.config.email} (fallback poll interval {interval_seconds}s)")
         
-        self._polling_task = asyncio.create_task(self._poll_loop(interval_seconds))
+        poll_scheduler.add(self.config.email, self._scheduled_check, interval_seconds, host=self.config.imap_server)
         
-    async def _poll_loop(self, interval_seconds: int):
-        """Main polling loop"""
-        while self.is_polling:
-            try:
-                await self._check_new_emails()
-                await asyncio.sleep(interval_seconds)
-            except Exception as e:
-                logger.error(f"Polling error for {self.config.email}: {e}")
-                await asyncio.sleep(interval_seconds)  # Continue polling despite errors
-                
-    async def _check_new_emails(self):
-        """Check for new emails from allowed senders with attachments"""
+    async def _scheduled_check(self) -> Tuple[int, bool]:
+        """Eén check vanuit de poll scheduler; daarna IDLE als de server dat ondersteunt.
+        
+        De scheduler regelt het adaptieve interval, de reconnect backoff en
+        het verbindingsbudget per IMAP host; bij IDLE vraagt de watcher zelf
+        de volgende check aan.
+        """
+        try:
+            with stage_duration.time(user=self.config.email, stage="poll"):
+                new_messages = await self._check_new_emails()
+            push = self.use_idle and await run_blocking(self._idle_supported)
+            if not poll_scheduler.hold_connection(self.config.email):
+                # Verbindingsbudget van de host is op: pollen zonder warme verbinding
+                push = False
+                await run_blocking(self.session.close)
+        except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"IMAP connection error for {self.config.email}: {e!r}")
+            stage_errors.inc(user=self.config.email, stage="imap")
+            await run_blocking(self.session.invalidate)
+            raise
+        except Exception as e:
+            logger.error(f"Polling error for {self.config.email}: {e}")
+            stage_errors.inc(user=self.config.email, stage="poll")
+            raise
+        
+        self.watch_mode = "idle" if push else "polling"
+        if push and self.is_polling:
+            self._idle_task = asyncio.create_task(self._watch_idle())
+        return new_messages, push
+    
+    async def _watch_idle(self):
+        """Wacht via IDLE (eigen thread) op nieuwe mail en vraag dan een check aan"""
         try:
-            context = ssl.create_default_context()
+            await run_watcher(self._wait_for_activity, name=f"idle-{self.config.email}")
+        except Exception as e:
+            logger.error(f"IMAP connection error for {self.config.email} during IDLE: {e!r}")
+            stage_errors.inc(user=self.config.email, stage="imap")
+            await run_blocking(self.session.invalidate)
+            poll_scheduler.backoff(self.config.email, f"{type(e).__name__}: {e}")
+        else:
+            poll_scheduler.trigger(self.config.email)
+    
+    def _connect(self) -> imaplib.IMAP4_SSL:
+        """Haal de warme IMAP verbinding op (reconnect alleen indien nodig)"""
+        with self.session.lock:
+            return self.session.acquire()
+    
+    def _disconnect(self):
+        """Sluit de persistente IMAP sessie van deze handler"""
+        session_manager.close_session(self.config.imap_server, self.config.imap_port, self.config.email, self.session)
+    
+    def _idle_supported(self) -> bool:
+        """Check IDLE capability van de huidige sessie"""
+        return supports_idle(self._connect())
+    
+    def _wait_for_activity(self):
+        """Blokkeer (in een worker thread) tot de server nieuwe mail meldt of IDLE verloopt"""
+        with self.session.lock:
+            imap = self.session.acquire()
+            if has_pending_activity(imap):
+                return
+            activity = idle_wait(imap, IDLE_RENEW_SECONDS, self._stop_event)
+            self.session.touch()
+            if activity:
+                logger.info(f"IDLE: new mail signalled for {self.config.email}")
+                
+    def _search_new_uids(self) -> List[int]:
+        """Zoek UIDs boven de high-water mark (blokkerend, draait in de I/O pool).
+        
+        Bij een eerste sync of gewijzigde UIDVALIDITY worden alleen ongelezen
+        berichten opgepakt. De high-water mark komt dan net onder de eerste
+        ongelezen UID; pas als alles in de queue staat schuift hij door naar
+        de hoogste UID (zie _check_new_emails). Zo raakt ongelezen mail bij een
+        mislukte enqueue of crash niet stilletjes kwijt.
+        """
+        with self.session.lock:
+            imap = self.session.acquire()
+            imap.untagged_responses.pop("EXISTS", None)
+            imap.untagged_responses.pop("RECENT", None)
+            uidvalidity = self.session.uidvalidity or 0
+            state = self.mailbox_state
             
-            with imaplib.IMAP4_SSL(self.config.imap_server, self.config.imap_port, ssl_context=context) as imap:
-                imap.login(self.config.email, self.config.password)
-                imap.select("INBOX")
+            if state is None or state.uidvalidity != uidvalidity:
+                if state is not None:
+                    logger.warning(f"UIDVALIDITY changed for {self.config.email}, resyncing")
+                status, data = imap.uid("SEARCH", None, "UNSEEN")
+                unseen = [int(uid) for uid in data[0].split()] if status == "OK" and data[0] else []
+                status, data = imap.uid("SEARCH", None, "ALL")
+                all_uids = [int(uid) for uid in data[0].split()] if status == "OK" and data[0] else []
                 
-                # Search for unread emails
-                status, messages = imap.search(None, "UNSEEN")
+                # Gelezen mail telt als gezien; ongelezen mail wordt nog één keer verwerkt
+                unseen.sort()
+                self._resync_last_uid = max(all_uids + unseen, default=0)
+                baseline = unseen[0] - 1 if unseen else self._resync_last_uid
+                self._save_state(MailboxState(uidvalidity=uidvalidity, last_uid=baseline))
+                return unseen
+            
+            status, data = imap.uid("SEARCH", None, f"UID {state.last_uid + 1}:*")
+        
+        if status != "OK" or not data[0]:
+            return []
+        # "n:*" geeft altijd de hoogste UID terug, ook als die <= n is
+        return sorted(uid for uid in (int(u) for u in data[0].split()) if uid > state.last_uid)
+    
+    def _save_state(self, state: MailboxState):
+        """Update en persisteer de high-water mark"""
+        self.mailbox_state = state
+        sync_state.set(self.config.email, state)
+    
+    def _fetch_message(self, uid: int) -> Optional[bytes]:
+        """Haal een volledig bericht op (fallback, blokkerend, draait in de I/O pool)"""
+        with self.session.lock:
+            status, msg_data = self.session.acquire().uid("FETCH", str(uid), "(RFC822)")
+        
+        if status != "OK" or not msg_data or not isinstance(msg_data[0], tuple):
+            return None
+        return msg_data[0][1]
+    
+    def _fetch_envelope(self, uid: int) -> Optional[Dict[str, Any]]:
+        """Haal alleen de From header en BODYSTRUCTURE op (blokkerend, draait in de I/O pool)"""
+        with self.session.lock:
+            status, msg_data = self.session.acquire().uid("FETCH", str(uid), HEADER_FETCH_ITEMS)
+        
+        if status != "OK" or not msg_data or msg_data[0] is None:
+            return None
+        return parse_fetch_items(msg_data)
+    
+    def _fetch_sections(self, uid: int, sections: List[str]) -> Dict[str, bytes]:
+        """Haal specifieke body secties op en markeer het bericht als gelezen"""
+        items = " ".join(f"BODY.PEEK[{section}]" for section in sections)
+        with self.session.lock:
+            imap = self.session.acquire()
+            status, msg_data = imap.uid("FETCH", str(uid), f"({items})")
+            if status != "OK":
+                return {}
+            imap.uid("STORE", str(uid), "+FLAGS", "(\\Seen)")
+        
+        fetched = parse_fetch_items(msg_data)
+        return {section: fetched.get(f"BODY[{section}]") or b"" for section in sections}
+    
+    def _select_attachment_parts(self, parts: List[BodyPart]) -> List[BodyPart]:
+        """Selecteer PDF/PNG kandidaten uit BODYSTRUCTURE (ook inline en octet-stream)"""
+        return [
+            part for part in parts
+            if classify_part(part.content_type, part.disposition, part.filename, part.content_id)
+        ]
+    
+    def _fetch_prefixes(self, uid: int, parts: List[BodyPart]) -> Dict[str, bytes]:
+        """Haal de eerste bytes van parts op om ze op magic bytes te herkennen (blokkerend)"""
+        # 12 base64 tekens = 9 bytes, genoeg voor SNIFF_BYTES
+        length = 4 * -(-SNIFF_BYTES // 3)
+        items = " ".join(f"BODY.PEEK[{part.section}]<0.{length}>" for part in parts)
+        with self.session.lock:
+            status, msg_data = self.session.acquire().uid("FETCH", str(uid), f"({items})")
+        if status != "OK" or not msg_data:
+            return {}
+        fetched = parse_fetch_items(msg_data)
+        prefixes = {}
+        for part in parts:
+            data = fetched.get(f"BODY[{part.section}]<0>") or b""
+            if part.encoding == "base64":
+                data = data.translate(None, b" \t\r\n")
+                data = data[:len(data) - len(data) % 4]
+            try:
+                prefixes[part.section] = decode_section(data, part.encoding)
+            except (ValueError, binascii.Error):
+                prefixes[part.section] = b""
+        return prefixes
                 
-                if status == "OK" and messages[0]:
-                    message_ids = messages[0].split()
-                    logger.info(f"Found {len(message_ids)} unread emails for {self.config.email}")
-                    
-                    for msg_id in message_ids:
-                        msg_id_str = msg_id.decode()
-                        
-                        if msg_id_str in self.processed_messages:
-                            continue
-                            
-                        await self._process_email(imap, msg_id_str)
-                        self.processed_messages.add(msg_id_str)
-                        
-        except Exception as e:
-            logger.error(f"Email check failed for {self.config.email}: {e}")
+    async def _check_new_emails(self) -> int:
+        """Check for new emails from allowed senders with attachments.
+        
+        Attachments gaan alleen de job queue in; OCR en notificaties doen de
+        workers. De high-water mark schuift op zodra een bericht in de queue
+        staat, dus een trage OCR call houdt de IMAP sessie niet vast.
+        
+        Returns:
+            int: Aantal nieuw verwerkte berichten
+        """
+        processed = 0
+        uids = await run_blocking(self._search_new_uids)
+        
+        if uids:
+            logger.info(f"Found {len(uids)} new emails for {self.config.email}")
+            
+            for uid in uids:
+                # Voorlopige trace; na de fetch krijgt elke attachment zijn eigen trace ID
+                with tracer.span("imap_fetch", deferred=True, account=self.config.email, uid=uid) as fetch_span:
+                    attachments = await self._process_email(uid)
+                for attachment in attachments:
+                    attachment["trace_id"] = new_trace_id()
+                tracer.adopt(fetch_span.trace_ids[0], [attachment["trace_id"] for attachment in attachments])
+                await self._enqueue_email(uid, attachments)
+                processed += 1
+        
+        # Resync klaar: de gelezen mail boven de laatste ongelezen UID overslaan
+        resync_last_uid, self._resync_last_uid = self._resync_last_uid, None
+        if resync_last_uid is not None and resync_last_uid > self.mailbox_state.last_uid:
+            state = MailboxState(uidvalidity=self.mailbox_state.uidvalidity, last_uid=resync_last_uid)
+            await run_blocking(self._save_state, state)
+                
+        return processed
+    
+    async def _enqueue_email(self, uid: int, attachments: List[Dict[str, Any]]):
+        """Zet attachments in de job queue en hoog daarna de high-water mark op"""
+        try:
+            if attachments and self.ocr_processor:
+                with tracer.span("enqueue", [attachment["trace_id"] for attachment in attachments]):
+                    added = await run_blocking(
+                        job_queue.enqueue, self.config.email, self.mailbox_state.uidvalidity, uid, attachments
+                    )
+                if added:
+                    logger.info(f"Queued {added} attachments from UID {uid} for OCR")
+                    attachments_queued.inc(added, user=self.config.email)
+                    job_workers.wake()
+            elif attachments:
+                logger.warning("OCR processor not available, skipping text extraction")
+                for attachment in attachments:
+                    logger.info(f"Attachment found: {attachment['filename']} ({attachment['content_type']})")
             
-    async def _process_email(self, imap: imaplib.IMAP4_SSL, msg_id: str):
-        """Process individual email for attachments"""
+            # Pas na een geslaagde enqueue ophogen; anders wordt het bericht opnieuw opgehaald
+            if uid > self.mailbox_state.last_uid:
+                state = MailboxState(uidvalidity=self.mailbox_state.uidvalidity, last_uid=uid)
+                await run_blocking(self._save_state, state)
+            self.processed_count += 1
+        finally:
+            for attachment in attachments:
+                attachment['file'].close()
+            
+    async def _process_email(self, uid: int) -> List[Dict[str, Any]]:
+        """Haal een bericht op en geef de PDF/PNG attachments van toegestane afzenders terug"""
         try:
-            # Fetch email
-            status, msg_data = imap.fetch(msg_id, "(RFC822)")
+            # Fase 1: alleen afzender en structuur ophalen
+            try:
+                with tracer.span("imap_fetch_envelope"):
+                    envelope = await run_blocking(self._fetch_envelope, uid)
+            except FetchParseError as e:
+                logger.warning(f"Header fetch for UID {uid} not parseable ({e}), fetching full message")
+                envelope = {"RFC822": await run_blocking(self._fetch_message, uid)}
             
-            if status != "OK":
-                return
+            if envelope is None or envelope.get("RFC822", b"") is None:
+                return []
                 
-            email_body = msg_data[0][1]
-            email_message = email.message_from_bytes(email_body)
+            with tracer.span("mime_parse", part="header"):
+                header = BytesHeaderParser().parsebytes(envelope.get(HEADER_FETCH_KEY) or envelope.get("RFC822") or b"")
             
             # Check sender
-            sender = email_message.get("From", "")
-            sender_email = self._extract_email_address(sender)
+            verdict = self.sender_policy.check(header)
+            sender_email = verdict.sender
             
-            if not self._is_allowed_sender(sender_email):
-                logger.info(f"Ignoring email from non-whitelisted sender: {sender_email}")
-                return
+            if not verdict.allowed:
+                logger.info(f"Ignoring email from {sender_email}: {verdict.reason}")
+                return []
                 
             logger.info(f"Processing email from allowed sender: {sender_email}")
+            messages_processed.inc(user=self.config.email)
             
-            # Look for PDF/PNG attachments
-            attachments = self._extract_attachments(email_message)
+            # Fase 2: alleen de PDF/PNG parts downloaden
+            attachments = await self._fetch_attachments(uid, envelope)
             
             if attachments:
                 logger.info(f"Found {len(attachments)} attachments in email from {sender_email}")
-                
-                # Process attachments with OCR if available
-                if self.ocr_processor:
-                    await self._process_attachments_with_ocr(attachments, sender_email)
-                else:
-                    logger.warning("OCR processor not available, skipping text extraction")
-                    for attachment in attachments:
-                        logger.info(f"Attachment found: {attachment['filename']} ({attachment['content_type']})")
             else:
                 logger.info(f"No PDF/PNG attachments found in email from {sender_email}")
+            return attachments
                 
-        except Exception as e:
-            logger.error(f"Failed to process email {msg_id}: {e}")
+        except (ValueError, MessageError) as e:
+            # Kapot bericht (headers, MIME, encoding): opnieuw ophalen levert hetzelfde op, dus overslaan.
+            # IMAP- en andere fouten gaan door naar de scheduler; de high-water mark blijft dan staan.
+            logger.error(f"Skipping malformed email UID {uid}: {e!r}")
+            stage_errors.inc(user=self.config.email, stage="parse")
+            return []
     
-    async def _process_attachments_with_ocr(self, attachments: List[Dict[str, Any]], sender_email: str):
-        """Process attachments with OCR and log results"""
-        for attachment in attachments:
-            try:
-                filename = attachment['filename']
-                file_data = attachment['data']
-                
-                logger.info(f"Starting OCR processing for: {filename}")
-                
-                # Process with OCR
-                ocr_result = await self.ocr_processor.process_attachment(filename, file_data)
-                
-                if ocr_result['success']:
-                    logger.info(f"OCR successful for {filename}: {len(ocr_result['text'])} characters extracted")
-                    logger.info(f"OCR confidence: {ocr_result['confidence']}")
-                    
-                    # Log first 200 chars of extracted text for debugging
-                    preview_text = ocr_result['text'][:200] + "..." if len(ocr_result['text']) > 200 else ocr_result['text']
-                    logger.info(f"Extracted text preview: {preview_text}")
-                    
-                    # Send notification if notification handler is available
-                    from config.app_config import notification_handlers
-                    user_email = self.config.email
-                    
-                    if user_email in notification_handlers:
-                        notification_handler = notification_handlers[user_email]
-                        
-                        # Try to send notification
-                        try:
-                            # Include filename in OCR result
-                            ocr_result['filename'] = filename
-                            
-                            # Send notification with original attachment
-                            success = await notification_handler.send_ocr_result(
-                                ocr_result,
-                                original_attachment=file_data
-                            )
-                            
-                            if success:
-                                logger.info(f"OCR notification sent successfully for {filename}")
-                            else:
-                                logger.error(f"Failed to send OCR notification for {filename}")
-                                
-                        except Exception as e:
-                            logger.error(f"Error sending OCR notification: {e}")
-                    else:
-                        logger.info(f"No notification handler available for {user_email}, skipping notification")
-                    
+    async def _fetch_attachments(self, uid: int, envelope: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Download de PDF/PNG parts uit BODYSTRUCTURE, of het hele bericht als fallback"""
+        try:
+            parts = self._select_attachment_parts(walk_parts(envelope["BODYSTRUCTURE"]))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            email_body = envelope.get("RFC822")
+            if email_body is None:
+                logger.warning(f"BODYSTRUCTURE for UID {uid} not usable ({e!r}), fetching full message")
+                email_body = await run_blocking(self._fetch_message, uid)
+            if email_body is None:
+                return []
+            with tracer.span("mime_parse", part="full"):
+                return await run_blocking(extract_attachments, email_body, SPOOL_DECODE_CHUNK)
+        
+        # Generieke types (octet-stream) alleen ophalen als de eerste bytes PDF/PNG zijn
+        sniff = [part for part in parts
+                 if classify_part(part.content_type, part.disposition, part.filename, part.content_id) == "sniff"]
+        if sniff:
+            prefixes = await run_blocking(self._fetch_prefixes, uid, sniff)
+            for part in sniff:
+                content_type = sniff_content_type(prefixes.get(part.section, b""))
+                if content_type is None:
+                    parts.remove(part)
                 else:
-                    logger.error(f"OCR failed for {filename}: {ocr_result.get('error', 'Unknown error')}")
-                    
-            except Exception as e:
-                logger.error(f"Exception during OCR processing of {attachment['filename']}: {e}")
-            
-    def _extract_email_address(self, sender: str) -> str:
-        """Extract email address from sender field"""
-        if "<" in sender and ">" in sender:
-            start = sender.find("<") + 1
-            end = sender.find(">")
-            return sender[start:end].lower().strip()
-        return sender.lower().strip()
+                    logger.info(f"Part {part.section} of UID {uid} ({part.content_type}) is a {content_type}")
+                    part.content_type = content_type
         
-    def _is_allowed_sender(self, sender_email: str) -> bool:
-        """Check if sender is in whitelist"""
-        return sender_email in [s.lower().strip() for s in self.config.allowed_senders]
+        if not parts:
+            return []
         
-    def _extract_attachments(self, email_message) -> List[Dict[str, Any]]:
-        """Extract PDF/PNG attachments from email"""
+        with tracer.span("imap_fetch_sections", sections=len(parts)):
+            sections = await run_blocking(self._fetch_sections, uid, [part.section for part in parts])
         attachments = []
-        
-        for part in email_message.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition", ""))
-            
-            # Check for PDF or PNG attachments
-            if content_type in ["application/pdf", "image/png"] and "attachment" in content_disposition:
-                filename = part.get_filename()
-                if filename:
-                    attachments.append({
-                        "filename": filename,
-                        "content_type": content_type,
-                        "data": part.get_payload(decode=True)
-                    })
-                    
+        for part in parts:
+            if not sections.get(part.section):
+                continue
+            with tracer.span("mime_parse", part=part.section, filename=part.filename, encoding=part.encoding):
+                spool = await run_blocking(self._spool_section, sections.pop(part.section), part.encoding)
+            attachments.append({
+                "filename": attachment_filename(part.filename, part.content_type, f"{uid}-{part.section}"),
+                "content_type": part.content_type,
+                "file": spool
+            })
         return attachments
+    
+    def _spool_section(self, data: bytes, encoding: str) -> SpooledAttachment:
+        """Decodeer een body sectie blok voor blok naar een spool (RAM of disk)"""
+        if encoding != "base64":
+            return SpooledAttachment.from_bytes(decode_section(data, encoding))
         
-    def stop_polling(self):
-        """Stop polling"""
+        spool = SpooledAttachment()
+        view = memoryview(data)
+        for offset in range(0, len(view), SPOOL_DECODE_CHUNK):
+            spool.write_base64(bytes(view[offset:offset + SPOOL_DECODE_CHUNK]))
+        spool.finish_base64()
+        return spool
+    
+    async def stop_polling(self):
+        """Stop polling en sluit de IMAP sessie"""
         self.is_polling = False
-        if self._polling_task:
-            self._polling_task.cancel()
+        self._stop_event.set()
+        poll_scheduler.remove(self.config.email)
+        if self._idle_task:
+            self._idle_task.cancel()
+        # Wacht tot een lopende check of IDLE wait de sessie vrijgeeft, zodat een
+        # nieuwe handler voor dit account niet de sessie krijgt die nog gesloten wordt
+        await run_blocking(self._disconnect)
         logger.info(f"Stopped polling for {self.config.email}")
@@ -0,0 +1,112 @@
+"""
+Gedeelde HTTP client pool voor OpenRouter.
+
+Eén httpx.AsyncClient voor het hele proces (HTTP/2 als h2 geïnstalleerd is),
+met keep-alive limieten. De client wordt in de FastAPI lifespan gestart en
+gesloten; auth headers worden per request meegegeven zodat alle API keys
+dezelfde verbindingen delen.
+"""
+
+import os
+import logging
+from typing import Any, Dict, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+
+OPENROUTER_HEADERS = {
+    "HTTP-Referer": "https://remarkable-ocr.local",
+    "X-Title": "Remarkable OCR Tool"
+}
+
+
+class HTTPClientPool:
+    """Lifecycle-managed gedeelde AsyncClient met verbindingsstatistieken"""
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None):
+        self.headers = headers or {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Statistieken
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def _create_client(self) -> httpx.AsyncClient:
+        logger.info(f"Creating shared HTTP client (http2={HTTP2_AVAILABLE}, max_connections={HTTP_MAX_CONNECTIONS})")
+        return httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            headers=self.headers
+        )
+
+    async def start(self):
+        """Start de client (FastAPI lifespan)"""
+        if self._client is None:
+            self._client = self._create_client()
+
+    async def close(self):
+        """Sluit de client en alle open verbindingen (FastAPI lifespan)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Shared HTTP client closed")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """De gedeelde client; wordt lazy aangemaakt buiten de lifespan (scripts, tests)"""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        """httpcore trace hook: tel nieuwe verbindingen en TLS handshakes"""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    async def post(self, url: str, api_key: Optional[str] = None, **kwargs) -> httpx.Response:
+        """POST met per-request Authorization header"""
+        headers = dict(kwargs.pop("headers", None) or {})
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = self._trace
+
+        self.requests += 1
+        return await self.client.post(url, headers=headers, extensions=extensions, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Verbindingshergebruik statistieken"""
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "active": self._client is not None,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "reused_requests": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0
+        }
+
+
+# Process-wide client pool voor OpenRouter
+openrouter_pool = HTTPClientPool(OPENROUTER_HEADERS)
@@ -0,0 +1,240 @@
+"""
+IMAP FETCH/BODYSTRUCTURE parsing voor header-first ophalen van berichten.
+
+imaplib levert FETCH responses als een lijst van bytes en (prefix, literal)
+tuples. Deze module zet die om naar een dict met FETCH items en leidt uit
+BODYSTRUCTURE de MIME parts af (met IMAP part nummers), zodat we alleen de
+benodigde body secties hoeven te downloaden.
+"""
+
+import re
+import base64
+import quopri
+from urllib.parse import unquote
+from dataclasses import dataclass
+from email.header import decode_header, make_header
+from typing import Any, Dict, List, Optional
+
+
+class FetchParseError(ValueError):
+    """FETCH response kon niet geparsed worden"""
+
+
+class _Atom(str):
+    """Onderscheidt atoms (keys, getallen) van quoted strings (bytes)"""
+
+
+class _Literal:
+    """Literal inhoud uit een (prefix, literal) tuple van imaplib"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+_OPEN = object()
+_CLOSE = object()
+
+
+def _tokenize(segments: List[Any]) -> List[Any]:
+    """Zet tekst segmenten en literals om in een platte token lijst"""
+    tokens: List[Any] = []
+    for segment in segments:
+        if isinstance(segment, _Literal):
+            tokens.append(segment.data)
+            continue
+
+        text = segment
+        i, n = 0, len(text)
+        while i < n:
+            ch = text[i:i + 1]
+            if ch in (b" ", b"\r", b"\n"):
+                i += 1
+            elif ch == b"(":
+                tokens.append(_OPEN)
+                i += 1
+            elif ch == b")":
+                tokens.append(_CLOSE)
+                i += 1
+            elif ch == b'"':
+                i += 1
+                value = bytearray()
+                while i < n and text[i:i + 1] != b'"':
+                    if text[i:i + 1] == b"\\":
+                        i += 1
+                    value += text[i:i + 1]
+                    i += 1
+                i += 1
+                tokens.append(bytes(value))
+            elif ch == b"{":
+                # Literal marker; de inhoud volgt als apart segment
+                i = text.index(b"}", i) + 1
+            else:
+                # Atom, inclusief sectie specificaties zoals BODY[HEADER.FIELDS (FROM)]
+                start = i
+                depth = 0
+                while i < n:
+                    ch = text[i:i + 1]
+                    if ch == b"[":
+                        depth += 1
+                    elif ch == b"]":
+                        depth -= 1
+                    elif depth == 0 and ch in (b" ", b"(", b")"):
+                        break
+                    i += 1
+                atom = text[start:i].decode("ascii", "replace")
+                tokens.append(None if atom.upper() == "NIL" else _Atom(atom))
+    return tokens
+
+
+def _build(tokens: List[Any], pos: int = 0):
+    """Bouw geneste lijsten uit de token stroom"""
+    result = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token is _OPEN:
+            nested, pos = _build(tokens, pos + 1)
+            result.append(nested)
+            continue
+        if token is _CLOSE:
+            return result, pos + 1
+        result.append(token)
+        pos += 1
+    return result, pos
+
+
+def parse_fetch_items(data: List[Any]) -> Dict[str, Any]:
+    """Parse een imaplib FETCH response voor één bericht naar {ITEM: waarde}.
+
+    Keys zijn in hoofdletters, bijv. "UID", "BODYSTRUCTURE",
+    "BODY[HEADER.FIELDS (FROM)]" of "BODY[2]".
+    """
+    segments: List[Any] = []
+    for item in data:
+        if isinstance(item, tuple):
+            segments.append(item[0])
+            segments.append(_Literal(item[1]))
+        elif isinstance(item, bytes):
+            segments.append(item)
+
+    try:
+        tree, _ = _build(_tokenize(segments))
+        # Verwacht: <seq> (<key> <value> <key> <value> ...)
+        items = next(t for t in tree if isinstance(t, list))
+    except (StopIteration, ValueError, IndexError) as e:
+        raise FetchParseError(f"Onverwachte FETCH response: {data!r}") from e
+
+    result = {}
+    for key, value in zip(items[0::2], items[1::2]):
+        # Servers geven BODY[..] terug voor BODY.PEEK[..] requests
+        result[str(key).upper().replace("BODY.PEEK[", "BODY[")] = value
+    return result
+
+
+@dataclass
+class BodyPart:
+    """Eén (niet-multipart) MIME part uit BODYSTRUCTURE"""
+    section: str
+    content_type: str
+    encoding: str
+    size: int
+    disposition: Optional[str]
+    filename: Optional[str]
+    content_id: Optional[str] = None
+
+
+def _as_str(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+def _params(value: Any) -> Dict[str, str]:
+    """Zet een IMAP parameter lijst ("name" "value" ...) om naar een dict"""
+    if not isinstance(value, list):
+        return {}
+    return {_as_str(k).lower(): _as_str(v) for k, v in zip(value[0::2], value[1::2])}
+
+
+_CONTINUATION_RE = re.compile(r"^(filename|name)\*(\d+)?(\*)?$")
+
+
+def _decode_filename(params: Dict[str, str]) -> Optional[str]:
+    """Haal een (RFC 2231/2047 gecodeerde) bestandsnaam uit parameters"""
+    for base in ("filename", "name"):
+        # RFC 2231: filename*=utf-8''na%C3%AFef.pdf of filename*0*=...; filename*1*=...
+        pieces = []
+        encoded = False
+        for key, value in params.items():
+            match = _CONTINUATION_RE.match(key)
+            if match and match.group(1) == base:
+                pieces.append((int(match.group(2) or 0), value))
+                encoded = encoded or bool(match.group(3)) or match.group(2) is None
+        if pieces:
+            value = "".join(v for _, v in sorted(pieces))
+            if encoded and value.count("'") >= 2:
+                charset, _, value = value.split("'", 2)
+                return unquote(value, encoding=charset or "utf-8", errors="replace")
+            return unquote(value)
+
+        if params.get(base):
+            return str(make_header(decode_header(params[base])))
+    return None
+
+
+def walk_parts(structure: List[Any], prefix: str = "") -> List[BodyPart]:
+    """Loop recursief door BODYSTRUCTURE en geef alle bladeren met part nummer"""
+    if structure and isinstance(structure[0], list):
+        # Multipart: (child)(child)... subtype [extensies]
+        parts = []
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            section = f"{prefix}.{index}" if prefix else str(index)
+            parts.extend(walk_parts(child, section))
+        return parts
+
+    section = prefix or "1"
+    main_type = _as_str(structure[0]).lower()
+    sub_type = _as_str(structure[1]).lower()
+
+    if main_type == "message" and sub_type == "rfc822" and len(structure) > 8 and isinstance(structure[8], list):
+        # Doorgestuurd bericht: ga de body in (single-part body heet <sectie>.1)
+        body = structure[8]
+        nested_prefix = section if body and isinstance(body[0], list) else f"{section}.1"
+        return walk_parts(body, nested_prefix)
+
+    content_params = _params(structure[2])
+    encoding = _as_str(structure[5]).lower() or "7bit"
+    size = int(structure[6]) if structure[6] is not None else 0
+
+    # Positie van de disposition hangt af van het type part (text heeft een extra "lines" veld)
+    disposition_index = 9 if main_type == "text" else 8
+
+    disposition = None
+    disposition_params: Dict[str, str] = {}
+    if len(structure) > disposition_index and isinstance(structure[disposition_index], list):
+        disposition_field = structure[disposition_index]
+        disposition = _as_str(disposition_field[0]).lower()
+        if len(disposition_field) > 1:
+            disposition_params = _params(disposition_field[1])
+
+    return [BodyPart(
+        section=section,
+        content_type=f"{main_type}/{sub_type}",
+        encoding=encoding,
+        size=size,
+        disposition=disposition,
+        filename=_decode_filename(disposition_params) or _decode_filename(content_params),
+        content_id=_as_str(structure[3]) or None
+    )]
+
+
+def decode_section(data: bytes, encoding: str) -> bytes:
+    """Decodeer een opgehaalde body sectie volgens zijn transfer encoding"""
+    if encoding == "base64":
+        return base64.b64decode(data)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
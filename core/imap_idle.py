@@ -0,0 +1,139 @@
+"""
+IMAP IDLE support (RFC 2177) bovenop imaplib.
+
+imaplib (Python < 3.14) kent geen IDLE commando, daarom sturen we het zelf
+over de bestaande sessie. Na de "+ idling" continuation lezen we direct van
+de socket met een eigen regelbuffer, zodat we met een korte select-timeout
+kunnen controleren of de watcher gestopt moet worden zonder de gebufferde
+file van imaplib in een time-out toestand te brengen. Wat imaplib al van de
+socket had gelezen (bijvoorbeeld een EXISTS direct achter de continuation)
+gaat eerst naar die regelbuffer; select ziet die bytes niet meer.
+"""
+
+import ssl
+import time
+import select
+import imaplib
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# RFC 2177: servers mogen een IDLE na 30 minuten afbreken, dus ruim daarvoor vernieuwen
+IDLE_RENEW_SECONDS = 29 * 60
+
+# Hoe vaak de IDLE loop controleert of de watcher gestopt is
+_STOP_CHECK_SECONDS = 1.0
+
+# Maximale wachttijd op de tagged response na DONE
+_DONE_TIMEOUT_SECONDS = 30
+
+
+def supports_idle(imap: imaplib.IMAP4) -> bool:
+    """Check of de server IDLE adverteert in zijn capabilities"""
+    return "IDLE" in imap.capabilities
+
+
+def has_pending_activity(imap: imaplib.IMAP4) -> bool:
+    """Check of imaplib al EXISTS/RECENT responses heeft gebufferd"""
+    return bool(imap.untagged_responses.get("EXISTS") or imap.untagged_responses.get("RECENT"))
+
+
+class _SocketLineReader:
+    """Minimale regellezer direct op de (SSL) socket van een IMAP sessie"""
+
+    def __init__(self, imap: imaplib.IMAP4):
+        self.sock = imap.sock
+        self.buffer = self._drain(imap)
+
+    def _drain(self, imap: imaplib.IMAP4) -> bytes:
+        """Neem over wat imaplib al gebufferd heeft, zonder te blokkeren op de socket"""
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0.0)
+        try:
+            # read1 geeft eerst alleen de buffer terug; is die leeg dan één non-blocking read
+            return imap.file.read1(65536) or b""
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return b""
+        finally:
+            self.sock.settimeout(timeout)
+
+    def _readable(self, timeout: float) -> bool:
+        pending = getattr(self.sock, "pending", None)
+        if pending and pending() > 0:
+            return True
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(readable)
+
+    def readline(self, timeout: float) -> Optional[bytes]:
+        """Lees een volledige regel, of None als er binnen timeout niets binnenkwam"""
+        deadline = time.monotonic() + timeout
+        while b"\r\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._readable(remaining):
+                return None
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise imaplib.IMAP4.abort("Verbinding gesloten tijdens IDLE")
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\r\n", 1)
+        return line
+
+
+def idle_wait(imap: imaplib.IMAP4, timeout: float, stop_event: threading.Event) -> bool:
+    """Wacht via IDLE op nieuwe mail.
+
+    Args:
+        imap: Ingelogde sessie met geselecteerde mailbox
+        timeout: Maximale IDLE duur in seconden (blijf onder IDLE_RENEW_SECONDS)
+        stop_event: Wordt periodiek gecontroleerd om de wachtlus te verlaten
+
+    Returns:
+        bool: True als de server EXISTS/RECENT meldde, False bij timeout of stop
+    """
+    tag = imap._new_tag()
+    imap.send(tag + b" IDLE\r\n")
+
+    continuation = imap.readline()
+    if not continuation.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE geweigerd: {continuation!r}")
+
+    reader = _SocketLineReader(imap)
+    deadline = time.monotonic() + min(timeout, IDLE_RENEW_SECONDS)
+    activity = False
+
+    while not stop_event.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        line = reader.readline(min(remaining, _STOP_CHECK_SECONDS))
+        if line is None:
+            continue
+        if line.startswith(b"* BYE"):
+            raise imaplib.IMAP4.abort(f"Server sloot IDLE sessie: {line!r}")
+        if line.startswith(b"*") and (line.endswith(b"EXISTS") or line.endswith(b"RECENT")):
+            logger.debug(f"IDLE activiteit: {line!r}")
+            activity = True
+            break
+
+    # Beëindig IDLE en lees alles tot en met de tagged response
+    imap.send(b"DONE\r\n")
+    while True:
+        line = reader.readline(_DONE_TIMEOUT_SECONDS)
+        if line is None:
+            raise imaplib.IMAP4.abort("Geen antwoord op IDLE DONE")
+        if line.startswith(tag):
+            imap.tagged_commands.pop(tag, None)
+            if not line[len(tag):].strip().startswith(b"OK"):
+                raise imaplib.IMAP4.error(f"IDLE afgesloten met fout: {line!r}")
+            if reader.buffer:
+                # Komt niet meer bij imaplib terecht; nieuwe mail daarin haalt de volgende check op
+                logger.debug(f"Data na IDLE DONE genegeerd: {reader.buffer!r}")
+                activity = activity or b"EXISTS" in reader.buffer or b"RECENT" in reader.buffer
+            break
+        if line.endswith(b"EXISTS") or line.endswith(b"RECENT"):
+            activity = True
+
+    return activity
@@ -0,0 +1,218 @@
+"""
+IMAP Session Manager voor Remarkable 2 naar Tekst Converter.
+
+Verantwoordelijk voor:
+- Eén warme IMAP verbinding per account, hergebruikt tussen checks
+- Liveness check via NOOP, reconnect alleen wanneer nodig
+- Gedeelde SSL context voor alle handlers
+- Per-sessie tellers voor handshakes, NOOPs, hergebruik en reconnects
+- Mislukte verbindingen/logins herkenbaar maken voor de per-host backoff
+"""
+
+import os
+import ssl
+import time
+import imaplib
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+
+from .blocking_io import IMAP_TIMEOUT, get_server_timeout
+from .metrics import stage_duration, stage_errors
+
+logger = logging.getLogger(__name__)
+
+# Sessies die korter dan dit idle zijn worden zonder NOOP hergebruikt
+NOOP_CHECK_SECONDS = 60
+
+# Extra CA bundle (PEM), bijv. voor een eigen mailserver of de load test (benchmarks/load_test.py)
+SSL_CA_FILE = os.getenv("SSL_CA_FILE") or None
+
+
+class IMAPConnectError(imaplib.IMAP4.error):
+    """Verbinden of inloggen mislukt; telt mee voor de backoff van de hele host (poll_scheduler)"""
+
+
+@lru_cache(maxsize=1)
+def get_ssl_context() -> ssl.SSLContext:
+    """Gedeelde SSL context (laden van CA certificaten gebeurt maar één keer)"""
+    context = ssl.create_default_context()
+    if SSL_CA_FILE:
+        context.load_verify_locations(cafile=SSL_CA_FILE)
+    return context
+
+
+class IMAPSession:
+    """Persistente, thread-safe IMAP sessie voor één account"""
+
+    def __init__(self, server: str, port: int, email: str, password: str, mailbox: str = "INBOX"):
+        self.server = server
+        self.port = port
+        self.email = email
+        self.password = password
+        self.mailbox = mailbox
+        self.lock = threading.RLock()
+        self._imap: Optional[imaplib.IMAP4_SSL] = None
+        self._last_used = 0.0
+        self.uidvalidity: Optional[int] = None
+
+        # Statistieken
+        self.handshakes = 0
+        self.reconnects = 0
+        self.noops = 0
+        self.reuses = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return self._imap is not None
+
+    def acquire(self) -> imaplib.IMAP4_SSL:
+        """Geef een bruikbare verbinding terug; roep aan terwijl self.lock vastgehouden wordt"""
+        if self._imap is not None:
+            if time.monotonic() - self._last_used < NOOP_CHECK_SECONDS:
+                self.reuses += 1
+            elif self._is_alive():
+                self.reuses += 1
+            else:
+                logger.info(f"IMAP session for {self.email} went stale, reconnecting")
+                self._drop()
+                self.reconnects += 1
+
+        if self._imap is None:
+            self._open()
+
+        self._last_used = time.monotonic()
+        return self._imap
+
+    def touch(self):
+        """Markeer de verbinding als recent gebruikt (bijv. na een geslaagde IDLE)"""
+        self._last_used = time.monotonic()
+
+    def _is_alive(self) -> bool:
+        """Controleer de verbinding met NOOP"""
+        try:
+            self.noops += 1
+            status, _ = self._imap.noop()
+            return status == "OK"
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    def _open(self):
+        """Nieuwe TLS verbinding, login en select"""
+        started = time.monotonic()
+        try:
+            imap = imaplib.IMAP4_SSL(
+                self.server, self.port,
+                ssl_context=get_ssl_context(),
+                timeout=get_server_timeout(self.server, IMAP_TIMEOUT)
+            )
+        except OSError as e:
+            stage_errors.inc(user=self.email, stage="imap_login")
+            raise IMAPConnectError(f"connect to {self.server}:{self.port} failed: {e!r}") from e
+        self.handshakes += 1
+        try:
+            imap.login(self.email, self.password)
+            imap.select(self.mailbox)
+            uidvalidity = imap.untagged_responses.get("UIDVALIDITY")
+            self.uidvalidity = int(uidvalidity[-1]) if uidvalidity else None
+        except Exception as e:
+            stage_errors.inc(user=self.email, stage="imap_login")
+            try:
+                imap.shutdown()
+            except OSError:
+                pass
+            if isinstance(e, (imaplib.IMAP4.error, OSError)):
+                raise IMAPConnectError(f"login on {self.server} failed: {e!r}") from e
+            raise
+        stage_duration.observe(time.monotonic() - started, user=self.email, stage="imap_login")
+        self._imap = imap
+        logger.info(f"IMAP session opened for {self.email} (handshake #{self.handshakes})")
+
+    def _drop(self):
+        """Gooi de huidige verbinding weg zonder nette logout"""
+        if self._imap is not None:
+            try:
+                self._imap.shutdown()
+            except OSError:
+                pass
+            self._imap = None
+
+    def invalidate(self):
+        """Markeer de verbinding als kapot na een protocol- of socketfout"""
+        with self.lock:
+            if self._imap is not None:
+                self._drop()
+                self.reconnects += 1
+
+    def close(self):
+        """Netjes uitloggen en verbinding sluiten"""
+        with self.lock:
+            if self._imap is None:
+                return
+            try:
+                self._imap.logout()
+            except Exception:
+                pass
+            self._imap = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Sessie statistieken"""
+        return {
+            "connected": self.is_connected,
+            "handshakes": self.handshakes,
+            "reconnects": self.reconnects,
+            "noops": self.noops,
+            "reuses": self.reuses
+        }
+
+
+class IMAPSessionManager:
+    """Registry van persistente IMAP sessies, één per account"""
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[str, int, str], IMAPSession] = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, server: str, port: int, email: str, password: str) -> IMAPSession:
+        """Haal bestaande sessie op of maak een nieuwe aan"""
+        key = (server, port, email)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.password != password:
+                if session is not None:
+                    session.close()
+                session = IMAPSession(server, port, email, password)
+                self._sessions[key] = session
+            return session
+
+    def close_session(self, server: str, port: int, email: str, session: Optional[IMAPSession] = None):
+        """Sluit en verwijder de sessie van een account.
+        
+        Met session alleen als die nog de geregistreerde sessie is; een
+        nieuwere sessie (bijv. na een wachtwoordwijziging) blijft staan.
+        """
+        key = (server, port, email)
+        with self._lock:
+            current = self._sessions.get(key)
+            if current is None or (session is not None and current is not session):
+                return
+            del self._sessions[key]
+        current.close()
+
+    def close_all(self):
+        """Sluit alle sessies (shutdown)"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Statistieken per account"""
+        with self._lock:
+            return {key[2]: session.get_stats() for key, session in self._sessions.items()}
+
+
+# Process-wide session manager
+session_manager = IMAPSessionManager()
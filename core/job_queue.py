@@ -0,0 +1,479 @@
+"""
+Durable job queue tussen mail ingestion en OCR.
+
+Ingestion zet attachments op disk en maakt een job aan; workers halen jobs
+op met een lease (visibility timeout). Een job doorloopt de states:
+
+    fetched → ocr_pending → ocr_done → notified   (of failed)
+
+Na een crash of herstart worden jobs met een verlopen lease opnieuw
+opgepakt, zonder het bericht opnieuw uit de mailbox te halen. Opslag is
+SQLite in WAL mode, zodat lezen en schrijven elkaar niet blokkeren.
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from .attachment_spool import SpooledAttachment
+from .storage import DATA_DIR
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Lease op een job tijdens enqueue (INSERT → bestand schrijven → ocr_pending); pas daarna mag
+# een ander proces de half-geschreven job opruimen of overnemen
+JOB_ENQUEUE_LEASE_SECONDS = int(os.getenv("JOB_ENQUEUE_LEASE_SECONDS", "120"))
+
+# Notificaties bundelen: off (per attachment), message (per bericht) of window (per account per tijdvak)
+NOTIFICATION_DIGEST = os.getenv("NOTIFICATION_DIGEST", "message").lower()
+NOTIFICATION_DIGEST_WINDOW = int(os.getenv("NOTIFICATION_DIGEST_WINDOW", "300"))  # seconds
+NOTIFICATION_DIGEST_MAX = 50  # maximaal aantal resultaten per digest
+
+STATE_FETCHED = "fetched"
+STATE_OCR_PENDING = "ocr_pending"
+STATE_OCR_DONE = "ocr_done"
+STATE_NOTIFIED = "notified"
+STATE_FAILED = "failed"
+
+_JOB_COLUMNS = "id, account, uid, filename, content_type, file_path, state, attempts, result, trace_id"
+
+# Job p komt in de mailbox vóór job j (zelfde account). Na een UIDVALIDITY wissel geldt de volgorde
+# van de queue zelf.
+_EARLIER_MESSAGE = (
+    "p.account = j.account AND ((p.uidvalidity = j.uidvalidity AND p.uid < j.uid) "
+    "OR (p.uidvalidity != j.uidvalidity AND p.id < j.id))"
+)
+_EARLIER_JOB = (
+    "p.account = j.account AND ((p.uidvalidity = j.uidvalidity AND (p.uid < j.uid "
+    "OR (p.uid = j.uid AND p.part < j.part))) OR (p.uidvalidity != j.uidvalidity AND p.id < j.id))"
+)
+
+# Nog niet afgeronde states als SQL literal: de partial index hieronder wordt alleen gebruikt als
+# de query exact dezelfde voorwaarde bevat (met ? parameters kan SQLite dat niet bewijzen)
+_UNFINISHED_STATES = f"('{STATE_FETCHED}', '{STATE_OCR_PENDING}', '{STATE_OCR_DONE}')"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    file_path TEXT,
+    state TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    trace_id TEXT,
+    UNIQUE (account, uidvalidity, uid, part)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(state, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_message ON jobs(account, uidvalidity, uid);
+CREATE INDEX IF NOT EXISTS idx_jobs_unfinished ON jobs(account, uidvalidity, uid, part)
+    WHERE state IN {_UNFINISHED_STATES};
+"""
+
+
+class JobQueueError(Exception):
+    """Enqueue niet afgerond; het bericht moet later opnieuw worden aangeboden"""
+
+
+@dataclass
+class Job:
+    """Eén attachment in de queue"""
+    id: int
+    account: str
+    uid: int
+    filename: str
+    content_type: str
+    file_path: Optional[str]
+    state: str
+    attempts: int
+    result: Optional[Dict[str, Any]] = None
+    trace_id: Optional[str] = None
+
+
+class JobQueue:
+    """SQLite job queue met leases per worker"""
+
+    def __init__(self, path: str, attachments_dir: str,
+                 lease_seconds: int = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.attachments_dir = attachments_dir
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            os.makedirs(self.attachments_dir, exist_ok=True)
+            # Autocommit; transacties expliciet met BEGIN IMMEDIATE
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._migrate(self._conn)
+            self._recover(self._conn)
+        return self._conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Kolommen die later zijn toegevoegd aan een bestaande queue"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)").fetchall()}
+        if "trace_id" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN trace_id TEXT")
+
+    def _recover(self, conn: sqlite3.Connection):
+        """Ruim half-geschreven jobs op van een enqueue die is gecrasht.
+
+        Alleen jobs waarvan de enqueue lease verlopen is: een ander proces kan
+        op dit moment nog tussen INSERT en het schrijven van het bestand zitten.
+        Het bericht zelf staat nog in de mailbox (de high-water mark is niet
+        opgehoogd) en wordt bij de volgende poll opnieuw aangeboden.
+        """
+        for (job_id,) in conn.execute(
+            "SELECT id FROM jobs WHERE state = ? AND (lease_expires IS NULL OR lease_expires < ?)",
+            (STATE_FETCHED, time.time())
+        ).fetchall():
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE id = ? AND state = ? AND (lease_expires IS NULL OR lease_expires < ?)",
+                (job_id, STATE_FETCHED, time.time())
+            )
+            if cursor.rowcount:
+                self._remove_file(os.path.join(self.attachments_dir, f"{job_id}.bin"))
+                logger.warning(f"Dropped incomplete job {job_id} from queue")
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        return Job(
+            id=row[0], account=row[1], uid=row[2], filename=row[3], content_type=row[4],
+            file_path=row[5], state=row[6], attempts=row[7],
+            result=json.loads(row[8]) if row[8] else None, trace_id=row[9]
+        )
+
+    def enqueue(self, account: str, uidvalidity: int, uid: int, attachments: List[Dict[str, Any]]) -> int:
+        """Sla attachments van één bericht op disk op en zet ze in de queue (blokkerend).
+
+        Een bericht dat al in de queue staat wordt niet nog eens toegevoegd.
+        Tot het bestand op disk staat heeft deze enqueue een lease op de job;
+        een half-geschreven job van een gecrasht proces wordt na die lease
+        overgenomen.
+
+        Returns:
+            int: Aantal nieuwe jobs
+
+        Raises:
+            JobQueueError: Een job is (nog) niet in de queue gekomen; de
+                high-water mark mag dan niet worden opgehoogd
+        """
+        added = 0
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        for part, attachment in enumerate(attachments):
+            now = time.time()
+            with self._lock:
+                conn = self._connection()
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO jobs "
+                    "(account, uidvalidity, uid, part, filename, content_type, state, lease_owner, lease_expires, "
+                    "available_at, created_at, updated_at, trace_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (account, uidvalidity, uid, part, attachment["filename"], attachment["content_type"],
+                     STATE_FETCHED, owner, now + JOB_ENQUEUE_LEASE_SECONDS, now, now, now, attachment.get("trace_id"))
+                )
+                if cursor.rowcount:
+                    job_id = cursor.lastrowid
+                else:
+                    job_id = self._take_over_fetched(conn, (account, uidvalidity, uid, part), owner, now)
+                    if job_id is None:
+                        continue  # Staat al in de queue
+
+            file_path = os.path.join(self.attachments_dir, f"{job_id}.bin")
+            try:
+                spool: SpooledAttachment = attachment["file"]
+                spool.save(file_path)
+                with self._lock:
+                    cursor = self._connection().execute(
+                        "UPDATE jobs SET state = ?, file_path = ?, lease_owner = NULL, lease_expires = NULL, "
+                        "updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                        (STATE_OCR_PENDING, file_path, time.time(), job_id, STATE_FETCHED, owner)
+                    )
+                if cursor.rowcount == 0:
+                    raise JobQueueError(f"Lost enqueue lease on job {job_id} ({attachment['filename']})")
+            except BaseException:
+                # Niet half in de queue laten staan: de volgende poll biedt het bericht opnieuw aan
+                with self._lock:
+                    self._connection().execute(
+                        "DELETE FROM jobs WHERE id = ? AND state = ? AND lease_owner = ?",
+                        (job_id, STATE_FETCHED, owner)
+                    )
+                self._remove_file(file_path)
+                raise
+            added += 1
+        return added
+
+    def _take_over_fetched(self, conn: sqlite3.Connection, key: tuple, owner: str, now: float) -> Optional[int]:
+        """Job ID als de bestaande job half-geschreven is en we hem mogen overnemen; None als hij al klaar is"""
+        row = conn.execute(
+            "SELECT id, state FROM jobs WHERE account = ? AND uidvalidity = ? AND uid = ? AND part = ?", key
+        ).fetchone()
+        if row is not None and row[1] != STATE_FETCHED:
+            return None
+        if row is not None:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_owner = ?, lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND state = ? AND (lease_expires IS NULL OR lease_expires < ?)",
+                (owner, now + JOB_ENQUEUE_LEASE_SECONDS, now, row[0], STATE_FETCHED, now)
+            )
+            if cursor.rowcount:
+                logger.warning(f"Taking over incomplete job {row[0]} from an earlier enqueue")
+                return row[0]
+        raise JobQueueError(f"Job for UID {key[2]} part {key[3]} is being enqueued by another worker")
+
+    def claim(self, state: str, owner: str) -> Optional[Job]:
+        """Claim de oudste beschikbare job in state met een lease (blokkerend)"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE state = ? AND available_at <= ? "
+                    "AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY id LIMIT 1",
+                    (state, now, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE id = ?",
+                    (owner, now + self.lease_seconds, now, row[0])
+                )
+                job_row = conn.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (row[0],)
+                ).fetchone()
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(job_row)
+
+    def claim_notifications(self, owner: str, mode: str = NOTIFICATION_DIGEST,
+                            window: int = NOTIFICATION_DIGEST_WINDOW) -> List[Job]:
+        """Claim een groep ocr_done jobs die samen in één notificatie gaan (blokkerend).
+
+        - off: één job
+        - message: alle attachments van een bericht, zodra geen enkele nog OCR wacht
+        - window: alle resultaten van een account, zodra het oudste window seconden wacht
+
+        Notificaties gaan per account in mailbox volgorde (uid, part): een job
+        wordt pas geclaimd als alle eerdere jobs van het account verstuurd of
+        definitief mislukt zijn. Een trage OCR of een notificatie die opnieuw
+        geprobeerd wordt houdt latere berichten van dat account dus op.
+
+        Returns:
+            List[Job]: Geclaimde jobs in mailbox volgorde; leeg als er niets klaar staat
+        """
+        now = time.time()
+        available = "j.state = ? AND j.available_at <= ? AND (j.lease_expires IS NULL OR j.lease_expires < ?)"
+        available_params = (STATE_OCR_DONE, now, now)
+        if mode == "window":
+            # Eerdere ocr_done jobs die nog vrij zijn gaan in dezelfde digest mee
+            blocking = ("(p.state IN (?, ?) OR (p.state = ? AND (p.available_at > ? OR p.lease_expires >= ?)))",
+                        (STATE_FETCHED, STATE_OCR_PENDING, STATE_OCR_DONE, now, now))
+        else:
+            blocking = ("p.state IN (?, ?, ?)", (STATE_FETCHED, STATE_OCR_PENDING, STATE_OCR_DONE))
+        # Binnen een bericht wachten parts in message mode op elkaar via de groep, niet via de volgorde
+        earlier = _EARLIER_MESSAGE if mode == "message" else _EARLIER_JOB
+        # De state literal laat de subquery via idx_jobs_unfinished lopen, niet langs alle
+        # verstuurde en mislukte jobs van het account
+        in_order = (f"NOT EXISTS (SELECT 1 FROM jobs p WHERE p.state IN {_UNFINISHED_STATES} "
+                    f"AND {earlier} AND {blocking[0]})")
+        eligible = f"{available} AND {in_order}"
+        eligible_params = available_params + blocking[1]
+
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if mode == "message":
+                    group = conn.execute(
+                        f"SELECT account, uidvalidity, uid FROM jobs j WHERE {eligible} "
+                        "AND NOT EXISTS (SELECT 1 FROM jobs q WHERE q.account = j.account "
+                        "AND q.uidvalidity = j.uidvalidity AND q.uid = j.uid AND q.state IN (?, ?)) "
+                        "ORDER BY id LIMIT 1",
+                        eligible_params + (STATE_FETCHED, STATE_OCR_PENDING)
+                    ).fetchone()
+                    where, params = "j.account = ? AND j.uidvalidity = ? AND j.uid = ?", tuple(group or ())
+                    limit = NOTIFICATION_DIGEST_MAX
+                elif mode == "window":
+                    group = conn.execute(
+                        f"SELECT account FROM jobs j WHERE {eligible} "
+                        "GROUP BY account HAVING MIN(updated_at) <= ? ORDER BY MIN(id) LIMIT 1",
+                        eligible_params + (now - window,)
+                    ).fetchone()
+                    where, params = "j.account = ?", tuple(group or ())
+                    limit = NOTIFICATION_DIGEST_MAX
+                else:
+                    group = conn.execute(
+                        f"SELECT id FROM jobs j WHERE {eligible} ORDER BY id LIMIT 1", eligible_params
+                    ).fetchone()
+                    where, params = "j.id = ?", tuple(group or ())
+                    limit = 1
+
+                if group is None:
+                    conn.execute("COMMIT")
+                    return []
+
+                ids = [row[0] for row in conn.execute(
+                    f"SELECT id FROM jobs j WHERE {where} AND {eligible} ORDER BY uidvalidity, uid, part LIMIT ?",
+                    params + eligible_params + (limit,)
+                ).fetchall()]
+                placeholders = ", ".join("?" for _ in ids)
+                conn.execute(
+                    "UPDATE jobs SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                    f"WHERE id IN ({placeholders})",
+                    (owner, now + self.lease_seconds, now, *ids)
+                )
+                rows = {row[0]: row for row in conn.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id IN ({placeholders})", tuple(ids)
+                ).fetchall()}
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return [self._row_to_job(rows[job_id]) for job_id in ids]
+
+    def _update_leased(self, job: Job, owner: str, sql: str, params: tuple) -> bool:
+        """Voer een update uit alleen als owner de lease nog heeft"""
+        with self._lock:
+            cursor = self._connection().execute(
+                f"UPDATE jobs SET {sql}, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                params + (time.time(), job.id, owner)
+            )
+        if cursor.rowcount == 0:
+            logger.warning(f"Lost lease on job {job.id} ({job.filename})")
+            return False
+        return True
+
+    def extend_lease(self, job: Job, owner: str) -> bool:
+        """Verleng de lease van een lopende job (heartbeat)"""
+        return self._update_leased(job, owner, "lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def complete_ocr(self, job: Job, owner: str, result: Dict[str, Any]) -> bool:
+        """ocr_pending → ocr_done met het OCR resultaat"""
+        return self._update_leased(
+            job, owner,
+            "state = ?, result = ?, error = NULL, attempts = 0, lease_owner = NULL, lease_expires = NULL",
+            (STATE_OCR_DONE, json.dumps(result))
+        )
+
+    def mark_notified(self, job: Job, owner: str) -> bool:
+        """ocr_done → notified; het attachment op disk is dan niet meer nodig"""
+        done = self._update_leased(
+            job, owner,
+            "state = ?, file_path = NULL, lease_owner = NULL, lease_expires = NULL",
+            (STATE_NOTIFIED,)
+        )
+        if done:
+            self._remove_file(job.file_path)
+        return done
+
+    def retry(self, job: Job, owner: str, error: str, delay: float) -> bool:
+        """Geef de job terug voor een nieuwe poging, of markeer als failed na max_attempts"""
+        if job.attempts >= self.max_attempts:
+            logger.error(f"Job {job.id} ({job.filename}) failed after {job.attempts} attempts: {error}")
+            return self.fail(job, owner, error)
+        return self._update_leased(
+            job, owner,
+            "error = ?, available_at = ?, lease_owner = NULL, lease_expires = NULL",
+            (error, time.time() + delay)
+        )
+
+    def fail(self, job: Job, owner: str, error: str) -> bool:
+        """Markeer de job direct als failed (permanente fout of max_attempts bereikt)"""
+        done = self._update_leased(
+            job, owner,
+            "state = ?, error = ?, file_path = NULL, lease_owner = NULL, lease_expires = NULL",
+            (STATE_FAILED, error)
+        )
+        if done:
+            self._remove_file(job.file_path)
+        return done
+
+    def release(self, job: Job, owner: str, delay: float) -> bool:
+        """Geef de job terug zonder dat het als poging telt (bijv. account nog niet geladen)"""
+        return self._update_leased(
+            job, owner,
+            "attempts = attempts - 1, available_at = ?, lease_owner = NULL, lease_expires = NULL",
+            (time.time() + delay,)
+        )
+
+    def cleanup(self) -> int:
+        """Verwijder afgeronde jobs ouder dan de retentie"""
+        with self._lock:
+            removed = self._connection().execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (STATE_NOTIFIED, STATE_FAILED, time.time() - JOB_RETENTION_SECONDS)
+            ).rowcount
+        return removed
+
+    @staticmethod
+    def _remove_file(file_path: Optional[str]):
+        if file_path:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Aantal jobs per state en leeftijd van de oudste openstaande job"""
+        with self._lock:
+            conn = self._connection()
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE state IN (?, ?)", (STATE_OCR_PENDING, STATE_OCR_DONE)
+            ).fetchone()[0]
+            leased = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE lease_expires >= ?", (time.time(),)
+            ).fetchone()[0]
+        return {
+            "states": {state: counts.get(state, 0) for state in
+                       (STATE_FETCHED, STATE_OCR_PENDING, STATE_OCR_DONE, STATE_NOTIFIED, STATE_FAILED)},
+            "leased": leased,
+            "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest else 0.0
+        }
+
+
+# Process-wide job queue
+job_queue = JobQueue(os.path.join(DATA_DIR, "jobs.sqlite3"), os.path.join(DATA_DIR, "attachments"))
+
+# Queue diepte wordt pas bij een scrape uit SQLite gelezen
+metrics.gauge(
+    "remarkable_job_queue_jobs", "Jobs in de queue per state", ("state",),
+    callback=lambda: {(state,): count for state, count in job_queue.get_stats()["states"].items()}
+)
+metrics.gauge(
+    "remarkable_job_queue_oldest_pending_seconds", "Leeftijd van de oudste openstaande job",
+    callback=lambda: {(): job_queue.get_stats()["oldest_pending_seconds"]}
+)
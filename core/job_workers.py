@@ -0,0 +1,268 @@
+"""
+Worker pool die de job queue leegtrekt.
+
+Elke worker claimt eerst notificaties (ocr_done, gebundeld per bericht of
+tijdvak) en daarna OCR jobs (ocr_pending). Tijdens lange OCR calls wordt de
+lease verlengd; crasht het proces, dan komt de job na de visibility timeout
+weer vrij.
+"""
+
+import os
+import socket
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from .job_queue import Job, JobQueue, STATE_OCR_PENDING, job_queue
+from .ocr_processor import OCRProcessor
+from .notification_handler import (
+    NOTIFICATION_ATTACHMENTS, NotificationError, NotificationHandler, create_notification_handler
+)
+from .ocr_scheduler import OCR_MAX_CONCURRENCY
+from .attachment_spool import SpooledAttachment
+from .blocking_io import run_blocking
+from .rate_limiter import backoff_delay
+from .storage import state_store
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(OCR_MAX_CONCURRENCY)))
+JOB_POLL_INTERVAL = 5  # seconds, vangnet voor verlopen leases en uitgestelde retries
+JOB_ACCOUNT_WAIT = 60  # seconds, wachten als een account (nog) niet geladen is
+JOB_RETRY_BASE = 30  # seconds
+
+
+class JobWorkerPool:
+    """Asyncio workers voor OCR en notificaties uit de job queue"""
+
+    def __init__(self, queue: JobQueue = job_queue, workers: int = JOB_WORKERS):
+        self.queue = queue
+        self.workers = workers
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._processors: Dict[str, OCRProcessor] = {}
+        self._notifiers: Dict[str, NotificationHandler] = {}
+        self._configs: Dict[str, Tuple[Optional[float], Dict[str, Any]]] = {}  # account → (versie, config)
+
+        # Statistieken
+        self.ocr_completed = 0
+        self.notified = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def start(self):
+        """Start de workers (FastAPI lifespan)"""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        removed = await run_blocking(self.queue.cleanup)
+        if removed:
+            logger.info(f"Removed {removed} finished jobs from queue")
+        self._tasks = [
+            asyncio.create_task(self._worker_loop(f"{self.worker_prefix}:{index}"))
+            for index in range(self.workers)
+        ]
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self):
+        """Stop de workers; lopende jobs komen na hun lease weer vrij"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Meld dat er nieuw werk in de queue staat"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker_loop(self, worker_id: str):
+        while True:
+            try:
+                # Notificaties eerst: die maken werk af dat al OCR heeft gekost
+                jobs = await run_blocking(self.queue.claim_notifications, worker_id)
+                if not jobs:
+                    job = await run_blocking(self.queue.claim, STATE_OCR_PENDING, worker_id)
+                    jobs = [job] if job else []
+                if not jobs:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+
+                await self._run_jobs(jobs, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} error: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def _run_jobs(self, jobs: List[Job], worker_id: str):
+        """Voer een OCR job of een groep notificatie jobs uit met lease heartbeat"""
+        heartbeat = asyncio.create_task(self._heartbeat(jobs, worker_id))
+        stage = "ocr" if jobs[0].state == STATE_OCR_PENDING else "notify"
+        try:
+            # De trace ID van elke attachment komt uit de queue (gezet bij de fetch)
+            with tracer.span(stage, [job.trace_id for job in jobs], account=jobs[0].account,
+                             filename=", ".join(job.filename for job in jobs), attempt=jobs[0].attempts):
+                if stage == "ocr":
+                    await self._process_ocr(jobs[0], worker_id)
+                else:
+                    await self._send_notification(jobs, worker_id)
+        except Exception as e:
+            permanent = isinstance(e, NotificationError) and e.permanent
+            for job in jobs:
+                logger.error(f"Job {job.id} ({job.filename}) failed in state {job.state}: {e}")
+                if permanent:
+                    # Bijv. onbekende ontvanger: opnieuw proberen levert dezelfde 5xx op
+                    self.failed += 1
+                    await run_blocking(self.queue.fail, job, worker_id, str(e))
+                else:
+                    # Backoff per job; de worker pakt intussen ander werk op
+                    self.retried += 1
+                    await run_blocking(self.queue.retry, job, worker_id, str(e), JOB_RETRY_BASE + backoff_delay(job.attempts))
+                if permanent or job.attempts >= self.queue.max_attempts:
+                    await run_blocking(state_store.record_history, job.account, job.uid, job.filename, "failed", 0, str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, jobs: List[Job], worker_id: str):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            for job in jobs:
+                await run_blocking(self.queue.extend_lease, job, worker_id)
+
+    async def _user_config(self, account: str) -> Dict[str, Any]:
+        """User config per account; alleen opnieuw laden en ontsleutelen als hij gewijzigd is"""
+        from config.app_config import get_user_config
+
+        version = await run_blocking(state_store.account_version, account)
+        cached = self._configs.get(account)
+        if cached is None or cached[0] != version:
+            cached = self._configs[account] = (version, await run_blocking(get_user_config, account))
+        return cached[1]
+
+    async def _processor_for(self, account: str) -> Optional[OCRProcessor]:
+        """OCR processor van de actieve handler, of een nieuwe uit de user config"""
+        from config.app_config import active_handlers
+
+        handler = active_handlers.get(account)
+        if handler is not None and handler.ocr_processor is not None:
+            return handler.ocr_processor
+
+        api_key = (await self._user_config(account)).get("openrouter_api_key")
+        if not api_key:
+            return None
+        if account not in self._processors or self._processors[account].api_key != api_key:
+            self._processors[account] = OCRProcessor(api_key=api_key, model="google/gemini-2.5-flash", account=account)
+        return self._processors[account]
+
+    async def _process_ocr(self, job: Job, worker_id: str):
+        """ocr_pending → ocr_done"""
+        processor = await self._processor_for(job.account)
+        if processor is None:
+            logger.info(f"No OCR processor for {job.account} yet, postponing job {job.id}")
+            await run_blocking(self.queue.release, job, worker_id, JOB_ACCOUNT_WAIT)
+            return
+
+        logger.info(f"Starting OCR processing for: {job.filename}")
+        file = await run_blocking(SpooledAttachment.from_file, job.file_path)
+        try:
+            # Mislukte pagina's: job opnieuw (geslaagde pagina's staan in de cache); de laatste poging accepteert
+            # een document met gaten
+            ocr_result = await processor.process_attachment(
+                job.filename, file, allow_partial=job.attempts >= self.queue.max_attempts,
+                content_type=job.content_type
+            )
+        finally:
+            file.close()
+
+        if not ocr_result['success']:
+            raise RuntimeError(f"OCR failed for {job.filename}: {ocr_result.get('error', 'Unknown error')}")
+
+        logger.info(f"OCR successful for {job.filename}: {len(ocr_result['text'])} characters extracted")
+        logger.info(f"OCR confidence: {ocr_result['confidence']}")
+
+        # Log first 200 chars of extracted text for debugging
+        preview_text = ocr_result['text'][:200] + "..." if len(ocr_result['text']) > 200 else ocr_result['text']
+        logger.info(f"Extracted text preview: {preview_text}")
+
+        ocr_result['filename'] = job.filename
+        if await run_blocking(self.queue.complete_ocr, job, worker_id, ocr_result):
+            self.ocr_completed += 1
+            self.wake()
+
+    async def _notifier_for(self, account: str) -> Optional[NotificationHandler]:
+        """Notification handler van dit proces, of een nieuwe uit de (gedeelde) user config.
+
+        De mailbox kan door een ander proces bewaakt worden; de job kan hier toch
+        afgerond worden.
+        """
+        from config.app_config import notification_handlers
+
+        config = await self._user_config(account)
+        notification_email = config.get("notification_email")
+        handler = notification_handlers.get(account) or self._notifiers.get(account)
+        if handler is None and notification_email:
+            handler = create_notification_handler(config)
+            self._notifiers[account] = handler
+        if handler is not None and notification_email and handler.notification_email != notification_email:
+            handler.set_notification_email(notification_email)
+        return handler
+
+    async def _send_notification(self, jobs: List[Job], worker_id: str):
+        """ocr_done → notified; meerdere jobs gaan samen in één digest email"""
+        account = jobs[0].account
+        notification_handler = await self._notifier_for(account)
+        if notification_handler is None:
+            logger.info(f"No notification handler available for {account}, skipping notification")
+            await self._finish_notified(jobs, worker_id, "processed")
+            return
+
+        # Originelen alleen openen als ze meegestuurd worden; ze worden tijdens het versturen gestreamd
+        items, files = [], []
+        try:
+            for job in jobs:
+                file = None
+                if NOTIFICATION_ATTACHMENTS != "none" and job.file_path:
+                    file = await run_blocking(SpooledAttachment.from_file, job.file_path)
+                    files.append(file)
+                items.append((job.result, file))
+
+            success = await notification_handler.send_ocr_digest(items)
+        finally:
+            for file in files:
+                file.close()
+        filenames = ", ".join(job.filename for job in jobs)
+        if not success:
+            raise RuntimeError(f"Failed to send OCR notification for {filenames}")
+
+        logger.info(f"OCR notification sent successfully for {filenames}")
+        await self._finish_notified(jobs, worker_id, "notified")
+
+    async def _finish_notified(self, jobs: List[Job], worker_id: str, status: str):
+        for job in jobs:
+            if await run_blocking(self.queue.mark_notified, job, worker_id):
+                if status == "notified":
+                    self.notified += 1
+                characters = len(job.result.get("text", "")) if job.result else 0
+                await run_blocking(state_store.record_history, job.account, job.uid, job.filename, status, characters)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Worker en queue statistieken"""
+        return {
+            "workers": len(self._tasks),
+            "ocr_completed": self.ocr_completed,
+            "notified": self.notified,
+            "retried": self.retried,
+            "failed": self.failed,
+            "queue": self.queue.get_stats()
+        }
+
+
+# Process-wide worker pool
+job_workers = JobWorkerPool()
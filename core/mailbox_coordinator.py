@@ -0,0 +1,180 @@
+"""
+Mailbox coordinator voor multi-process deployments.
+
+Elk proces dat mail bewaakt (APP_MODE=all of worker) draait een coordinator.
+Die claimt via leases in de gedeelde state store een eerlijk deel van de
+mailboxes waarvoor polling aan staat, start daar een EmailHandler voor en
+geeft mailboxes vrij als er workers bijkomen. Elke mailbox heeft zo precies
+één eigenaar, ook met meerdere uvicorn workers of losse worker processen.
+"""
+
+import os
+import math
+import socket
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from .storage import StateStore, state_store
+from .blocking_io import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# all: API + polling + OCR in één proces, control: alleen API, worker: alleen polling + OCR
+APP_MODE = os.getenv("APP_MODE", "all").lower()
+
+MAILBOX_LEASE_SECONDS = int(os.getenv("MAILBOX_LEASE_SECONDS", "60"))
+MAILBOX_CHECK_INTERVAL = MAILBOX_LEASE_SECONDS / 4
+MAILBOX_POLL_INTERVAL = 30  # fallback poll interval zonder IDLE
+
+
+def runs_mail_workers() -> bool:
+    """True als dit proces mailboxes bewaakt en OCR jobs uitvoert"""
+    return APP_MODE in ("all", "worker")
+
+
+class MailboxCoordinator:
+    """Verdeelt mailboxes over processen met leases"""
+
+    def __init__(self, store: StateStore = state_store, lease_seconds: int = MAILBOX_LEASE_SECONDS):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.owned: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def start(self):
+        """Start de coordinator (FastAPI lifespan of worker entrypoint)"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        await run_blocking(self._release_dead_leases)
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Mailbox coordinator started as {self.worker_id}")
+
+    async def stop(self):
+        """Stop alle eigen handlers en geef de leases direct vrij"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for email in list(self.owned):
+            await self._stop_mailbox(email)
+        await run_blocking(self.store.remove_worker, self.worker_id)
+
+    def _release_dead_leases(self):
+        """Geef leases van gestopte processen op deze host vrij, zodat polling na een herstart direct hervat"""
+        host = socket.gethostname()
+        for email, owner in self.store.lease_owners().items():
+            owner_host, _, pid = owner.rpartition(":")
+            if owner_host != host or not pid.isdigit() or owner == self.worker_id:
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                logger.info(f"Releasing lease on {email} held by stopped process {owner}")
+                self.store.release_lease(email, owner)
+            except PermissionError:
+                pass
+
+    def wake(self):
+        """Herverdeel direct (bijv. na start/stop polling via de API)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Mailbox coordinator error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), MAILBOX_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _rebalance(self):
+        """Verleng eigen leases, stop wat weg moet en claim tot een eerlijk deel"""
+        await run_blocking(self.store.worker_heartbeat, self.worker_id)
+        wanted = await run_blocking(self.store.polling_accounts)
+        workers = await run_blocking(self.store.live_workers, self.lease_seconds)
+        fair_share = math.ceil(len(wanted) / max(len(workers), 1))
+
+        # Polling uitgezet
+        for email in self.owned - set(wanted):
+            await self._stop_mailbox(email)
+
+        # Leases verlengen; kwijtgeraakt (bijv. na een lange pauze) betekent direct stoppen
+        for email in list(self.owned):
+            if not await run_blocking(self.store.acquire_lease, email, self.worker_id, self.lease_seconds):
+                logger.warning(f"Lost mailbox lease for {email}")
+                await self._stop_mailbox(email, release=False)
+
+        # Meer dan ons deel (er is een worker bijgekomen): overschot vrijgeven
+        for email in sorted(self.owned)[fair_share:]:
+            logger.info(f"Releasing {email} for rebalancing ({len(self.owned)} > {fair_share})")
+            await self._stop_mailbox(email)
+
+        for email in wanted:
+            if len(self.owned) >= fair_share:
+                break
+            if email in self.owned:
+                continue
+            if await run_blocking(self.store.acquire_lease, email, self.worker_id, self.lease_seconds):
+                if not await self._start_mailbox(email):
+                    await run_blocking(self.store.release_lease, email, self.worker_id)
+
+    async def _start_mailbox(self, email: str) -> bool:
+        """Start een EmailHandler (en notification handler) voor een geclaimde mailbox"""
+        from config.app_config import get_user_config, set_active_handler, set_notification_handler
+        from core.email_handler import EmailHandler, create_email_config, validate_email_config
+        from core.notification_handler import create_notification_handler
+
+        # Config (ontsleutelen) en sync state komen uit de database: niet op de event loop
+        config_data = await run_blocking(get_user_config, email)
+        if not config_data:
+            logger.error(f"No configuration for {email}, cannot start polling")
+            return False
+
+        email_config = create_email_config(config_data, config_data["allowed_senders"])
+        is_valid, error_msg = validate_email_config(email_config)
+        if not is_valid:
+            logger.error(f"Invalid configuration for {email}: {error_msg}")
+            return False
+
+        handler = await run_blocking(EmailHandler, email_config)
+        await run_blocking(set_active_handler, email, handler)
+        notification_handler = create_notification_handler(config_data)
+        if notification_handler:
+            await run_blocking(set_notification_handler, email, notification_handler)
+
+        self.owned.add(email)
+        await handler.start_polling(MAILBOX_POLL_INTERVAL)
+        logger.info(f"{self.worker_id} now owns mailbox {email}")
+        return True
+
+    async def _stop_mailbox(self, email: str, release: bool = True):
+        from config.app_config import get_active_handler, remove_active_handler
+
+        handler = get_active_handler(email)
+        if handler:
+            await handler.stop_polling()
+            await run_blocking(remove_active_handler, email)
+        self.owned.discard(email)
+        if release:
+            await run_blocking(self.store.release_lease, email, self.worker_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": APP_MODE,
+            "worker_id": self.worker_id,
+            "owned_mailboxes": sorted(self.owned)
+        }
+
+
+# Process-wide coordinator
+mailbox_coordinator = MailboxCoordinator()
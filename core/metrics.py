@@ -0,0 +1,251 @@
+"""
+Prometheus metrics voor Remarkable 2 naar Tekst Converter.
+
+Verantwoordelijk voor:
+- Counters, gauges en histogrammen met labels (user, stage, ...)
+- Tekstformaat 0.0.4 voor /metrics, zonder extra dependency
+- Gauges die pas bij een scrape worden uitgerekend (bijv. queue diepte)
+
+Een observatie kost een lock, een bisect en een dict lookup; er wordt niets
+geformatteerd tot iemand /metrics opvraagt. Elk proces heeft
+zijn eigen registry: losse workers (worker.py) exposen hun metrics met
+METRICS_PORT op een eigen poort.
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0: geen losse metrics server (worker.py)
+
+MEDIA_TYPE = "text/plain; version=0.0.4"  # FastAPI voegt zelf de charset toe
+CONTENT_TYPE = f"{MEDIA_TYPE}; charset=utf-8"
+
+# Seconden; van een IMAP SEARCH tot een OCR call van een volle pagina
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple([labels.get(name, "") for name in self.labelnames])
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Oplopende teller per labelcombinatie"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Momentopname; met callback wordt de waarde pas bij een scrape opgehaald"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> Iterator[str]:
+        if self.callback is not None:
+            try:
+                values = list(self.callback().items())
+            except Exception as e:
+                logger.warning(f"Metrics callback for {self.name} failed: {e}")
+                values = []
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Verdeling in vaste buckets, plus som en aantal (voor percentielen in Prometheus)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per labelcombinatie: [counts per bucket (+Inf als laatste), som]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Meet de duur van een with-blok, ook als dat een exception gooit"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """Alle metrics van dit proces"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Alle metrics in het Prometheus tekstformaat (blokkerend door gauge callbacks)"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+
+# Pijplijn: poll → imap_login → ocr → ocr_api → notify (smtp)
+stage_duration = metrics.histogram(
+    "remarkable_stage_duration_seconds", "Duur per pijplijn stap", ("user", "stage")
+)
+stage_errors = metrics.counter(
+    "remarkable_stage_errors_total", "Fouten per pijplijn stap", ("user", "stage")
+)
+messages_processed = metrics.counter(
+    "remarkable_messages_processed_total", "Verwerkte emails van toegestane afzenders", ("user",)
+)
+attachments_queued = metrics.counter(
+    "remarkable_attachments_queued_total", "Attachments in de job queue gezet", ("user",)
+)
+ocr_documents = metrics.counter(
+    "remarkable_ocr_documents_total", "OCR resultaten per document", ("user", "result")
+)
+ocr_api_responses = metrics.counter(
+    "remarkable_ocr_api_responses_total", "OpenRouter responses per HTTP status", ("user", "status")
+)
+ocr_tokens = metrics.counter(
+    "remarkable_ocr_tokens_total", "Door OpenRouter gerapporteerde tokens", ("user", "model", "type")
+)
+notifications_sent = metrics.counter(
+    "remarkable_notifications_total", "Verstuurde notificatie emails", ("user", "result")
+)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serveer /metrics in een daemon thread (voor processen zonder FastAPI)"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Metrics server listening on :{port}/metrics")
+    return server
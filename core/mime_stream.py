@@ -0,0 +1,323 @@
+"""
+Streaming MIME extractor voor Remarkable 2 naar Tekst Converter.
+
+Verantwoordelijk voor:
+- Een RFC822 bericht in blokken verwerken, zonder message tree
+  (email.message_from_bytes) en zonder gedecodeerde payloads in geheugen
+- Headers per part parsen met BytesFeedParser (folding, RFC 2231 namen)
+- Bodies van kandidaat attachments blok voor blok naar een
+  SpooledAttachment decoderen; overige parts worden alleen overgeslagen
+- PDF/PNG herkennen op magic bytes, ook bij inline parts en bij generieke
+  types als application/octet-stream
+
+Dezelfde regels (classify_part, sniff_content_type) gebruikt de
+EmailHandler voor parts die via BODYSTRUCTURE gekozen worden.
+"""
+
+import binascii
+import logging
+from email.message import Message
+from email.parser import BytesFeedParser
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .attachment_spool import SpooledAttachment
+
+logger = logging.getLogger(__name__)
+
+# Attachment types die we via OCR verwerken
+ATTACHMENT_CONTENT_TYPES = ("application/pdf", "image/png")
+
+# Types waar een PDF/PNG achter kan zitten; die herkennen we op de inhoud
+GENERIC_CONTENT_TYPES = (
+    "application/octet-stream", "application/x-pdf", "application/x-download",
+    "application/force-download", "binary/octet-stream"
+)
+
+MAGIC_TYPES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png")
+)
+SNIFF_BYTES = 8  # langste magic hierboven
+
+FILE_EXTENSIONS = {"application/pdf": ".pdf", "image/png": ".png"}
+
+# Een boundary is maximaal 70 tekens (RFC 2046) plus "--", "--" en wat witruimte
+MAX_BOUNDARY_LINE = 80
+
+
+def sniff_content_type(prefix: bytes) -> Optional[str]:
+    """PDF/PNG op basis van de eerste bytes, anders None"""
+    for magic, content_type in MAGIC_TYPES:
+        if prefix.startswith(magic):
+            return content_type
+    return None
+
+
+def classify_part(content_type: str, disposition: Optional[str], filename: Optional[str],
+                  content_id: Optional[str] = None) -> Optional[str]:
+    """Bepaal wat we met een part doen: "accept", "sniff" (magic bytes beslissen) of None.
+
+    Inline PNG's met een Content-ID zijn plaatjes in de HTML body (logo's,
+    handtekeningen) en worden overgeslagen.
+    """
+    if content_type in ATTACHMENT_CONTENT_TYPES:
+        if disposition == "attachment" or content_type == "application/pdf":
+            return "accept"
+        if filename and not content_id:
+            return "accept"
+        return None
+    if content_type in GENERIC_CONTENT_TYPES:
+        return "sniff"
+    return None
+
+
+def attachment_filename(filename: Optional[str], content_type: str, index: Any) -> str:
+    """Gebruik de opgegeven naam, of maak er een (met extensie) voor naamloze parts"""
+    return filename or f"attachment-{index}{FILE_EXTENSIONS.get(content_type, '')}"
+
+
+class _PartSink:
+    """Decodeert één body incrementeel naar een spool"""
+
+    def __init__(self, encoding: str, content_type: str, filename: Optional[str], action: str, index: int):
+        self.encoding = encoding
+        self.content_type = content_type
+        self.filename = filename
+        self.action = action
+        self.index = index
+        self.spool = SpooledAttachment()
+        self._qp_rest = b""
+
+    def write(self, data: bytes):
+        if self.encoding == "base64":
+            self.spool.write_base64(data)
+        elif self.encoding == "quoted-printable":
+            # Alleen complete regels decoderen: een soft line break kan over blokken heen lopen
+            data = self._qp_rest + data
+            end = data.rfind(b"\n") + 1
+            self._qp_rest = data[end:]
+            if end:
+                self.spool.write(binascii.a2b_qp(data[:end]))
+        else:
+            self.spool.write(data)
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        if self.encoding == "base64":
+            self.spool.finish_base64()
+        elif self._qp_rest:
+            self.spool.write(binascii.a2b_qp(self._qp_rest))
+            self._qp_rest = b""
+
+        content_type = self.content_type
+        if self.action == "sniff" or self.content_type == "application/pdf":
+            sniffed = sniff_content_type(self.spool.read_at(0, SNIFF_BYTES))
+            if self.action == "sniff" and sniffed is None:
+                self.spool.close()
+                return None
+            content_type = sniffed or content_type
+        return {
+            "filename": attachment_filename(self.filename, content_type, self.index),
+            "content_type": content_type,
+            "file": self.spool
+        }
+
+    def abort(self):
+        self.spool.close()
+
+
+class AttachmentStream:
+    """Incrementele MIME parser: feed() blokken, krijg afgeronde PDF/PNG attachments terug.
+
+    Alleen de headers van elk part worden geparsed; bodies worden op
+    boundaries gescand en (als ze kandidaat zijn) direct naar disk of RAM
+    spool gedecodeerd. Het geheugengebruik is daardoor onafhankelijk van
+    de grootte van het bericht.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._boundaries: List[bytes] = []  # open multipart boundaries, binnenste laatst
+        self._in_headers = True
+        self._header_lines: List[bytes] = []
+        self._sink: Optional[_PartSink] = None
+        self._line_start = True  # staat het begin van de buffer aan het begin van een regel?
+        self._parts = 0
+        self._finished: List[Dict[str, Any]] = []
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        """Verwerk een blok en geef de attachments terug die daarin afgerond zijn"""
+        self._buffer += data
+        while self._buffer:
+            if self._in_headers:
+                if not self._feed_headers():
+                    break
+            elif not self._feed_body():
+                break
+        finished, self._finished = self._finished, []
+        return finished
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Einde van het bericht: rond een eventueel open part af"""
+        if self._in_headers:
+            if self._header_lines or self._buffer:
+                # Bericht zonder body (of zonder lege regel na de headers)
+                self._header_lines.append(bytes(self._buffer))
+                self._buffer.clear()
+                self._start_part()
+        if not self._in_headers:
+            self._emit(len(self._buffer))
+            self._finish_part()
+        finished, self._finished = self._finished, []
+        return finished
+
+    def abort(self):
+        """Gooi een half geschreven part weg (bijv. na een fout)"""
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+        for attachment in self._finished:
+            attachment["file"].close()
+        self._finished = []
+
+    def _feed_headers(self) -> bool:
+        while True:
+            end = self._buffer.find(b"\n") + 1
+            if not end:
+                return False
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end]
+            if line.strip(b"\r\n"):
+                self._header_lines.append(line)
+                continue
+            self._start_part()
+            return True
+
+    def _start_part(self):
+        """Headers van een part zijn binnen: kies wat er met de body gebeurt"""
+        parser = BytesFeedParser()
+        parser.feed(b"".join(self._header_lines) + b"\n")
+        headers: Message = parser.close()
+        self._header_lines = []
+        self._in_headers = False
+        self._line_start = True
+
+        content_type = headers.get_content_type()
+        if headers.get_content_maintype() == "multipart":
+            boundary = headers.get_boundary()
+            if boundary:
+                self._boundaries.append(boundary.encode("ascii", "replace"))
+            return  # Preamble tot de eerste boundary overslaan
+        if content_type == "message/rfc822":
+            self._in_headers = True  # Doorgestuurd bericht: de body begint met headers
+            return
+
+        filename = headers.get_filename()
+        action = classify_part(content_type, headers.get_content_disposition(), filename, headers.get("Content-ID"))
+        if action:
+            self._parts += 1
+            encoding = str(headers.get("Content-Transfer-Encoding", "7bit")).strip().lower()
+            self._sink = _PartSink(encoding, content_type, filename, action, self._parts)
+
+    def _feed_body(self) -> bool:
+        """Schrijf body bytes door tot de volgende boundary; False als er meer data nodig is"""
+        if not self._boundaries:
+            self._emit(len(self._buffer))
+            return False
+
+        search = 0
+        while True:
+            if search == 0 and self._line_start and self._buffer.startswith(b"--"):
+                # Boundary direct na de headers (lege body) of na een vorige boundary
+                start = 0
+            else:
+                found = self._buffer.find(b"\n--", search)
+                if found < 0:
+                    # "\r\n-" van een mogelijke boundary in het volgende blok bewaren
+                    self._emit(max(len(self._buffer) - 3, 0))
+                    return False
+                start = found + 1
+
+            end = self._buffer.find(b"\n", start) + 1
+            if not end:
+                if len(self._buffer) - start <= MAX_BOUNDARY_LINE:
+                    self._emit(max(start - 2, 0))  # Regel nog niet compleet
+                    return False
+                search = start + 1  # Te lang voor een boundary
+                continue
+
+            depth, closing = self._match_boundary(bytes(self._buffer[start:end]))
+            if depth < 0:
+                search = end
+                continue
+
+            # De regelovergang vóór een boundary hoort bij de boundary
+            body_end = start - 1 if start else 0
+            if body_end and self._buffer[body_end - 1:body_end] == b"\r":
+                body_end -= 1
+            self._emit(body_end)
+            self._finish_part()
+            del self._buffer[:end - body_end]
+
+            if closing:
+                # Epiloog van deze multipart overslaan tot de boundary van de ouder
+                del self._boundaries[depth:]
+                self._line_start = True
+            else:
+                del self._boundaries[depth + 1:]
+                self._in_headers = True
+            return True
+
+    def _match_boundary(self, line: bytes):
+        """(diepte, is afsluitend) als de regel een open boundary is, anders (-1, False)"""
+        line = line.rstrip(b" \t\r\n")
+        for depth in range(len(self._boundaries) - 1, -1, -1):
+            delimiter = b"--" + self._boundaries[depth]
+            if line == delimiter:
+                return depth, False
+            if line == delimiter + b"--":
+                return depth, True
+        return -1, False
+
+    def _emit(self, size: int):
+        """Stuur de eerste size bytes van de buffer naar het huidige part (of gooi ze weg)"""
+        if size <= 0:
+            return
+        if self._sink is not None:
+            self._sink.write(bytes(self._buffer[:size]))
+        self._line_start = self._buffer[size - 1:size] == b"\n"
+        del self._buffer[:size]
+
+    def _finish_part(self):
+        if self._sink is None:
+            return
+        sink, self._sink = self._sink, None
+        attachment = sink.finish()
+        if attachment is not None:
+            self._finished.append(attachment)
+
+
+def iter_attachments(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """Loop over de PDF/PNG attachments van een bericht dat in blokken binnenkomt"""
+    stream = AttachmentStream()
+    try:
+        for chunk in chunks:
+            yield from stream.feed(chunk)
+        yield from stream.close()
+    except BaseException:
+        stream.abort()
+        raise
+
+
+def extract_attachments(data: bytes, chunk_size: int = 256 * 1024) -> List[Dict[str, Any]]:
+    """Alle PDF/PNG attachments uit een volledig opgehaald bericht, blok voor blok gespoold"""
+    view = memoryview(data)
+    attachments: List[Dict[str, Any]] = []
+    try:
+        for attachment in iter_attachments(bytes(view[offset:offset + chunk_size])
+                                           for offset in range(0, len(view), chunk_size)):
+            attachments.append(attachment)
+    except BaseException:
+        for attachment in attachments:
+            attachment["file"].close()
+        raise
+    return attachments
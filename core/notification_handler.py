@@ -4,27 +4,104 @@ Notification Handler Module voor Remarkable 2 naar Tekst Converter.
 Verantwoordelijk voor:
 - Formatteren van OCR resultaten
 - Genereren van email notificaties
-- Verzenden via SMTP
-- Error handling en retries
+- Verzenden via de gedeelde SMTP delivery service (warme sessies per account)
+- Onderscheid tussen tijdelijke en permanente SMTP fouten
+
+Een verzending wordt hier één keer geprobeerd. Mislukt die tijdelijk, dan
+plant de job queue een nieuwe poging met backoff per bericht; een worker
+blijft dus niet hangen op een trage of haperende SMTP server.
 """
 
 import logging
 import smtplib
-import ssl
+import zipfile
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from typing import Dict, Any, Optional
-import asyncio
+from typing import Dict, Any, List, Optional, Tuple, Union
 from pathlib import Path
 import os
 import jinja2
 
+from .smtp_pool import ATTACHMENT_READ_CHUNK, StreamedAttachment, smtp_delivery
+from .attachment_spool import SpooledAttachment
+from .blocking_io import run_blocking
+from .metrics import notifications_sent, stage_duration, stage_errors
+from .tracing import tracer
+from .storage import DATA_DIR
+
 logger = logging.getLogger(__name__)
 
+# Bijlagen bij een digest: none, originals of zip
+ATTACHMENT_POLICIES = ("none", "originals", "zip")
+NOTIFICATION_ATTACHMENTS = os.getenv("NOTIFICATION_ATTACHMENTS", "originals").lower()
+if NOTIFICATION_ATTACHMENTS not in ATTACHMENT_POLICIES:
+    logger.warning(f"Unknown NOTIFICATION_ATTACHMENTS '{NOTIFICATION_ATTACHMENTS}', using 'originals'")
+    NOTIFICATION_ATTACHMENTS = "originals"
+
+# Origineel als bytes of als spool (bijv. het bestand in de job queue); spools worden gestreamd
+Original = Union[bytes, SpooledAttachment]
+
+
+class NotificationError(Exception):
+    """Verzenden mislukt; permanent betekent dat een nieuwe poging geen zin heeft"""
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def is_permanent_smtp_error(error: Exception) -> bool:
+    """5xx antwoorden (onbekende ontvanger, login geweigerd, ...) zijn permanent; 4xx en netwerkfouten niet"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return isinstance(error, smtplib.SMTPNotSupportedError)
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates")
+TEMPLATE_CACHE_DIR = os.path.join(DATA_DIR, "template_cache")
+# Alleen voor ontwikkeling: anders wordt elke template één keer per proces gecompileerd
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
+EMAIL_TEMPLATES = ("email_response.html", "email_response.txt")
+
+
+def _create_template_env() -> jinja2.Environment:
+    """Jinja2 environment met bytecode cache; de email templates worden direct geladen"""
+    bytecode_cache = None
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    except OSError as e:
+        logger.warning(f"Template cache {TEMPLATE_CACHE_DIR} unavailable: {e}")
+    
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(searchpath=TEMPLATE_DIR),
+        auto_reload=TEMPLATE_AUTO_RELOAD,
+        bytecode_cache=bytecode_cache
+    )
+    for name in EMAIL_TEMPLATES:
+        try:
+            env.get_template(name)
+        except jinja2.exceptions.TemplateNotFound:
+            logger.warning(f"Email template {name} not found")
+    return env
+
+
 # Set up Jinja2 environment for email templates
-template_loader = jinja2.FileSystemLoader(searchpath=os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates"))
-template_env = jinja2.Environment(loader=template_loader)
+template_env = _create_template_env()
+
+
+def render_template(name: str, **context) -> Optional[str]:
+    """Render een email template uit de (gecompileerde) cache.
+    
+    Returns:
+        str or None: None als de template niet bestaat
+    """
+    try:
+        return template_env.get_template(name).render(**context)
+    except jinja2.exceptions.TemplateNotFound:
+        return None
 
 
 class NotificationHandler:
@@ -39,8 +116,6 @@ class NotificationHandler:
         """
         self.smtp_config = smtp_config
         self.notification_email = notification_email
-        self.max_retries = 3
-        self.retry_delay = 5  # seconds
         
     def set_notification_email(self, email: str):
         """Set or update the notification email address.
@@ -118,30 +193,13 @@ class NotificationHandler:
         message["From"] = self.smtp_config["email"]
         message["To"] = recipient
         
-        # Create plain text version
-        text_content = f"""OCR Resultaat voor: {original_filename}
+        text_content = render_template("email_response.txt", filename=original_filename, result=formatted_result)
+        if text_content is None:
+            text_content = formatted_result.get("text", "")
         
-Model: {formatted_result.get('model', 'Unknown')}
-
--------- TEKST --------
-
-{formatted_result.get('text', 'Geen tekst gevonden.')}
-
-------------------------
-
-Automatisch verwerkt door Remarkable 2 naar Tekst Converter.
-        """
-        
-        # Create HTML version using template
-        try:
-            template = template_env.get_template("email_response.html")
-            html_content = template.render(
-                filename=original_filename,
-                result=formatted_result
-            )
-        except jinja2.exceptions.TemplateNotFound:
+        html_content = render_template("email_response.html", filename=original_filename, result=formatted_result)
+        if html_content is None:
             # Fallback to basic HTML if template not found
-            logger.warning("Email template niet gevonden, fallback naar basis HTML")
             html_content = f"""
             <html>
               <body>
@@ -163,17 +221,20 @@ Automatisch verwerkt door Remarkable 2 naar Tekst Converter.
         
         return message
         
-    async def send_ocr_result(self, ocr_result: Dict[str, Any], original_attachment: Optional[bytes] = None, 
+    async def send_ocr_result(self, ocr_result: Dict[str, Any], original_attachment: Optional[Original] = None, 
                               recipient: Optional[str] = None) -> bool:
         """Send OCR results via email.
         
         Args:
             ocr_result (dict): OCR processor result
-            original_attachment (bytes, optional): Original file
+            original_attachment (bytes or SpooledAttachment, optional): Original file; de aanroeper sluit de spool
             recipient (str, optional): Custom recipient (overrides default notification_email)
             
         Returns:
-            bool: Success status
+            bool: False als er geen ontvanger is of de email niet kon worden opgebouwd
+            
+        Raises:
+            NotificationError: Als verzenden mislukt
         """
         # Use default notification_email if recipient not specified
         target_email = recipient or self.notification_email
@@ -193,60 +254,210 @@ Automatisch verwerkt door Remarkable 2 naar Tekst Converter.
             original_filename = ocr_result.get("filename", "document.pdf")
             
             # Prepare email message
-            message = await self.prepare_email(target_email, formatted_result, original_filename)
+            with tracer.span("template_render"):
+                message = await self.prepare_email(target_email, formatted_result, original_filename)
             
             # Attach original file if provided
             if original_attachment:
-                attachment = MIMEApplication(original_attachment)
-                attachment.add_header(
-                    "Content-Disposition", 
-                    f"attachment; filename={original_filename}"
-                )
-                message.attach(attachment)
-            
-            # Send email with retry mechanism
-            return await self._send_with_retry(message, target_email)
+                # Wordt pas tijdens het versturen gelezen en base64 gecodeerd
+                attachment = StreamedAttachment(original_attachment, original_filename)
+                with tracer.span("attach_originals", bytes=attachment.size):
+                    message.attach(attachment)
             
         except Exception as e:
             logger.error(f"Fout bij voorbereiden notificatie email: {e}")
             return False
+        
+        await self._send(message, target_email)
+        return True
     
-    async def _send_with_retry(self, message: MIMEMultipart, recipient: str) -> bool:
-        """Send email with retry mechanism.
+    async def send_ocr_digest(self, items: List[Tuple[Dict[str, Any], Optional[Original]]],
+                              attachment_policy: str = NOTIFICATION_ATTACHMENTS,
+                              recipient: Optional[str] = None) -> bool:
+        """Send several OCR results as one combined email.
+        
+        Args:
+            items (list): (ocr_result, original_attachment) per document, in volgorde
+            attachment_policy (str): none, originals of zip
+            recipient (str, optional): Custom recipient (overrides default notification_email)
+            
+        Returns:
+            bool: False als er geen ontvanger is of de email niet kon worden opgebouwd
+            
+        Raises:
+            NotificationError: Als verzenden mislukt
+        """
+        target_email = recipient or self.notification_email
+        
+        if not target_email:
+            logger.error("Geen notificatie email adres ingesteld")
+            return False
+        
+        if len(items) == 1 and attachment_policy != "zip":
+            ocr_result, original = items[0]
+            return await self.send_ocr_result(
+                ocr_result, original if attachment_policy == "originals" else None, recipient=target_email
+            )
+        
+        created: List[SpooledAttachment] = []
+        try:
+            documents = []
+            for ocr_result, _ in items:
+                formatted_result = await self.format_ocr_result(ocr_result)
+                documents.append({"filename": ocr_result.get("filename", "document.pdf"), "result": formatted_result})
+            
+            with tracer.span("template_render", documents=len(documents)):
+                message = await self.prepare_digest_email(target_email, documents)
+            originals = [
+                (ocr_result.get("filename", "document.pdf"), original)
+                for ocr_result, original in items if original
+            ]
+            with tracer.span("attach_originals", policy=attachment_policy):
+                created = await run_blocking(self._attach_originals, message, originals, attachment_policy)
+            
+        except Exception as e:
+            logger.error(f"Fout bij voorbereiden digest email: {e}")
+            for spool in created:
+                spool.close()
+            return False
+        
+        try:
+            await self._send(message, target_email)
+        finally:
+            for spool in created:
+                spool.close()
+        return True
+    
+    async def prepare_digest_email(self, recipient: str, documents: List[Dict[str, Any]]) -> MIMEMultipart:
+        """Prepare one email with the OCR results of several documents.
+        
+        Args:
+            recipient (str): Recipient email
+            documents (list): Dicts met filename en het geformatteerde resultaat
+            
+        Returns:
+            MIMEMultipart: Prepared email message
+        """
+        message = MIMEMultipart("mixed")
+        message["Subject"] = f"OCR Resultaat: {len(documents)} documenten"
+        message["From"] = self.smtp_config["email"]
+        message["To"] = recipient
+        
+        text_content = render_template("email_response.txt", results=documents)
+        html_content = render_template("email_response.html", results=documents)
+        if text_content is None or html_content is None:
+            raise RuntimeError("Email templates not found")
+        
+        body = MIMEMultipart("alternative")
+        body.attach(MIMEText(text_content, "plain"))
+        body.attach(MIMEText(html_content, "html"))
+        message.attach(body)
+        
+        return message
+    
+    def _attach_originals(self, message: MIMEMultipart, originals: List[Tuple[str, Original]],
+                          policy: str) -> List[SpooledAttachment]:
+        """Voeg de originele bestanden toe volgens de attachment policy (blokkerend bij zip).
+        
+        De originelen worden pas tijdens het versturen gelezen. De zip wordt
+        blok voor blok in een eigen spool gebouwd (RAM of disk).
         
         Args:
             message: Prepared email message
-            recipient: Target email address
+            originals (list): (filename, bytes of spool) per document
+            policy (str): none, originals of zip
             
         Returns:
-            bool: Success status
+            list: Zelf aangemaakte spools; sluiten na het versturen
         """
-        retries = 0
+        if policy == "none" or not originals:
+            return []
         
-        while retries < self.max_retries:
+        if policy == "zip":
+            spool = SpooledAttachment()
             try:
-                context = ssl.create_default_context()
-                
-                with smtplib.SMTP(self.smtp_config["smtp_server"], self.smtp_config["smtp_port"]) as server:
-                    server.starttls(context=context)
-                    server.login(self.smtp_config["email"], self.smtp_config["password"])
-                    server.sendmail(
-                        self.smtp_config["email"],
-                        recipient,
-                        message.as_string()
-                    )
-                
-                logger.info(f"OCR notificatie succesvol verzonden naar {recipient}")
-                return True
-                
-            except Exception as e:
-                retries += 1
-                logger.error(f"Poging {retries}/{self.max_retries} om email te verzenden mislukt: {e}")
-                
-                if retries < self.max_retries:
-                    await asyncio.sleep(self.retry_delay)
-                    # Increase delay for next retry (exponential backoff)
-                    self.retry_delay *= 2
-        
-        logger.error(f"OCR notificatie kon niet worden verzonden na {self.max_retries} pogingen")
-        return False
+                with zipfile.ZipFile(_SpoolWriter(spool), "w", zipfile.ZIP_DEFLATED) as archive:
+                    used_names = set()
+                    for filename, data in originals:
+                        name = filename
+                        counter = 1
+                        while name in used_names:
+                            counter += 1
+                            name = f"{Path(filename).stem}_{counter}{Path(filename).suffix}"
+                        used_names.add(name)
+                        with archive.open(name, "w") as entry:
+                            if isinstance(data, SpooledAttachment):
+                                for chunk in data.iter_chunks(ATTACHMENT_READ_CHUNK):
+                                    entry.write(chunk)
+                            else:
+                                entry.write(data)
+            except BaseException:
+                spool.close()
+                raise
+            message.attach(StreamedAttachment(spool, "originelen.zip", "zip"))
+            return [spool]
+        
+        for filename, data in originals:
+            message.attach(StreamedAttachment(data, filename))
+        return []
+    
+    async def _send(self, message: MIMEMultipart, recipient: str):
+        """Send email once; retries are scheduled by the caller.
+        
+        Args:
+            message: Prepared email message
+            recipient: Target email address
+            
+        Raises:
+            NotificationError: Met permanent=True bij een 5xx antwoord van de server
+        """
+        user = self.smtp_config["email"]
+        try:
+            with stage_duration.time(user=user, stage="notify"), tracer.span("smtp_send"):
+                await smtp_delivery.send(self.smtp_config, message, recipient)
+        except Exception as e:
+            permanent = is_permanent_smtp_error(e)
+            kind = "permanent" if permanent else "tijdelijk"
+            logger.error(f"Email naar {recipient} verzenden mislukt ({kind}): {e!r}")
+            stage_errors.inc(user=user, stage="notify")
+            notifications_sent.inc(user=user, result="permanent_error" if permanent else "transient_error")
+            raise NotificationError(f"SMTP fout: {e}", permanent=permanent) from e
+        
+        notifications_sent.inc(user=user, result="sent")
+        logger.info(f"OCR notificatie succesvol verzonden naar {recipient}")
+
+
+class _SpoolWriter:
+    """Schrijfbaar, niet-seekbaar doel voor zipfile (die schrijft dan data descriptors)"""
+
+    def __init__(self, spool: SpooledAttachment):
+        self.spool = spool
+
+    def write(self, data: bytes) -> int:
+        self.spool.write(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def create_notification_handler(config_data: Dict[str, Any]) -> Optional[NotificationHandler]:
+    """Factory function voor een NotificationHandler uit de user config.
+    
+    Args:
+        config_data (dict): User configuratie (met SMTP gegevens)
+        
+    Returns:
+        NotificationHandler or None: None als er geen notificatie email is ingesteld
+    """
+    notification_email = config_data.get("notification_email")
+    if not notification_email:
+        return None
+    
+    smtp_config = {
+        "email": config_data["email"],
+        "password": config_data["password"],
+        "smtp_server": config_data["smtp_server"],
+        "smtp_port": config_data["smtp_port"]
+    }
+    return NotificationHandler(smtp_config, notification_email)
@@ -0,0 +1,204 @@
+"""
+OCR Result Cache voor Remarkable 2 naar Tekst Converter.
+
+Content-addressed cache in SQLite: de key is een hash van de bestandsinhoud,
+het model en de prompt. Dezelfde export opnieuw insturen kost zo geen
+OpenRouter call meer. Eviction op TTL en op totale grootte (LRU).
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from .storage import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "True").lower() == "true"
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", str(30 * 24 * 3600)))  # 30 dagen
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    cache_key TEXT PRIMARY KEY,
+    file_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache(last_access);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_version ON ocr_cache(model, prompt_hash);
+"""
+
+
+def hash_bytes(data: bytes) -> str:
+    """SHA-256 hex digest"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class OCRCache:
+    """Persistente OCR cache met TTL en grootte-limiet"""
+
+    def __init__(self, path: str, ttl: int = OCR_CACHE_TTL, max_bytes: int = OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        # Statistieken
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # WAL: workers lezen de cache terwijl een ander proces schrijft
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(_SCHEMA)
+            except sqlite3.Error:
+                conn.close()  # Volgende aanroep opnieuw proberen, niet zonder schema verder
+                raise
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(file_hash: str, model: str, prompt: str) -> str:
+        """Cache key op basis van bestand, model en prompt"""
+        return hash_bytes(f"{file_hash}\0{model}\0{prompt}".encode())
+
+    def get(self, file_hash: str, model: str, prompt: str) -> Optional[str]:
+        """Zoek een resultaat op; None bij een miss of verlopen entry"""
+        key = self.make_key(file_hash, model, prompt)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT text, created_at FROM ocr_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM ocr_cache WHERE cache_key = ?", (key,))
+                    conn.commit()
+                    self.evictions += 1
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE ocr_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"OCR cache lookup failed: {e}")
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, file_hash: str, model: str, prompt: str, text: str):
+        """Sla een OCR resultaat op en evict indien nodig"""
+        key = self.make_key(file_hash, model, prompt)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO ocr_cache "
+                    "(cache_key, file_hash, model, prompt_hash, text, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, file_hash, model, hash_bytes(prompt.encode()), text, len(text.encode()), now, now)
+                )
+                self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"OCR cache store failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """Verwijder verlopen entries en daarna de minst recent gebruikte boven max_bytes"""
+        expired = conn.execute("DELETE FROM ocr_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        self.evictions += expired
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT cache_key, size FROM ocr_cache ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM ocr_cache WHERE cache_key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def invalidate(self, model: Optional[str] = None, prompt: Optional[str] = None, keep_current: bool = False) -> int:
+        """Verwijder entries voor een model en/of prompt.
+
+        Met keep_current=True worden juist alle entries verwijderd die NIET bij
+        het opgegeven model/prompt horen (opruimen na een model- of promptwijziging).
+        Zonder argumenten wordt de hele cache geleegd.
+
+        Returns:
+            int: Aantal verwijderde entries (0 als de database niet beschikbaar is)
+        """
+        conditions, params = [], []
+        if model is not None:
+            conditions.append("model = ?")
+            params.append(model)
+        if prompt is not None:
+            conditions.append("prompt_hash = ?")
+            params.append(hash_bytes(prompt.encode()))
+
+        if not conditions:
+            sql = "DELETE FROM ocr_cache"
+        elif keep_current:
+            sql = f"DELETE FROM ocr_cache WHERE NOT ({' AND '.join(conditions)})"
+        else:
+            sql = f"DELETE FROM ocr_cache WHERE {' AND '.join(conditions)}"
+
+        with self._lock:
+            try:
+                conn = self._connection()
+                removed = conn.execute(sql, params).rowcount
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"OCR cache invalidate failed: {e}")
+                return 0
+        logger.info(f"OCR cache invalidated: {removed} entries removed")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Cache statistieken"""
+        with self._lock:
+            try:
+                entries, total = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache"
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"OCR cache stats failed: {e}")
+                entries, total = None, None
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+
+# Process-wide OCR cache
+ocr_cache: Optional[OCRCache] = OCRCache(os.path.join(DATA_DIR, "ocr_cache.sqlite3")) if OCR_CACHE_ENABLED else None
@@ -1,33 +1,71 @@
 """
 OCR Processing Module voor Remarkable 2 notities.
 Gebruikt OpenRouter API voor OCR-conversie van PDF/PNG bestanden.
+Meerpagina PDF's worden per pagina gelijktijdig verwerkt en weer samengevoegd.
 """
 
+import os
+import json
+import time
 import base64
+import asyncio
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
 import httpx
 
+from .http_pool import HTTPClientPool, openrouter_pool
+from .blocking_io import run_blocking
+from .ocr_cache import OCRCache, ocr_cache
+from .attachment_spool import CHUNK_SIZE, SpooledAttachment, base64_length, ensure_spooled
+from .ocr_scheduler import OCR_MAX_PER_KEY, ocr_scheduler
+from .rate_limiter import backoff_delay, openrouter_limits, parse_retry_after
+from .pdf_pages import PageDocument, PDFPages, can_split_pdf
+from .metrics import ocr_api_responses, ocr_documents, ocr_tokens, stage_duration, stage_errors
+from .tracing import tracer
+
 logger = logging.getLogger(__name__)
 
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+
+OCR_MAX_TOKENS = int(os.getenv("OCR_MAX_TOKENS", "4000"))
+
+# Per-pagina verwerking van meerpagina PDF's
+OCR_SPLIT_PDF = os.getenv("OCR_SPLIT_PDF", "True").lower() == "true"
+
+# Retries per API call bij 429, 5xx en verbindingsfouten. Dit is de enige retry laag binnen
+# een poging; een mislukt document (of pagina) gaat als job terug de queue in (JOB_MAX_ATTEMPTS).
+OCR_API_RETRIES = int(os.getenv("OCR_API_RETRIES", "4"))
+
+# Scheidingsteken tussen pagina's in de samengevoegde tekst
+PAGE_SEPARATOR = "\n\n"
+
+# Placeholder in de JSON body waar de base64 data gestreamd wordt
+_FILE_PLACEHOLDER = "@@REMARKABLE_OCR_FILE_BASE64@@"
+
+# Nederlandse prompt - simpel en effectief
+OCR_PROMPT = (
+    "Zet deze handgeschreven Nederlandse tekst om met OCR. "
+    "Behoud paragrafen, regeleinden en opmaak. "
+    "Extraheer tekst en corrigeer spelfouten waar nodig. "
+    "Stuur de output terug zonder commentaar. "
+)
+
 
 class OCRProcessor:
     """OCR processor using OpenRouter API with vision-capable models."""
     
-    def __init__(self, api_key: str, model: str = "google/gemini-2.5-flash"):
-        """Initialize OCR processor with API key and model."""
+    def __init__(self, api_key: str, model: str = "google/gemini-2.5-flash",
+                 prompt: str = OCR_PROMPT, cache: Optional[OCRCache] = ocr_cache,
+                 http_pool: HTTPClientPool = openrouter_pool, account: Optional[str] = None):
+        """Initialize OCR processor with API key, model, result cache and shared HTTP pool."""
         self.api_key = api_key
+        self.account = account or "unknown"  # user label voor metrics
         self.model = model
-        self.base_url = "https://openrouter.ai/api/v1"
-        self.client = httpx.AsyncClient(
-            timeout=120.0,
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "HTTP-Referer": "https://remarkable-ocr.local",
-                "X-Title": "Remarkable OCR Tool"
-            }
-        )
+        self.prompt = prompt
+        self.cache = cache
+        self.http_pool = http_pool
+        self.base_url = OPENROUTER_BASE_URL
     
     def _get_content_type(self, filename: str) -> str:
         """Get correct MIME type for file extension."""
@@ -41,47 +79,57 @@ class OCRProcessor:
         }
         return content_types.get(file_ext, 'application/octet-stream')
     
-    def _encode_base64(self, file_bytes: bytes) -> str:
-        """Encode bytes to base64 string."""
-        return base64.b64encode(file_bytes).decode('utf-8')
-    
-    async def process_attachment(self, filename: str, file_bytes: bytes) -> Dict[str, Any]:
-        """Process attachment for OCR and return extracted text."""
-        logger.info(f"Processing attachment: {filename} ({len(file_bytes)} bytes)")
+    async def process_attachment(self, filename: str, file_data: Union[bytes, SpooledAttachment],
+                                 allow_partial: bool = True, content_type: Optional[str] = None) -> Dict[str, Any]:
+        """Process attachment for OCR and return extracted text.
+        
+        Met allow_partial=False mislukt een PDF als één van de pagina's mislukt,
+        zodat de aanroeper (de job queue) het later opnieuw probeert; geslaagde
+        pagina's komen dan uit de cache.
+        
+        content_type is het type uit de mail (of uit de magic bytes); de
+        extensie van filename is alleen de fallback, want een gesnifte PDF
+        kan gewoon scan.bin heten.
+        """
+        file = ensure_spooled(file_data)
+        logger.info(f"Processing attachment: {filename} ({file.size} bytes)")
         
         try:
-            # Get correct content type
-            content_type = self._get_content_type(filename)
-            
-            # Nederlandse prompt - simpel en effectief
-            prompt = (
-                "Zet deze handgeschreven Nederlandse tekst om met OCR. "
-                "Behoud paragrafen, regeleinden en opmaak. "
-                "Extraheer tekst en corrigeer spelfouten waar nodig. "
-                "Stuur de output terug zonder commentaar. "
-            )
-            
-            # Encode to base64
-            file_b64 = self._encode_base64(file_bytes)
+            with stage_duration.time(user=self.account, stage="ocr"):
+                result = await self._process_file(filename, file, allow_partial, content_type)
+            ocr_documents.inc(user=self.account, result="success" if result["success"] else "failed")
+            if not result["success"]:
+                stage_errors.inc(user=self.account, stage="ocr")
+            return result
+        finally:
+            # Zelf aangemaakte spool opruimen; spools van de aanroeper blijven open
+            if file is not file_data:
+                file.close()
+    
+    async def _process_file(self, filename: str, file: SpooledAttachment, allow_partial: bool = True,
+                            content_type: Optional[str] = None) -> Dict[str, Any]:
+        """OCR een gespoold bestand (hele document of per pagina)."""
+        try:
+            # Opgegeven type gaat voor; de extensie alleen als er geen bruikbaar type is
+            if not content_type or content_type == 'application/octet-stream':
+                content_type = self._get_content_type(filename)
             
-            # Call API with correct content structure
-            response = await self._call_api(file_b64, prompt, content_type, filename)
+            # Hele document al eerder verwerkt? Dan ook niet splitsen (de hash is bij het spoolen berekend)
+            cached_text = await self._cached_text(filename, file)
+            if cached_text is not None:
+                return self._build_result(filename, file, content_type, cached_text, cache_hit=True)
             
-            # Extract text
-            extracted_text = ""
-            if response.get("choices") and len(response["choices"]) > 0:
-                extracted_text = response["choices"][0]["message"]["content"].strip()
+            if content_type == 'application/pdf' and OCR_SPLIT_PDF and can_split_pdf():
+                document = await self._open_pdf(filename, file)
+                if document is not None:
+                    try:
+                        if document.page_count > 1:
+                            return await self._process_pages(filename, file, document, allow_partial)
+                    finally:
+                        await run_blocking(document.close)
             
-            # Return result
-            return {
-                "text": extracted_text,
-                "filename": filename,
-                "confidence": "high" if len(extracted_text) > 50 else "low",
-                "model": self.model,
-                "file_size": len(file_bytes),
-                "content_type": content_type,
-                "success": True
-            }
+            extracted_text, cache_hit = await self._ocr_document(filename, file, content_type, lookup=False)
+            return self._build_result(filename, file, content_type, extracted_text, cache_hit=cache_hit)
             
         except Exception as e:
             logger.error(f"OCR processing failed for {filename}: {e}")
@@ -93,22 +141,162 @@ class OCRProcessor:
                 "success": False
             }
     
-    async def _call_api(self, file_b64: str, prompt: str, content_type: str, filename: str) -> Dict[str, Any]:
-        """Call OpenRouter API with file content."""
+    async def _open_pdf(self, filename: str, file: SpooledAttachment) -> Optional[PDFPages]:
+        """Open een PDF om per pagina te splitsen; bij fouten verwerken we het hele document"""
+        try:
+            return await run_blocking(PDFPages, filename, file)
+        except Exception as e:
+            logger.warning(f"Could not split {filename} into pages, sending whole document: {e}")
+            return None
+    
+    async def _cached_text(self, filename: str, file: SpooledAttachment) -> Optional[str]:
+        """Eerder OCR resultaat voor deze inhoud + model + prompt, of None"""
+        if not self.cache:
+            return None
+        cached_text = await run_blocking(self.cache.get, file.sha256, self.model, self.prompt)
+        if cached_text is not None:
+            logger.info(f"OCR cache hit for {filename}")
+        return cached_text
+    
+    async def _ocr_document(self, filename: str, file: SpooledAttachment, content_type: str,
+                            lookup: bool = True) -> Tuple[str, bool]:
+        """OCR één document of pagina, met cache lookup op inhoud + model + prompt.
+        
+        Returns:
+            tuple: (extracted_text, cache_hit)
+        """
+        file_hash = file.sha256
+        if lookup:
+            cached_text = await self._cached_text(filename, file)
+            if cached_text is not None:
+                return cached_text, True
+        
+        # Call API with correct content structure (rate limited, met retries)
+        response = await self._request_ocr(file, content_type, filename)
+        
+        # Extract text
+        extracted_text = ""
+        if response.get("choices") and len(response["choices"]) > 0:
+            extracted_text = response["choices"][0]["message"]["content"].strip()
+        
+        if self.cache and extracted_text:
+            await run_blocking(self.cache.put, file_hash, self.model, self.prompt, extracted_text)
+        
+        return extracted_text, False
+    
+    async def _ocr_page(self, document: PDFPages, index: int, rendering: asyncio.Semaphore) -> Dict[str, Any]:
+        """Render en OCR één pagina; transient API fouten zijn al opgevangen in _request_ocr"""
+        async with rendering:
+            started = time.monotonic()
+            page: Optional[PageDocument] = None
+            try:
+                page = await run_blocking(document.page, index)
+                text, cache_hit = await self._ocr_document(page.filename, page.file, page.content_type)
+                return {
+                    "page": index + 1,
+                    "text": text,
+                    "success": True,
+                    "cache_hit": cache_hit,
+                    "duration": round(time.monotonic() - started, 3)
+                }
+            except Exception as e:
+                logger.warning(f"OCR failed for page {index + 1} of {document.stem}: {e}")
+                return {
+                    "page": index + 1,
+                    "text": "",
+                    "success": False,
+                    "error": str(e),
+                    "duration": round(time.monotonic() - started, 3)
+                }
+            finally:
+                if page is not None:
+                    page.file.close()
+    
+    async def _process_pages(self, filename: str, file: SpooledAttachment, document: PDFPages,
+                             allow_partial: bool = True) -> Dict[str, Any]:
+        """OCR de pagina's gelijktijdig en voeg de tekst in paginavolgorde samen.
+        
+        Pagina's worden pas gerenderd als er een plek vrij is (zoveel als er per
+        API key tegelijk mogen), dus er staan nooit alle pagina's tegelijk open.
+        """
+        page_count = document.page_count
+        logger.info(f"Processing {filename} as {page_count} pages")
+        
+        # Resultaten per pagina invullen zodra ze binnenkomen
+        page_results: List[Optional[Dict[str, Any]]] = [None] * page_count
+        rendering = asyncio.Semaphore(OCR_MAX_PER_KEY)
+        tasks = [asyncio.create_task(self._ocr_page(document, index, rendering)) for index in range(page_count)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                page_results[result["page"] - 1] = result
+                done = sum(1 for r in page_results if r is not None)
+                logger.info(f"{filename}: page {result['page']} {'done' if result['success'] else 'FAILED'} "
+                            f"in {result['duration']}s ({done}/{page_count})")
+        finally:
+            # Geannuleerd (bijv. worker stop): geen pagina's meer renderen uit een document dat we sluiten
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        failed_pages = [r["page"] for r in page_results if not r["success"]]
+        if len(failed_pages) == page_count:
+            raise RuntimeError(f"Alle {page_count} pagina's mislukt: {page_results[0].get('error')}")
+        if failed_pages and not allow_partial:
+            error = next(r["error"] for r in page_results if not r["success"])
+            raise RuntimeError(f"{len(failed_pages)} van {page_count} pagina's mislukt ({failed_pages}): {error}")
+        
+        stitched_text = PAGE_SEPARATOR.join(
+            r["text"] if r["success"] else f"[Pagina {r['page']} kon niet worden verwerkt]"
+            for r in page_results
+        )
+        
+        if self.cache and not failed_pages and stitched_text:
+            await run_blocking(self.cache.put, file.sha256, self.model, self.prompt, stitched_text)
+        
+        result = self._build_result(filename, file, 'application/pdf', stitched_text, cache_hit=False)
+        result["pages"] = [{k: v for k, v in r.items() if k != "text"} for r in page_results]
+        result["page_count"] = page_count
+        result["failed_pages"] = failed_pages
+        return result
+    
+    def _build_result(self, filename: str, file: SpooledAttachment, content_type: str,
+                      extracted_text: str, cache_hit: bool) -> Dict[str, Any]:
+        """Bouw het resultaat dict voor een geslaagde OCR (of cache hit)."""
+        return {
+            "text": extracted_text,
+            "filename": filename,
+            "confidence": "high" if len(extracted_text) > 50 else "low",
+            "model": self.model,
+            "file_size": file.size,
+            "content_type": content_type,
+            "cache_hit": cache_hit,
+            "success": True
+        }
+    
+    def _build_request_body(self, file: SpooledAttachment, prompt: str, content_type: str,
+                            filename: str) -> Tuple[int, AsyncIterator[bytes]]:
+        """Bouw de JSON request body als stream: base64 wordt per blok ge-encodeerd.
+        
+        Returns:
+            tuple: (content_length, async iterator met body chunks)
+        """
+        data_url = f"data:{content_type};base64,{_FILE_PLACEHOLDER}"
+        
         # PDF vs Image - gebruik juiste content structure
         if content_type == 'application/pdf':
             content_item = {
                 "type": "file",
                 "file": {
                     "filename": filename,
-                    "file_data": f"data:{content_type};base64,{file_b64}"
+                    "file_data": data_url
                 }
             }
         else:
             content_item = {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:{content_type};base64,{file_b64}"
+                    "url": data_url
                 }
             }
         
@@ -123,19 +311,113 @@ class OCRProcessor:
                     ]
                 }
             ],
-            "max_tokens": 4000,
+            "max_tokens": OCR_MAX_TOKENS,
             "temperature": 0.0,
             "data_collection": "deny"
         }
         
-        response = await self.client.post(
+        prefix, suffix = json.dumps(payload).encode().split(_FILE_PLACEHOLDER.encode(), 1)
+        content_length = len(prefix) + base64_length(file.size) + len(suffix)
+        
+        async def body() -> AsyncIterator[bytes]:
+            yield prefix
+            offset = 0
+            encode_time = 0.0
+            while offset < file.size:
+                chunk = await run_blocking(file.read_at, offset, CHUNK_SIZE)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                started = time.perf_counter()
+                encoded = base64.b64encode(chunk)
+                encode_time += time.perf_counter() - started
+                yield encoded
+            # Encoderen loopt door de upload heen; als één opgetelde stap in de trace
+            tracer.record("base64_encode", encode_time, bytes=offset)
+            yield suffix
+        
+        return content_length, body()
+    
+    async def _request_ocr(self, file: SpooledAttachment, content_type: str, filename: str) -> Dict[str, Any]:
+        """OCR API call met token bucket, Retry-After, backoff met jitter en circuit breaker."""
+        bucket = openrouter_limits.bucket(self.api_key)
+        breaker = openrouter_limits.breaker
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            with tracer.span("rate_limit_wait"):
+                await breaker.wait_until_available()
+                await bucket.acquire()
+            
+            started = time.monotonic()
+            try:
+                # Begrensd per API key en globaal; body wordt per poging opnieuw gestreamd
+                with tracer.span("api_call", attempt=attempt, model=self.model) as span:
+                    response = await ocr_scheduler.run(
+                        self.api_key,
+                        lambda: self._call_api(file, self.prompt, content_type, filename)
+                    )
+                    span.set(status=response.status_code)
+            except httpx.TransportError as e:
+                ocr_api_responses.inc(user=self.account, status="error")
+                stage_errors.inc(user=self.account, stage="ocr_api")
+                breaker.record_failure()
+                if attempt > OCR_API_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"OpenRouter connection error for {filename} (attempt {attempt}): {e}, retrying in {delay:.1f}s")
+            else:
+                bucket.update_from_headers(response.headers)
+                status = response.status_code
+                stage_duration.observe(time.monotonic() - started, user=self.account, stage="ocr_api")
+                ocr_api_responses.inc(user=self.account, status=str(status))
+                
+                if status == 429:
+                    # Upstream is bereikbaar; alleen deze key afremmen
+                    breaker.record_success()
+                    openrouter_limits.throttled += 1
+                    retry_after = parse_retry_after(response.headers.get("retry-after"))
+                    bucket.pause(retry_after if retry_after is not None else backoff_delay(attempt))
+                    delay = 0.0
+                elif status >= 500:
+                    breaker.record_failure()
+                    retry_after = parse_retry_after(response.headers.get("retry-after"))
+                    delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                else:
+                    breaker.record_success()
+                    response.raise_for_status()
+                    with tracer.span("response_parse"):
+                        data = response.json()
+                    self._record_usage(data)
+                    return data
+                
+                if attempt > OCR_API_RETRIES:
+                    response.raise_for_status()
+                logger.warning(f"OpenRouter returned {status} for {filename} (attempt {attempt}), retrying")
+            
+            openrouter_limits.retries += 1
+            if delay:
+                await asyncio.sleep(delay)
+    
+    def _record_usage(self, data: Dict[str, Any]):
+        """Token gebruik uit de OpenRouter response naar metrics"""
+        usage = data.get("usage") or {}
+        for kind in ("prompt", "completion"):
+            tokens = usage.get(f"{kind}_tokens")
+            if tokens:
+                ocr_tokens.inc(tokens, user=self.account, model=self.model, type=kind)
+    
+    async def _call_api(self, file: SpooledAttachment, prompt: str, content_type: str, filename: str) -> httpx.Response:
+        """Call OpenRouter API with file content (gestreamde request body)."""
+        content_length, body = self._build_request_body(file, prompt, content_type, filename)
+        
+        return await self.http_pool.post(
             f"{self.base_url}/chat/completions",
-            json=payload
+            api_key=self.api_key,
+            content=body,
+            headers={
+                "Content-Type": "application/json",
+                "Content-Length": str(content_length)
+            }
         )
-        response.raise_for_status()
-        return response.json()
-    
-    async def close(self):
-        """Close HTTP client."""
-        if hasattr(self, 'client'):
-            await self.client.aclose()
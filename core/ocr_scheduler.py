@@ -0,0 +1,81 @@
+"""
+OCR Scheduler voor Remarkable 2 naar Tekst Converter.
+
+Verdeelt OCR calls over alle gebruikers met twee limieten:
+- Globaal maximum aantal gelijktijdige OCR calls in dit proces
+- Maximum per OpenRouter API key (rate limits gelden per key)
+
+De limieten gelden per API call, zodat pagina's van één document en
+attachments van verschillende berichten dezelfde slots delen.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", "8"))
+OCR_MAX_PER_KEY = int(os.getenv("OCR_MAX_PER_KEY", "4"))
+
+
+def _key_id(api_key: str) -> str:
+    """Korte, niet-geheime identifier voor een API key (voor logs en stats)"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+class OCRScheduler:
+    """Begrenst gelijktijdige OCR calls globaal en per API key"""
+
+    def __init__(self, max_concurrency: int = OCR_MAX_CONCURRENCY, max_per_key: int = OCR_MAX_PER_KEY):
+        self.max_concurrency = max_concurrency
+        self.max_per_key = max_per_key
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._per_key: Dict[str, asyncio.Semaphore] = {}
+
+        # Statistieken
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+
+    def _key_semaphore(self, api_key: str) -> asyncio.Semaphore:
+        key_id = _key_id(api_key)
+        if key_id not in self._per_key:
+            self._per_key[key_id] = asyncio.Semaphore(self.max_per_key)
+        return self._per_key[key_id]
+
+    async def run(self, api_key: str, job: Callable[[], Awaitable[Any]]) -> Any:
+        """Voer één OCR job uit zodra er ruimte is voor deze key en globaal"""
+        self.waiting += 1
+        started = False
+        try:
+            async with self._key_semaphore(api_key):
+                async with self._global:
+                    self.waiting -= 1
+                    started = True
+                    self.active += 1
+                    try:
+                        return await job()
+                    finally:
+                        self.active -= 1
+                        self.completed += 1
+        finally:
+            if not started:
+                self.waiting -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Scheduler statistieken"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_per_key": self.max_per_key,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "keys": len(self._per_key)
+        }
+
+
+# Process-wide OCR scheduler
+ocr_scheduler = OCRScheduler()
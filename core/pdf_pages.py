@@ -0,0 +1,104 @@
+"""
+PDF page splitting voor per-pagina OCR.
+
+Gebruikt optionele dependencies:
+- PyMuPDF (fitz): rendert pagina's naar PNG (beste OCR resultaat voor handschrift)
+- pypdf: splitst naar losse één-pagina PDF's
+
+Het document wordt vanaf de spool gelezen (het bestand in de job queue, of
+een stream over de spool) en pagina's komen één voor één uit PDFPages, elk
+in een eigen spool. Zo staat nooit de hele PDF plus al zijn pagina's in
+geheugen. Zonder een van beide libraries blijft de OCR processor hele
+documenten versturen.
+"""
+
+import io
+import os
+import logging
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+
+from .attachment_spool import SpooledAttachment
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+# Render pagina's naar PNG als PyMuPDF beschikbaar is
+OCR_PDF_RASTERIZE = os.getenv("OCR_PDF_RASTERIZE", "True").lower() == "true"
+OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", "150"))
+
+
+@dataclass
+class PageDocument:
+    """Eén pagina van een PDF, klaar voor OCR; de aanroeper sluit file"""
+    number: int  # 1-based
+    filename: str
+    content_type: str
+    file: SpooledAttachment
+
+
+def can_split_pdf() -> bool:
+    """Check of er een PDF library beschikbaar is"""
+    return fitz is not None or PdfReader is not None
+
+
+class PDFPages:
+    """Een geopende PDF waaruit pagina's op verzoek komen (blokkerend/CPU, draai via de I/O pool).
+
+    De libraries zijn niet thread-safe; page() kan uit meerdere threads
+    komen en loopt daarom onder een lock.
+    """
+
+    def __init__(self, filename: str, source: SpooledAttachment):
+        self.stem = Path(filename).stem
+        self._lock = threading.Lock()
+        self._document = None
+        self._reader = None
+        self._stream = None
+
+        if fitz is not None and OCR_PDF_RASTERIZE:
+            if source.path:
+                self._document = fitz.open(source.path, filetype="pdf")
+            else:
+                # fitz leest alleen een pad of bytes; spools zonder pad zijn klein (RAM) of tijdelijk
+                self._document = fitz.open(stream=source.read_bytes(), filetype="pdf")
+            self.page_count = self._document.page_count
+        elif PdfReader is not None:
+            self._stream = source.reader()
+            self._reader = PdfReader(self._stream)
+            self.page_count = len(self._reader.pages)
+        else:
+            raise RuntimeError("Geen PDF library beschikbaar (PyMuPDF of pypdf)")
+
+    def page(self, index: int) -> PageDocument:
+        """Pagina index (0-based) als eigen spool"""
+        number = index + 1
+        with self._lock:
+            if self._document is not None:
+                png = self._document[index].get_pixmap(dpi=OCR_PDF_DPI).tobytes("png")
+                return PageDocument(number, f"{self.stem}_p{number}.png", "image/png",
+                                    SpooledAttachment.from_bytes(png))
+
+            writer = PdfWriter()
+            writer.add_page(self._reader.pages[index])
+            buffer = io.BytesIO()
+            writer.write(buffer)
+        return PageDocument(number, f"{self.stem}_p{number}.pdf", "application/pdf",
+                            SpooledAttachment.from_bytes(buffer.getvalue()))
+
+    def close(self):
+        with self._lock:
+            if self._document is not None:
+                self._document.close()
+            if self._stream is not None:
+                self._stream.close()
@@ -0,0 +1,445 @@
+"""
+Centrale poll scheduler voor alle mailboxes van dit proces.
+
+Verantwoordelijk voor:
+- Eén heap met de volgende check per mailbox, in plaats van een task per gebruiker
+- Jitter op elk interval en gespreide eerste checks, zodat duizenden
+  mailboxes niet tegelijk bij dezelfde IMAP provider aankloppen
+- Een globaal maximum aan gelijktijdige mailbox checks
+- Adaptieve intervallen: snel na een hit, geleidelijk langzamer bij stilte
+- Backoff na fouten, en status per mailbox (ook na stoppen) voor /debug/polling
+- Per IMAP host een verbindingsbudget: gelijktijdige checks en persistente
+  (IDLE) verbindingen tellen samen mee voor de limiet van de provider
+- Backoff van een hele host als meerdere accounts daar niet meer in kunnen
+  loggen, met daarna één proef check voordat de rest weer mag
+
+Mailboxes met IDLE hebben geen timer: hun watcher vraagt na nieuwe mail (of
+na een IDLE renew) een check aan met trigger(). Ook die checks gaan door de
+concurrency limiet, dus een golf aan push meldingen wordt netjes afgewerkt.
+Checks die op een vol host budget wachten staan per host in de rij en lopen
+direct na elkaar zodra er ruimte is.
+"""
+
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .imap_session import IMAPConnectError
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+POLL_MAX_CONCURRENCY = int(os.getenv("POLL_MAX_CONCURRENCY", "8"))
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))  # ± fractie van elk interval
+POLL_START_SPACING = 0.1  # seconds per al geregistreerde mailbox; spreidt de eerste checks na een (her)start
+
+# Adaptieve polling voor servers zonder IDLE
+POLL_INTERVAL_MIN = 10
+POLL_BACKOFF_FACTOR = 1.5
+POLL_INTERVAL_MAX_FACTOR = 4  # maximaal interval = basis interval * factor
+
+# Backoff na fouten (verbinding weg, login geweigerd)
+RECONNECT_BACKOFF_MIN = 1
+RECONNECT_BACKOFF_MAX = 300
+
+POLL_HISTORY_SIZE = 1000  # gestopte mailboxes die in de stats blijven
+
+# Verbindingsbudget per IMAP host (providers tellen alle verbindingen vanaf ons IP)
+IMAP_HOST_MAX_CONNECTIONS = int(os.getenv("IMAP_HOST_MAX_CONNECTIONS", "200"))
+POLL_HOST_MAX_CONCURRENCY = int(os.getenv("POLL_HOST_MAX_CONCURRENCY", "4"))  # gelijktijdige checks per host
+
+# Host-brede backoff zodra zoveel verschillende accounts achter elkaar niet kunnen verbinden/inloggen
+HOST_LOGIN_FAILURES = 3
+HOST_BACKOFF_MIN = 30
+HOST_BACKOFF_MAX = 900
+HOST_LATENCY_ALPHA = 0.2  # gewicht van de laatste check in het voortschrijdend gemiddelde
+
+# Eén check: (aantal nieuwe berichten, push) waarbij push betekent dat een IDLE
+# watcher de volgende check zelf aanvraagt
+CheckFunc = Callable[[], Awaitable[Tuple[int, bool]]]
+
+
+@dataclass
+class PollEntry:
+    """Planning en statistieken van één mailbox"""
+    key: str
+    check: CheckFunc
+    base_interval: float
+    interval: float
+    host: str = ""
+    due: Optional[float] = None  # monotonic; None = draait of wacht op trigger()
+    state: str = "scheduled"  # scheduled, waiting (host budget), running, push, backoff, stopped
+    reconnect_delay: float = RECONNECT_BACKOFF_MIN
+    triggered: bool = False  # trigger() tijdens een lopende check
+    checks: int = 0
+    hits: int = 0
+    errors: int = 0
+    last_check: Optional[float] = None  # epoch
+    last_duration: Optional[float] = None
+    last_lag: Optional[float] = None
+    last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "state": self.state,
+            "interval": round(self.interval, 1),
+            "next_check_in": round(max(self.due - time.monotonic(), 0.0), 1) if self.due is not None else None,
+            "checks": self.checks,
+            "hits": self.hits,
+            "errors": self.errors,
+            "last_check": round(self.last_check, 3) if self.last_check else None,
+            "last_duration": round(self.last_duration, 3) if self.last_duration is not None else None,
+            "last_lag": round(self.last_lag, 3) if self.last_lag is not None else None,
+            "last_error": self.last_error
+        }
+
+
+@dataclass
+class HostState:
+    """Verbindingsbudget, latency en fouten van één IMAP host"""
+    host: str
+    active: int = 0  # lopende checks
+    held: Set[str] = field(default_factory=set)  # mailboxes met een persistente verbinding
+    waiting: Deque[PollEntry] = field(default_factory=deque)
+    failed_accounts: Set[str] = field(default_factory=set)  # sinds de laatste geslaagde check
+    backoff_until: float = 0.0  # monotonic
+    backoff_delay: float = HOST_BACKOFF_MIN
+    probing: bool = False  # na een host backoff: één check tegelijk tot er één slaagt
+    checks: int = 0
+    errors: int = 0
+    backoffs: int = 0
+    latency: Optional[float] = None  # voortschrijdend gemiddelde van de checkduur
+    lag: Optional[float] = None
+
+    @property
+    def check_limit(self) -> int:
+        # Persistente verbindingen plus lopende checks blijven binnen IMAP_HOST_MAX_CONNECTIONS
+        if self.probing:
+            return 1
+        return max(min(POLL_HOST_MAX_CONCURRENCY, IMAP_HOST_MAX_CONNECTIONS - len(self.held)), 1)
+
+    def can_hold(self, key: str) -> bool:
+        # Ruimte overhouden voor checks van mailboxes zonder eigen verbinding
+        return key in self.held or len(self.held) < IMAP_HOST_MAX_CONNECTIONS - POLL_HOST_MAX_CONCURRENCY
+
+    def observe(self, duration: float, lag: float):
+        if self.latency is None:
+            self.latency, self.lag = duration, lag
+        else:
+            self.latency += HOST_LATENCY_ALPHA * (duration - self.latency)
+            self.lag += HOST_LATENCY_ALPHA * (lag - self.lag)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "active_checks": self.active,
+            "persistent_connections": len(self.held),
+            "waiting": len(self.waiting),
+            "check_limit": self.check_limit,
+            "backoff_remaining": round(self.backoff_until - now, 1) if self.backoff_until > now else 0,
+            "probing": self.probing,
+            "failed_accounts": len(self.failed_accounts),
+            "checks": self.checks,
+            "errors": self.errors,
+            "backoffs": self.backoffs,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "lag": round(self.lag, 3) if self.lag is not None else None
+        }
+
+
+def _jitter(delay: float) -> float:
+    return delay * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER) if delay > 0 else 0.0
+
+
+class PollScheduler:
+    """Plant mailbox checks via een deadline-heap met een globale en per-host concurrency limiet"""
+
+    def __init__(self, max_concurrency: int = POLL_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._entries: Dict[str, PollEntry] = {}
+        self._hosts: Dict[str, HostState] = {}
+        self._heap: List[Tuple[float, int, str]] = []  # (due, volgnummer, key); verouderde items worden overgeslagen
+        self._sequence = itertools.count()
+        self._stopped: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """Start de dispatcher (FastAPI lifespan of worker entrypoint)"""
+        if self._task is not None:
+            return
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Poll scheduler started (max {self.max_concurrency} concurrent checks)")
+
+    async def stop(self):
+        """Stop de dispatcher en lopende checks"""
+        tasks = list(self._running)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add(self, key: str, check: CheckFunc, interval: float, host: str = ""):
+        """Registreer een mailbox; de eerste check volgt binnen een gespreid moment"""
+        if key in self._entries:
+            self.remove(key)
+        # Eén mailbox start direct; bij een herstart met veel mailboxes lopen de eerste checks uiteen
+        spread = min(interval, len(self._entries) * POLL_START_SPACING)
+        host = host.lower()
+        entry = PollEntry(key=key, check=check, base_interval=interval, interval=interval, host=host)
+        if host not in self._hosts:
+            self._hosts[host] = HostState(host)
+        self._entries[key] = entry
+        self._stopped.pop(key, None)
+        self._schedule(entry, random.uniform(0, spread))
+
+    def remove(self, key: str):
+        """Meld een mailbox af; een lopende check maakt zijn werk af maar wordt niet opnieuw gepland"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        entry.state = "stopped"
+        entry.due = None
+        self._release_connection(entry)
+        self._stopped[key] = {**entry.to_dict(), "stopped_at": round(time.time(), 3)}
+        while len(self._stopped) > POLL_HISTORY_SIZE:
+            self._stopped.popitem(last=False)
+
+    def trigger(self, key: str):
+        """Vraag zo snel mogelijk een check aan (bijv. na IDLE activiteit)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        if entry.state == "running":
+            entry.triggered = True
+        elif entry.state not in ("backoff", "waiting"):
+            self._schedule(entry, 0.0)
+
+    def backoff(self, key: str, error: str):
+        """Plan de volgende check met backoff na een fout buiten een check (bijv. in de IDLE watcher)"""
+        entry = self._entries.get(key)
+        if entry is None or entry.state in ("running", "waiting"):
+            return
+        self._record_error(entry, error)
+        self._release_connection(entry)
+        self._schedule(entry, _jitter(self._next_backoff(entry)))
+
+    def hold_connection(self, key: str) -> bool:
+        """Mag deze mailbox een persistente (IDLE) verbinding houden binnen het budget van zijn host?"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        host = self._hosts[entry.host]
+        if not host.can_hold(key):
+            return False
+        host.held.add(key)
+        return True
+
+    def _release_connection(self, entry: PollEntry):
+        host = self._hosts.get(entry.host)
+        if host is not None:
+            host.held.discard(entry.key)
+
+    def _schedule(self, entry: PollEntry, delay: float):
+        entry.due = time.monotonic() + delay
+        if entry.state != "backoff":
+            entry.state = "scheduled"
+        heapq.heappush(self._heap, (entry.due, next(self._sequence), entry.key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @staticmethod
+    def _next_backoff(entry: PollEntry) -> float:
+        delay = entry.reconnect_delay
+        entry.reconnect_delay = min(entry.reconnect_delay * 2, RECONNECT_BACKOFF_MAX)
+        return delay
+
+    @staticmethod
+    def _record_error(entry: PollEntry, error: str):
+        entry.errors += 1
+        entry.last_error = error
+        entry.state = "backoff"
+
+    async def _loop(self):
+        while True:
+            # Eerst een vrije plek, dan pas de volgende deadline: bij drukte schuiven checks op
+            await self._slots.acquire()
+            try:
+                entry = await self._next_due()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._run(entry))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _next_due(self) -> PollEntry:
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._heap:
+                due, _, key = self._heap[0]
+                entry = self._entries.get(key)
+                if entry is None or entry.due != due:
+                    heapq.heappop(self._heap)  # Gestopt of opnieuw gepland
+                    continue
+                if due > now:
+                    break
+                heapq.heappop(self._heap)
+                host = self._hosts[entry.host]
+                if host.backoff_until > now:
+                    # Hele host in backoff: na afloop gespreid opnieuw proberen
+                    entry.state = "backoff"
+                    self._schedule(entry, host.backoff_until - now + random.uniform(0, POLL_JITTER * HOST_BACKOFF_MIN))
+                    continue
+                if host.active >= host.check_limit:
+                    entry.state = "waiting"
+                    host.waiting.append(entry)
+                    continue
+                host.active += 1  # Telt vanaf het moment van uitdelen, niet pas als de task draait
+                return entry
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, entry: PollEntry):
+        """Eén check uitvoeren en de volgende plannen"""
+        host = self._hosts[entry.host]
+        lag = time.monotonic() - entry.due
+        entry.last_lag = lag
+        poll_lag.observe(lag)
+        entry.due = None
+        entry.state = "running"
+        entry.triggered = False
+        started = time.monotonic()
+        delay: Optional[float]
+        try:
+            new_messages, push = await entry.check()
+        except Exception as e:
+            self._record_error(entry, f"{type(e).__name__}: {e}")
+            self._release_connection(entry)
+            host.errors += 1
+            if isinstance(e, IMAPConnectError):
+                self._login_failed(host, entry.key)
+            delay = self._next_backoff(entry)
+            logger.warning(f"Check for {entry.key} failed, next attempt in {delay:.0f}s")
+        else:
+            entry.reconnect_delay = RECONNECT_BACKOFF_MIN
+            if host.probing or host.failed_accounts:
+                if host.probing:
+                    logger.info(f"IMAP host {host.host} reachable again")
+                host.probing = False
+                host.failed_accounts.clear()
+                host.backoff_delay = HOST_BACKOFF_MIN
+            if new_messages:
+                entry.hits += 1
+                entry.interval = min(POLL_INTERVAL_MIN, entry.base_interval)
+            else:
+                entry.interval = min(entry.interval * POLL_BACKOFF_FACTOR,
+                                     entry.base_interval * POLL_INTERVAL_MAX_FACTOR)
+            entry.state = "push" if push else "scheduled"
+            delay = None if push else entry.interval
+        finally:
+            self._slots.release()
+            duration = time.monotonic() - started
+            entry.checks += 1
+            entry.last_check = time.time()
+            entry.last_duration = duration
+            host.active -= 1
+            host.checks += 1
+            host.observe(duration, lag)
+            host_check_duration.observe(duration, host=host.host)
+            self._release_waiting(host)
+
+        if self._entries.get(entry.key) is not entry:
+            return  # Gestopt tijdens de check
+        if entry.triggered and entry.state != "backoff":
+            delay = 0.0
+        if delay is not None:
+            self._schedule(entry, _jitter(delay))
+
+    def _login_failed(self, host: HostState, key: str):
+        """Verbinden/inloggen mislukt; bij genoeg verschillende accounts gaat de hele host in backoff"""
+        host.failed_accounts.add(key)
+        if host.backoff_until > time.monotonic():
+            return  # Checks die al liepen toen de host in backoff ging
+        if not host.probing and len(host.failed_accounts) < HOST_LOGIN_FAILURES:
+            return
+        delay = _jitter(host.backoff_delay)
+        host.backoff_until = time.monotonic() + delay
+        host.backoff_delay = min(host.backoff_delay * 2, HOST_BACKOFF_MAX)
+        host.probing = True
+        host.backoffs += 1
+        logger.warning(f"IMAP host {host.host} refuses logins ({len(host.failed_accounts)} accounts), "
+                       f"pausing all checks for {delay:.0f}s")
+
+    def _release_waiting(self, host: HostState):
+        """Wachtende checks van deze host direct achter elkaar laten lopen zodra er ruimte is"""
+        room = host.check_limit - host.active
+        while host.waiting and room > 0:
+            entry = host.waiting.popleft()
+            if self._entries.get(entry.key) is not entry or entry.state != "waiting":
+                continue
+            entry.state = "scheduled"
+            # Oorspronkelijke deadline houden: de wachttijd telt mee in de lag
+            heapq.heappush(self._heap, (entry.due, next(self._sequence), entry.key))
+            room -= 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def state_counts(self) -> Dict[str, int]:
+        return dict(Counter(entry.state for entry in self._entries.values()))
+
+    def get_host_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: host.to_dict() for name, host in self._hosts.items()}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": len(self._running),
+            "states": self.state_counts(),
+            "hosts": self.get_host_stats(),
+            "mailboxes": {key: entry.to_dict() for key, entry in self._entries.items()},
+            "stopped": dict(self._stopped)
+        }
+
+
+# Process-wide scheduler
+poll_scheduler = PollScheduler()
+
+poll_lag = metrics.histogram(
+    "remarkable_poll_lag_seconds", "Vertraging tussen geplande en werkelijke start van een mailbox check",
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0)
+)
+host_check_duration = metrics.histogram(
+    "remarkable_imap_host_check_seconds", "Duur van mailbox checks per IMAP host", ("host",)
+)
+metrics.gauge(
+    "remarkable_imap_host_connections", "Lopende checks plus persistente verbindingen per IMAP host", ("host",),
+    callback=lambda: {(name,): host["active_checks"] + host["persistent_connections"]
+                      for name, host in poll_scheduler.get_host_stats().items()}
+)
+metrics.gauge(
+    "remarkable_imap_host_backoff", "1 als een IMAP host in backoff staat na geweigerde logins", ("host",),
+    callback=lambda: {(name,): int(host["backoff_remaining"] > 0) for name, host in poll_scheduler.get_host_stats().items()}
+)
+metrics.gauge(
+    "remarkable_poll_mailboxes", "Mailboxes in de poll scheduler per toestand", ("state",),
+    callback=lambda: {(state,): count for state, count in poll_scheduler.state_counts().items()}
+)
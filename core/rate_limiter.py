@@ -0,0 +1,205 @@
+"""
+Rate limiting en circuit breaker voor OpenRouter calls.
+
+Verantwoordelijk voor:
+- Token bucket per API key, bijgestuurd met X-RateLimit-* response headers
+- Retry-After parsing en exponentiële backoff met jitter
+- Circuit breaker die OCR dispatch pauzeert zolang OpenRouter plat ligt
+"""
+
+import os
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Vaste limiet in requests per seconde per key; 0 (standaard) = geen eigen limiet, alleen wat
+# OpenRouter via X-RateLimit-* headers en 429/Retry-After aangeeft. Betaalde modellen hebben
+# geen vaste limiet; zet dit bijv. op 0.33 voor een :free model (20 requests per minuut).
+OPENROUTER_RATE = float(os.getenv("OPENROUTER_RATE", "0"))
+OPENROUTER_BURST = int(os.getenv("OPENROUTER_BURST", "5"))
+
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60"))
+_HALF_OPEN_POLL_SECONDS = 0.5
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Exponentiële backoff met full jitter (attempt begint bij 1)"""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse een Retry-After header (seconden of HTTP datum) naar seconden"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Async token bucket; rate en pauzes worden bijgestuurd vanuit response headers.
+
+    Met rate 0 is er geen limiet tot OpenRouter er een opgeeft (headers of 429).
+    """
+
+    def __init__(self, rate: float = OPENROUTER_RATE, capacity: int = OPENROUTER_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wacht tot er een token beschikbaar is (en een eventuele pauze voorbij is)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.rate <= 0:
+                    return
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Geen requests meer voor deze key gedurende seconds (bijv. na 429)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Stem de bucket af op X-RateLimit-Limit/Remaining/Reset van OpenRouter"""
+        remaining = headers.get("x-ratelimit-remaining")
+        reset = headers.get("x-ratelimit-reset")
+        limit = headers.get("x-ratelimit-limit")
+        try:
+            if remaining is not None:
+                self.tokens = min(self.tokens, float(remaining))
+            if reset is not None:
+                # OpenRouter geeft een epoch timestamp in milliseconden
+                reset_at = float(reset)
+                seconds_left = (reset_at / 1000 if reset_at > 1e11 else reset_at) - time.time()
+                if remaining is not None and float(remaining) <= 0 and seconds_left > 0:
+                    self.pause(seconds_left)
+                elif limit is not None and seconds_left > 0:
+                    # Verdeel wat er over is gelijkmatig over het resterende window
+                    self.rate = max(float(remaining if remaining is not None else limit) / seconds_left, 0.05)
+                    self.capacity = max(int(float(limit)), 1)
+        except ValueError:
+            logger.debug(f"Unparseable rate limit headers: {dict(headers)}")
+
+
+class CircuitBreaker:
+    """Closed → open na herhaalde upstream fouten → half-open na cool-down"""
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.state = "closed"
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._trial_started = 0.0
+
+    async def wait_until_available(self):
+        """Pauzeer dispatch zolang het circuit open is; half-open laat één proef-request door"""
+        while True:
+            now = time.monotonic()
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                remaining = self.opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+                self.state = "half_open"
+                self._trial_in_flight = False
+                logger.info("Circuit breaker half-open, sending trial request")
+            # Nieuwe proef als er geen loopt of de vorige nooit is afgerond (bijv. geannuleerd)
+            if not self._trial_in_flight or now - self._trial_started > self.reset_timeout:
+                self._trial_in_flight = True
+                self._trial_started = now
+                return
+            # Andere requests wachten op de uitkomst van de proef-request
+            await asyncio.sleep(_HALF_OPEN_POLL_SECONDS)
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Circuit breaker closed, OpenRouter reachable again")
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                logger.error(f"Circuit breaker open after {self.failures} failures, pausing OCR for {self.reset_timeout}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened
+        }
+
+
+class RateLimitRegistry:
+    """Token buckets per API key plus één breaker voor de upstream"""
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.breaker = CircuitBreaker()
+        self.throttled = 0
+        self.retries = 0
+
+    def bucket(self, api_key: str) -> TokenBucket:
+        key_id = hashlib.sha256(api_key.encode()).hexdigest()[:12]
+        if key_id not in self._buckets:
+            self._buckets[key_id] = TokenBucket()
+        return self._buckets[key_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.get_stats(),
+            "throttled_responses": self.throttled,
+            "retries": self.retries,
+            "buckets": {
+                key_id: {"rate": round(bucket.rate, 3), "tokens": round(bucket.tokens, 2)}
+                for key_id, bucket in self._buckets.items()
+            }
+        }
+
+
+# Process-wide registry voor OpenRouter
+openrouter_limits = RateLimitRegistry()
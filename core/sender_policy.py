@@ -0,0 +1,203 @@
+"""
+Afzender whitelist voor Remarkable 2 naar Tekst Converter.
+
+Verantwoordelijk voor:
+- Eén keer per configuratie de whitelist compileren: sets voor adressen en
+  domeinen, parent-domein lookup voor subdomeinen, één regex voor de rest
+- From headers parsen via email.utils (ook quoted namen met < of komma's)
+- Optioneel DKIM/SPF/DMARC uitslagen uit Authentication-Results controleren
+
+Whitelist regels:
+    user@company.nl     exact adres
+    *@company.nl        elk adres op company.nl (ook: @company.nl)
+    *@*.company.nl      elk adres op een subdomein van company.nl
+    overige wildcards   fnmatch patronen, bijv. scan-*@company.nl
+"""
+
+import os
+import re
+import fnmatch
+import logging
+from dataclasses import dataclass
+from email.message import Message
+from email.utils import getaddresses
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Verplichte authenticatie: kommalijst van dkim, spf en/of dmarc. Eén van de
+# genoemde methodes moet 'pass' zijn voor het domein van de afzender. Leeg = uit.
+SENDER_REQUIRE_AUTH = tuple(
+    method.strip().lower() for method in os.getenv("SENDER_REQUIRE_AUTH", "").split(",") if method.strip()
+)
+# Authserv-id's van onze eigen mailserver; leeg = alleen de bovenste
+# Authentication-Results header (die voegt de ontvangende server als laatste toe)
+SENDER_AUTHSERV_IDS = tuple(
+    authserv_id.strip().lower() for authserv_id in os.getenv("SENDER_AUTHSERV_IDS", "").split(",") if authserv_id.strip()
+)
+
+AUTH_METHODS = ("dkim", "spf", "dmarc")
+WILDCARD_CHARS = frozenset("*?[")
+
+_COMMENT_PATTERN = re.compile(r"\([^()]*\)")
+
+
+@dataclass
+class AuthResult:
+    """Eén methode uit een Authentication-Results header, bijv. dkim=pass header.d=company.nl"""
+    method: str
+    result: str
+    properties: Dict[str, str]
+
+
+@dataclass
+class SenderCheck:
+    """Uitslag van SenderPolicy.check"""
+    allowed: bool
+    sender: str
+    reason: str = ""
+
+
+def parse_addresses(header_value: str) -> List[str]:
+    """Alle adressen uit een From header, lowercase"""
+    return [address.lower() for _, address in getaddresses([str(header_value)]) if "@" in address]
+
+
+def _domain(address: str) -> str:
+    return address.rpartition("@")[2].strip().rstrip(".").lower()
+
+
+def _aligned(domain: str, sender_domain: str) -> bool:
+    """Relaxed alignment: gelijk domein of een subdomein ervan (in beide richtingen)"""
+    if not domain:
+        return False
+    return (sender_domain == domain or sender_domain.endswith("." + domain)
+            or domain.endswith("." + sender_domain))
+
+
+def parse_authentication_results(header_value: str) -> Tuple[str, List[AuthResult]]:
+    """Parse één Authentication-Results header (RFC 8601) naar (authserv-id, uitslagen)"""
+    value = str(header_value)
+    # Commentaar (ook genest) weghalen
+    while True:
+        stripped = _COMMENT_PATTERN.sub(" ", value)
+        if stripped == value:
+            break
+        value = stripped
+
+    authserv_id, *resinfos = value.split(";")
+    authserv_id = authserv_id.split()[0].lower() if authserv_id.split() else ""
+    results = []
+    for resinfo in resinfos:
+        tokens = resinfo.split()
+        if not tokens or "=" not in tokens[0]:
+            continue  # bijv. "none"
+        method, _, result = tokens[0].partition("=")
+        properties = {}
+        for token in tokens[1:]:
+            key, separator, prop = token.partition("=")
+            if separator and "." in key:
+                properties[key.lower()] = prop.strip('"')
+        results.append(AuthResult(method.split("/")[0].lower(), result.lower(), properties))
+    return authserv_id, results
+
+
+class SenderPolicy:
+    """Voorgecompileerde whitelist; bouwen is O(n), een lookup O(1) per regelsoort"""
+
+    def __init__(self, allowed_senders: Iterable[str],
+                 require_auth: Iterable[str] = SENDER_REQUIRE_AUTH,
+                 authserv_ids: Iterable[str] = SENDER_AUTHSERV_IDS):
+        addresses, domains, parent_domains, patterns = set(), set(), set(), []
+        for entry in allowed_senders:
+            entry = entry.strip().lower()
+            if not entry:
+                continue
+            local, at, domain = entry.rpartition("@")
+            if not at:
+                logger.warning(f"Ignoring sender rule without @: {entry}")
+                continue
+            if local in ("", "*") and domain.startswith("*.") and not WILDCARD_CHARS & set(domain[2:]):
+                parent_domains.add(domain[2:])
+            elif local in ("", "*") and not WILDCARD_CHARS & set(domain):
+                domains.add(domain)
+            elif WILDCARD_CHARS & set(entry):
+                patterns.append(fnmatch.translate(entry))
+            else:
+                addresses.add(entry)
+
+        self.addresses: FrozenSet[str] = frozenset(addresses)
+        self.domains: FrozenSet[str] = frozenset(domains)
+        self.parent_domains: FrozenSet[str] = frozenset(parent_domains)
+        self._pattern = re.compile("|".join(patterns)) if patterns else None
+        self._pattern_count = len(patterns)
+
+        self.require_auth = tuple(method for method in require_auth if method in AUTH_METHODS)
+        unknown = set(require_auth) - set(AUTH_METHODS)
+        if unknown:
+            logger.warning(f"Ignoring unknown authentication methods: {', '.join(sorted(unknown))}")
+        self.authserv_ids = frozenset(authserv_ids)
+
+    def is_allowed(self, address: str) -> bool:
+        """Staat dit (lowercase) adres op de whitelist?"""
+        if address in self.addresses:
+            return True
+        domain = _domain(address)
+        if domain in self.domains:
+            return True
+        if self.parent_domains:
+            labels = domain.split(".")
+            for index in range(1, len(labels)):
+                if ".".join(labels[index:]) in self.parent_domains:
+                    return True
+        return bool(self._pattern and self._pattern.match(address))
+
+    def check(self, header: Message) -> SenderCheck:
+        """Controleer de From header (en zo nodig Authentication-Results) van een bericht"""
+        addresses = parse_addresses(header.get("From", ""))
+        if not addresses:
+            return SenderCheck(False, str(header.get("From", "")), "no sender address")
+        sender = addresses[0]
+        # Meerdere From adressen: allemaal op de whitelist, anders kan er een vreemde tussen zitten
+        for address in addresses:
+            if not self.is_allowed(address):
+                return SenderCheck(False, address, "sender not whitelisted")
+
+        if self.require_auth:
+            passed = self._authenticated(header, _domain(sender))
+            if not passed:
+                return SenderCheck(False, sender, f"no {'/'.join(self.require_auth)} pass for {_domain(sender)}")
+            return SenderCheck(True, sender, f"{passed}=pass")
+        return SenderCheck(True, sender)
+
+    def _authenticated(self, header: Message, sender_domain: str) -> Optional[str]:
+        """Naam van de eerste verplichte methode met een 'pass' voor het afzenderdomein"""
+        for header_value in self._trusted_results(header):
+            _, results = parse_authentication_results(header_value)
+            for result in results:
+                if result.method not in self.require_auth or result.result != "pass":
+                    continue
+                if result.method == "dkim":
+                    domain = result.properties.get("header.d") or _domain(result.properties.get("header.i", ""))
+                elif result.method == "spf":
+                    domain = _domain(result.properties.get("smtp.mailfrom", ""))
+                else:
+                    domain = result.properties.get("header.from", "").lower()
+                if _aligned(domain.lower(), sender_domain):
+                    return result.method
+        return None
+
+    def _trusted_results(self, header: Message) -> List[str]:
+        values = header.get_all("Authentication-Results") or []
+        if not self.authserv_ids:
+            return values[:1]
+        return [value for value in values if parse_authentication_results(value)[0] in self.authserv_ids]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "addresses": len(self.addresses),
+            "domains": len(self.domains),
+            "parent_domains": len(self.parent_domains),
+            "patterns": self._pattern_count,
+            "require_auth": list(self.require_auth)
+        }
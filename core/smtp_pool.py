@@ -0,0 +1,490 @@
+"""
+Uitgaande mail service voor Remarkable 2 naar Tekst Converter.
+
+Verantwoordelijk voor:
+- Eén warme, ingelogde SMTP verbinding per account
+- Meerdere berichten per sessie (geen STARTTLS + login per bericht)
+- Reconnect bij 421, verbroken verbinding of timeout (alleen vóór DATA)
+- Begrensde send queue per account en een globaal maximum aan sockets
+- Berichten als bytes naar de socket streamen (geen as_string() kopie)
+- Bijlagen uit een spool (StreamedAttachment) blok voor blok base64 coderen
+
+smtplib is blokkerend; de verzending zelf draait in de I/O pool. Per account
+verwerkt één consumer task de queue, zodat een burst niet tientallen
+verbindingen opent.
+"""
+
+import os
+import time
+import base64
+import socket
+import asyncio
+import smtplib
+import logging
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+from email import policy
+from email.generator import BytesGenerator
+from email.message import Message
+from email.mime.nonmultipart import MIMENonMultipart
+
+from .blocking_io import run_blocking, SMTP_TIMEOUT, get_server_timeout
+from .imap_session import get_ssl_context
+from .attachment_spool import SpooledAttachment
+
+logger = logging.getLogger(__name__)
+
+SMTP_MAX_CONNECTIONS = int(os.getenv("SMTP_MAX_CONNECTIONS", "10"))
+SMTP_QUEUE_SIZE = int(os.getenv("SMTP_QUEUE_SIZE", "100"))  # per account
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))  # sluit daarna de verbinding
+SMTP_MAX_MESSAGES_PER_SESSION = int(os.getenv("SMTP_MAX_MESSAGES_PER_SESSION", "100"))
+
+# Sessies die korter dan dit idle zijn worden zonder NOOP hergebruikt
+SMTP_NOOP_CHECK_SECONDS = 15
+
+# Bytes per sendall tijdens DATA
+SMTP_WRITE_CHUNK = 64 * 1024
+
+# Leesblok voor StreamedAttachment: veelvoud van 57 bytes (één base64 regel van 76 tekens)
+ATTACHMENT_READ_CHUNK = 57 * 12 * 1024
+
+# CRLF regeleinden; headers opnieuw vouwen zodat niet-ASCII (bijv. in een
+# bestandsnaam in het onderwerp) RFC 2047 gecodeerd wordt
+SMTP_POLICY = policy.SMTP.clone(refold_source="all")
+
+
+def _is_reconnectable(error: Exception) -> bool:
+    """Fouten waarbij een nieuwe verbinding zin heeft (421, verbroken, timeout)"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421:
+        return True
+    return isinstance(error, (socket.timeout, ConnectionError))
+
+
+class _DataWriter:
+    """File-achtig doel voor BytesGenerator dat DATA bytes dot-stuffed naar de socket schrijft"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self._buffer = bytearray()
+        self._line_start = True
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        # RFC 5321 4.5.2: regels die met een punt beginnen krijgen een extra punt
+        if self._line_start and data.startswith(b"."):
+            self._buffer += b"."
+        self._buffer += data.replace(b"\n.", b"\n..")
+        self._line_start = data.endswith(b"\n")
+        if len(self._buffer) >= SMTP_WRITE_CHUNK:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.smtp.send(bytes(self._buffer))
+            self._buffer.clear()
+
+    def finish(self):
+        """Sluit DATA af met <CRLF>.<CRLF>"""
+        if not self._line_start:
+            self._buffer += b"\r\n"
+        self._buffer += b".\r\n"
+        self._flush()
+
+
+class StreamedAttachment(MIMENonMultipart):
+    """Bijlage waarvan de inhoud pas tijdens het versturen base64 gecodeerd wordt.
+
+    De inhoud blijft in de spool (of het bestand in de job queue) van de
+    aanroeper, die hem pas na de verzending sluit. Alleen stream_message
+    schrijft de body; een gewone Generator (as_string()) ziet een lege part.
+    """
+
+    def __init__(self, data: Union[bytes, SpooledAttachment], filename: str, subtype: str = "octet-stream"):
+        super().__init__("application", subtype)
+        self["Content-Transfer-Encoding"] = "base64"
+        self.add_header("Content-Disposition", "attachment", filename=filename)
+        self.data = data
+
+    @property
+    def size(self) -> int:
+        return self.data.size if isinstance(self.data, SpooledAttachment) else len(self.data)
+
+    def iter_base64(self) -> Iterator[bytes]:
+        """base64 regels van 76 tekens (met \n), per ATTACHMENT_READ_CHUNK"""
+        if isinstance(self.data, SpooledAttachment):
+            chunks = self.data.iter_chunks(ATTACHMENT_READ_CHUNK)
+        else:
+            view = memoryview(self.data)
+            chunks = (view[offset:offset + ATTACHMENT_READ_CHUNK] for offset in range(0, len(view), ATTACHMENT_READ_CHUNK))
+        for chunk in chunks:
+            yield base64.encodebytes(chunk)
+
+
+class _StreamingGenerator(BytesGenerator):
+    """BytesGenerator zonder tussenbuffer per (sub)part.
+
+    De standaard generator schrijft elke part eerst naar een eigen buffer
+    (zodat de boundary achteraf gekozen kan worden) en splitst een payload
+    in één lijst met alle regels. Voor een base64 bijlage van 20 MB zijn dat
+    meerdere volledige kopieën; hier gaan headers en body direct door.
+    """
+
+    def _write(self, msg):
+        if msg.is_multipart() and msg.get_boundary() is None:
+            msg.set_boundary(self._make_boundary())
+        self._write_headers(msg)
+        self._dispatch(msg)
+
+    def _handle_multipart(self, msg):
+        boundary = msg.get_boundary()
+        if msg.preamble is not None:
+            self._write_lines(msg.preamble)
+            self.write(self._NL)
+        self.write("--" + boundary + self._NL)
+        for index, part in enumerate(msg.get_payload() or []):
+            if index:
+                self.write(self._NL + "--" + boundary + self._NL)
+            self.clone(self._fp).flatten(part, unixfrom=False, linesep=self._NL)
+        self.write(self._NL + "--" + boundary + "--" + self._NL)
+        if msg.epilogue is not None:
+            self.write(self._NL)
+            self._write_lines(msg.epilogue)
+
+    def _handle_text(self, msg):
+        if isinstance(msg, StreamedAttachment):
+            for lines in msg.iter_base64():
+                self._fp.write(lines.replace(b"\n", self._NL.encode("ascii")))
+            return
+        # base64 is altijd ASCII: geen surrogate check (een kopie van de payload)
+        # en geen lijst met alle regels, maar stukken van ~SMTP_WRITE_CHUNK
+        payload = msg._payload
+        if not isinstance(payload, str) or msg.get("content-transfer-encoding", "").lower() != "base64":
+            super()._handle_text(msg)
+            return
+        start = 0
+        while start < len(payload):
+            end = payload.find("\n", start + SMTP_WRITE_CHUNK)
+            end = len(payload) if end == -1 else end + 1
+            chunk = payload[start:end].replace("\r\n", "\n").replace("\n", self._NL)
+            self._fp.write(chunk.encode("ascii"))
+            start = end
+
+    # Generator koppelt _writeBody bij de klassedefinitie aan zijn eigen _handle_text
+    _writeBody = _handle_text
+
+
+def stream_message(smtp: smtplib.SMTP, sender: str, recipient: str, message: Message):
+    """sendmail() zonder het hele bericht als string op te bouwen.
+
+    Het bericht wordt met CRLF regeleinden direct in de socket geserialiseerd;
+    bijlagen staan zo maar één keer (als base64 payload) in geheugen.
+    """
+    _send_envelope(smtp, sender, recipient)
+    _send_data(smtp, message)
+
+
+def _send_envelope(smtp: smtplib.SMTP, sender: str, recipient: str):
+    """MAIL FROM en RCPT TO; tot hier heeft de server nog niets om af te leveren"""
+    code, response = smtp.mail(sender)
+    if code != 250:
+        if code == 421:
+            smtp.close()
+        else:
+            smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, response, sender)
+
+    code, response = smtp.rcpt(recipient)
+    if code not in (250, 251):
+        if code == 421:
+            smtp.close()
+            raise smtplib.SMTPResponseException(code, response)
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+
+
+def _send_data(smtp: smtplib.SMTP, message: Message):
+    """DATA met het gestreamde bericht; na een fout hier kan het bericht al afgeleverd zijn"""
+    smtp.putcmd("data")
+    code, response = smtp.getreply()
+    if code != 354:
+        if code == 421:
+            smtp.close()
+        else:
+            smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    try:
+        writer = _DataWriter(smtp)
+        _StreamingGenerator(writer, mangle_from_=False, policy=SMTP_POLICY).flatten(message)
+        writer.finish()
+    except BaseException:
+        # Halverwege DATA (bijv. encode fout): de server leest alles tot <CRLF>.<CRLF> als
+        # bericht, ook een RSET. Alleen de verbinding sluiten brengt de sessie in een bekende staat.
+        smtp.close()
+        raise
+
+    code, response = smtp.getreply()
+    if code != 250:
+        if code == 421:
+            smtp.close()
+        raise smtplib.SMTPDataError(code, response)
+
+
+class SMTPSession:
+    """Persistente, ingelogde SMTP verbinding voor één account (blokkerend)"""
+
+    def __init__(self, server: str, port: int, email: str, password: str):
+        self.server = server
+        self.port = port
+        self.email = email
+        self.password = password
+        self.lock = threading.Lock()
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._session_messages = 0
+
+        # Statistieken
+        self.handshakes = 0
+        self.reconnects = 0
+        self.messages_sent = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return self._smtp is not None
+
+    def _open(self):
+        timeout = get_server_timeout(self.server, SMTP_TIMEOUT)
+        smtp = smtplib.SMTP(self.server, self.port, timeout=timeout)
+        try:
+            smtp.starttls(context=get_ssl_context())
+            smtp.login(self.email, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._session_messages = 0
+        self.handshakes += 1
+        logger.info(f"SMTP session opened for {self.email} ({self.server}:{self.port})")
+
+    def _acquire(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            if self._session_messages >= SMTP_MAX_MESSAGES_PER_SESSION:
+                self._quit()
+            elif time.monotonic() - self._last_used >= SMTP_NOOP_CHECK_SECONDS:
+                try:
+                    if self._smtp.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected("NOOP failed")
+                except (smtplib.SMTPException, OSError):
+                    self._drop()
+                    self.reconnects += 1
+        if self._smtp is None:
+            self._open()
+        return self._smtp
+
+    def send(self, sender: str, recipient: str, message: Message):
+        """Verstuur één bericht.
+
+        Bij 421/verbroken verbinding tijdens MAIL of RCPT één keer opnieuw op
+        een nieuwe sessie. Vanaf DATA niet meer: de server kan het bericht dan
+        al hebben, dus de fout gaat naar de job queue (geen dubbele notificatie).
+        """
+        with self.lock:
+            for attempt in (1, 2):
+                smtp = self._acquire()
+                try:
+                    _send_envelope(smtp, sender, recipient)
+                    break
+                except Exception as e:
+                    if attempt == 2 or not _is_reconnectable(e):
+                        # Geen halve transactie laten staan voor het volgende bericht
+                        self._reset()
+                        raise
+                    logger.info(f"SMTP session for {self.email} dropped ({e!r}), reconnecting")
+                    self._drop()
+                    self.reconnects += 1
+            try:
+                _send_data(smtp, message)
+            except Exception:
+                self._reset()
+                raise
+            self._last_used = time.monotonic()
+            self._session_messages += 1
+            self.messages_sent += 1
+
+    def _reset(self):
+        """Na een mislukt bericht: RSET, of de verbinding weggooien als dat niet lukt"""
+        if self._smtp is None:
+            return
+        try:
+            if self._smtp.sock is None or self._smtp.rset()[0] != 250:
+                raise smtplib.SMTPServerDisconnected("RSET failed")
+        except (smtplib.SMTPException, OSError):
+            self._drop()
+
+    def _drop(self):
+        """Vergeet de verbinding zonder QUIT (die is al weg)"""
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def close(self):
+        """Netjes afsluiten met QUIT"""
+        with self.lock:
+            self._quit()
+
+    def _quit(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self.is_connected,
+            "handshakes": self.handshakes,
+            "reconnects": self.reconnects,
+            "messages_sent": self.messages_sent
+        }
+
+
+class SMTPDeliveryService:
+    """Async send queues per account boven warme SMTP sessies"""
+
+    def __init__(self, max_connections: int = SMTP_MAX_CONNECTIONS, queue_size: int = SMTP_QUEUE_SIZE):
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self._connections: Optional[asyncio.Semaphore] = None
+        self._sessions: Dict[Tuple[str, int, str], SMTPSession] = {}
+        self._queues: Dict[Tuple[str, int, str], asyncio.Queue] = {}
+        self._consumers: Dict[Tuple[str, int, str], asyncio.Task] = {}
+        # Consumers die op een vrije verbinding wachten; idle consumers geven die dan direct op
+        self._waiting = 0
+        self._slot_wanted: Optional[asyncio.Event] = None
+
+    def _session(self, smtp_config: Dict[str, Any]) -> Tuple[Tuple[str, int, str], SMTPSession]:
+        key = (smtp_config["smtp_server"], int(smtp_config["smtp_port"]), smtp_config["email"])
+        session = self._sessions.get(key)
+        if session is None or session.password != smtp_config["password"]:
+            if session is not None:
+                session.close()
+            session = SMTPSession(key[0], key[1], key[2], smtp_config["password"])
+            self._sessions[key] = session
+        return key, session
+
+    async def send(self, smtp_config: Dict[str, Any], message: Message, recipient: str):
+        """Zet een bericht in de queue van het account en wacht op de verzending.
+
+        Raises:
+            Exception: De SMTP fout als verzenden (ook na reconnect) mislukt
+        """
+        if self._connections is None:
+            self._connections = asyncio.Semaphore(self.max_connections)
+            self._slot_wanted = asyncio.Event()
+
+        key, session = self._session(smtp_config)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue(maxsize=self.queue_size)
+
+        consumer = self._consumers.get(key)
+        if consumer is None or consumer.done():
+            self._consumers[key] = asyncio.create_task(self._consume(key, session, queue))
+
+        future = asyncio.get_running_loop().create_future()
+        # Volle queue: de aanroeper wacht (backpressure) in plaats van een extra socket
+        await queue.put((message, recipient, future))
+
+        return await future
+
+    async def _acquire_connection(self):
+        """Wacht op een vrije verbinding en laat idle consumers van andere accounts weten dat we wachten"""
+        if not self._connections.locked():
+            await self._connections.acquire()
+            return
+        self._waiting += 1
+        self._slot_wanted.set()
+        try:
+            await self._connections.acquire()
+        finally:
+            self._waiting -= 1
+            if not self._waiting:
+                self._slot_wanted.clear()
+
+    async def _next_message(self, queue: asyncio.Queue) -> Optional[Tuple[Message, str, asyncio.Future]]:
+        """Volgend bericht; None na SMTP_IDLE_SECONDS, of direct als een ander account op een verbinding wacht"""
+        while not self._waiting:
+            getter = asyncio.ensure_future(queue.get())
+            wanted = asyncio.ensure_future(self._slot_wanted.wait())
+            try:
+                done, _ = await asyncio.wait((getter, wanted), timeout=SMTP_IDLE_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                wanted.cancel()
+                if not getter.done():
+                    getter.cancel()  # Een al toegewezen item blijft dan in de queue
+            if getter.done() and not getter.cancelled():
+                return getter.result()
+            if not done:
+                return None
+        return queue.get_nowait() if not queue.empty() else None
+
+    async def _consume(self, key: Tuple[str, int, str], session: SMTPSession, queue: asyncio.Queue):
+        """Verstuur berichten van één account na elkaar over dezelfde sessie"""
+        await self._acquire_connection()
+        try:
+            while True:
+                item = await self._next_message(queue)
+                if item is None:
+                    if queue.empty():
+                        # Afmelden zonder await ertussen, zodat send() een nieuwe consumer start
+                        self._consumers.pop(key, None)
+                        break
+                    continue
+                message, recipient, future = item
+                if future.cancelled():
+                    continue
+                try:
+                    await run_blocking(session.send, session.email, recipient, message)
+                    if not future.done():
+                        future.set_result(None)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+        finally:
+            # Idle of gestopt: verbinding vrijgeven zodat de socket-limiet klopt
+            if self._consumers.get(key) is asyncio.current_task():
+                del self._consumers[key]
+            try:
+                await run_blocking(session.close)
+            finally:
+                self._connections.release()
+
+    async def close(self):
+        """Stop alle consumers en sluit de sessies (lifespan shutdown)"""
+        for task in list(self._consumers.values()):
+            task.cancel()
+        await asyncio.gather(*self._consumers.values(), return_exceptions=True)
+        self._consumers.clear()
+        for session in self._sessions.values():
+            await run_blocking(session.close)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_connections": self.max_connections,
+            "active_consumers": len(self._consumers),
+            "waiting_for_connection": self._waiting,
+            "queued": sum(queue.qsize() for queue in self._queues.values()),
+            "sessions": {key[2]: session.get_stats() for key, session in self._sessions.items()}
+        }
+
+
+# Process-wide SMTP delivery service
+smtp_delivery = SMTPDeliveryService()
@@ -0,0 +1,312 @@
+"""
+Persistente opslag voor Remarkable 2 naar Tekst Converter.
+
+Eén SQLite bestand (WAL mode) dat de API en alle worker processen delen:
+- accounts: user config (credentials versleuteld) en of polling aan staat
+- mailbox_state: UIDVALIDITY en hoogste verwerkte UID per mailbox
+- history: verwerkte attachments per account
+- mailbox_leases: welke worker een mailbox bewaakt (precies één eigenaar)
+- workers: heartbeats van levende worker processen, voor de verdeling
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
+
+# Eén data directory voor alle persistente bestanden (state, queue, cache)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Fernet key; zonder env variabele wordt een key file in DATA_DIR aangemaakt
+CREDENTIALS_KEY = os.getenv("CREDENTIALS_KEY")
+
+# Config velden die versleuteld worden opgeslagen
+SECRET_FIELDS = ("password", "openrouter_api_key")
+_ENCRYPTED_PREFIX = "enc:v1:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    email TEXT PRIMARY KEY,
+    config TEXT NOT NULL,
+    polling INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_accounts_polling ON accounts(polling);
+CREATE TABLE IF NOT EXISTS mailbox_state (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    last_uid INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    characters INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_account ON history(account, created_at);
+CREATE TABLE IF NOT EXISTS mailbox_leases (
+    email TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_mailbox_leases_expires ON mailbox_leases(expires);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+class CredentialCipher:
+    """Versleutelt credentials met Fernet (cryptography is optioneel)"""
+
+    def __init__(self, key_path: str, key: Optional[str] = CREDENTIALS_KEY):
+        self.key_path = key_path
+        self._key = key
+        self._fernet = None
+        self._warned = False
+
+    def _get_fernet(self):
+        if self._fernet is None:
+            key = self._key or self._load_key_file()
+            self._fernet = Fernet(key.encode() if isinstance(key, str) else key)
+        return self._fernet
+
+    def _load_key_file(self) -> bytes:
+        """Lees de key file, of maak hem aan (alleen leesbaar voor de eigenaar)"""
+        if os.path.exists(self.key_path):
+            with open(self.key_path, "rb") as f:
+                return f.read().strip()
+        directory = os.path.dirname(self.key_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        key = Fernet.generate_key()
+        try:
+            fd = os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # Ander proces was ons voor
+            with open(self.key_path, "rb") as f:
+                return f.read().strip()
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        logger.info(f"Generated credentials key at {self.key_path}")
+        return key
+
+    def encrypt(self, value: str) -> str:
+        if Fernet is None:
+            if not self._warned:
+                logger.warning("cryptography not installed, credentials are stored unencrypted")
+                self._warned = True
+            return value
+        return _ENCRYPTED_PREFIX + self._get_fernet().encrypt(value.encode()).decode()
+
+    def decrypt(self, value: str) -> str:
+        if not value.startswith(_ENCRYPTED_PREFIX):
+            return value  # Oude, onversleutelde waarde; wordt bij de volgende save versleuteld
+        if Fernet is None:
+            raise RuntimeError("Encrypted credentials found but cryptography is not installed")
+        try:
+            return self._get_fernet().decrypt(value[len(_ENCRYPTED_PREFIX):].encode()).decode()
+        except InvalidToken:
+            raise RuntimeError("Credentials cannot be decrypted, wrong CREDENTIALS_KEY?")
+
+
+class _Result:
+    """Opgehaalde rijen en rowcount van één statement"""
+
+    def __init__(self, rows: List[tuple], rowcount: int):
+        self.rows = rows
+        self.rowcount = rowcount
+
+    def fetchone(self) -> Optional[tuple]:
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+
+
+class StateStore:
+    """Thread-safe SQLite store gedeeld tussen processen"""
+
+    def __init__(self, path: str, cipher: Optional[CredentialCipher] = None):
+        self.path = path
+        self.cipher = cipher or CredentialCipher(os.path.join(os.path.dirname(path), "credentials.key"))
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Vaste SQL strings met parameters; sqlite3 hergebruikt de prepared statements
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=30, cached_statements=256)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> "_Result":
+        """Voer één statement uit; rijen worden binnen de lock opgehaald"""
+        with self._lock:
+            cursor = self._connection().execute(sql, params)
+            return _Result(cursor.fetchall(), cursor.rowcount)
+
+    # Accounts
+
+    def save_account(self, email: str, config: Dict[str, Any]):
+        """Sla de user config op met versleutelde credentials (polling vlag blijft staan)"""
+        stored = dict(config)
+        for field in SECRET_FIELDS:
+            if stored.get(field):
+                stored[field] = self.cipher.encrypt(stored[field])
+        self._execute(
+            "INSERT INTO accounts (email, config, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(email) DO UPDATE SET config = excluded.config, updated_at = excluded.updated_at",
+            (email, json.dumps(stored), time.time())
+        )
+
+    def load_account(self, email: str) -> Optional[Dict[str, Any]]:
+        """User config met ontsleutelde credentials, of None voor een onbekend account"""
+        row = self._execute("SELECT config FROM accounts WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return None
+        config = json.loads(row[0])
+        for field in SECRET_FIELDS:
+            if config.get(field):
+                config[field] = self.cipher.decrypt(config[field])
+        return config
+
+    def account_version(self, email: str) -> Optional[float]:
+        """Tijdstip van de laatste wijziging van een account (goedkoop, zonder ontsleutelen)"""
+        row = self._execute("SELECT updated_at FROM accounts WHERE email = ?", (email,)).fetchone()
+        return row[0] if row else None
+
+    def account_emails(self) -> List[str]:
+        return [row[0] for row in self._execute("SELECT email FROM accounts ORDER BY email").fetchall()]
+
+    def set_polling(self, email: str, polling: bool):
+        """Zet de gewenste polling state; workers volgen deze vlag"""
+        self._execute(
+            "UPDATE accounts SET polling = ?, updated_at = ? WHERE email = ?",
+            (1 if polling else 0, time.time(), email)
+        )
+
+    def is_polling(self, email: str) -> bool:
+        row = self._execute("SELECT polling FROM accounts WHERE email = ?", (email,)).fetchone()
+        return bool(row and row[0])
+
+    def polling_accounts(self) -> List[str]:
+        return [row[0] for row in self._execute(
+            "SELECT email FROM accounts WHERE polling = 1 ORDER BY email"
+        ).fetchall()]
+
+    def account_counts(self) -> Tuple[int, int]:
+        """(aantal accounts, aantal accounts met polling aan)"""
+        return self._execute("SELECT COUNT(*), COALESCE(SUM(polling), 0) FROM accounts").fetchone()
+
+    # Mailbox state (UID high-water marks)
+
+    def get_mailbox_state(self, account: str, mailbox: str) -> Optional[Tuple[int, int]]:
+        """(uidvalidity, last_uid), of None voor een onbekende mailbox"""
+        return self._execute(
+            "SELECT uidvalidity, last_uid FROM mailbox_state WHERE account = ? AND mailbox = ?",
+            (account.lower(), mailbox)
+        ).fetchone()
+
+    def set_mailbox_state(self, account: str, mailbox: str, uidvalidity: int, last_uid: int):
+        self._execute(
+            "INSERT INTO mailbox_state (account, mailbox, uidvalidity, last_uid, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(account, mailbox) DO UPDATE SET uidvalidity = excluded.uidvalidity, "
+            "last_uid = excluded.last_uid, updated_at = excluded.updated_at",
+            (account.lower(), mailbox, uidvalidity, last_uid, time.time())
+        )
+
+    # Processing history
+
+    def record_history(self, account: str, uid: int, filename: str, status: str,
+                       characters: int = 0, error: Optional[str] = None):
+        self._execute(
+            "INSERT INTO history (account, uid, filename, status, characters, error, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (account, uid, filename, status, characters, error, time.time())
+        )
+
+    def get_history(self, account: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Meest recente verwerkingen voor een account"""
+        rows = self._execute(
+            "SELECT uid, filename, status, characters, error, created_at FROM history "
+            "WHERE account = ? ORDER BY created_at DESC LIMIT ?",
+            (account, limit)
+        ).fetchall()
+        return [
+            {"uid": uid, "filename": filename, "status": status, "characters": characters,
+             "error": error, "created_at": created_at}
+            for uid, filename, status, characters, error, created_at in rows
+        ]
+
+    def history_counts(self) -> Dict[str, int]:
+        return dict(self._execute("SELECT status, COUNT(*) FROM history GROUP BY status").fetchall())
+
+    # Mailbox leases
+
+    def acquire_lease(self, email: str, owner: str, ttl: float) -> bool:
+        """Claim of verleng de lease op een mailbox; False als een ander hem heeft"""
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO mailbox_leases (email, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(email) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+            "WHERE mailbox_leases.owner = excluded.owner OR mailbox_leases.expires < ?",
+            (email, owner, now + ttl, now)
+        )
+        return cursor.rowcount > 0
+
+    def release_lease(self, email: str, owner: str):
+        self._execute("DELETE FROM mailbox_leases WHERE email = ? AND owner = ?", (email, owner))
+
+    def lease_owners(self) -> Dict[str, str]:
+        """Actieve lease eigenaar per mailbox"""
+        return dict(self._execute(
+            "SELECT email, owner FROM mailbox_leases WHERE expires >= ?", (time.time(),)
+        ).fetchall())
+
+    # Workers
+
+    def worker_heartbeat(self, worker_id: str):
+        self._execute(
+            "INSERT INTO workers (id, heartbeat) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (worker_id, time.time())
+        )
+
+    def remove_worker(self, worker_id: str):
+        self._execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def live_workers(self, max_age: float) -> List[str]:
+        """Workers met een recente heartbeat (oude entries worden opgeruimd)"""
+        cutoff = time.time() - max_age
+        self._execute("DELETE FROM workers WHERE heartbeat < ?", (cutoff,))
+        return [row[0] for row in self._execute("SELECT id FROM workers ORDER BY id").fetchall()]
+
+
+# Process-wide persistent store
+state_store = StateStore(os.path.join(DATA_DIR, "state.sqlite3"))
@@ -0,0 +1,42 @@
+"""
+Sync state opslag voor UID-gebaseerde incrementele mailbox sync.
+
+Per mailbox bewaren we UIDVALIDITY en de hoogste verwerkte UID, zodat een
+herstart alleen nieuwe berichten oppakt. Opslag is de mailbox_state tabel
+in de gedeelde SQLite store.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from .storage import StateStore, state_store
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MailboxState:
+    """High-water mark van een mailbox"""
+    uidvalidity: int
+    last_uid: int
+
+
+class SyncStateStore:
+    """MailboxState per account/mailbox in de state store"""
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    def get(self, account: str, mailbox: str = "INBOX") -> Optional[MailboxState]:
+        """Haal de opgeslagen state op, of None bij een onbekende mailbox"""
+        row = self.store.get_mailbox_state(account, mailbox)
+        return MailboxState(uidvalidity=row[0], last_uid=row[1]) if row else None
+
+    def set(self, account: str, state: MailboxState, mailbox: str = "INBOX"):
+        """Sla state direct persistent op"""
+        self.store.set_mailbox_state(account, mailbox, state.uidvalidity, state.last_uid)
+
+
+# Process-wide sync state
+sync_state = SyncStateStore(state_store)
@@ -0,0 +1,303 @@
+"""
+Lichtgewicht tracing voor Remarkable 2 naar Tekst Converter.
+
+Verantwoordelijk voor:
+- Een trace ID per attachment, van IMAP fetch tot SMTP verzending
+- Spans met timings per stap (fetch, parse, base64, API call, render, send)
+- De laatste traces in geheugen, als JSON op /debug/traces
+- Optionele export als OTLP/HTTP JSON naar een lokale collector
+
+De huidige span zit in een contextvar, zodat geneste stappen (ook over
+await en run_blocking heen) vanzelf children worden. De trace ID van een
+attachment staat in de job queue, dus OCR en notificatie in een andere
+worker sluiten aan op dezelfde trace. Elk proces bewaart alleen zijn eigen
+spans; met losse worker processen geeft de OTLP collector het hele beeld.
+"""
+
+import os
+import json
+import time
+import secrets
+import logging
+import threading
+import contextvars
+import urllib.request
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACE_MAX_TRACES = int(os.getenv("TRACE_MAX_TRACES", "500"))
+TRACE_MAX_SPANS = 200  # per trace, tegen ontsporende retry loops
+
+# Bijv. http://localhost:4318; leeg = geen export
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/")
+OTLP_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "remarkable-ocr")
+OTLP_EXPORT_INTERVAL = 5.0  # seconds
+OTLP_QUEUE_SIZE = 10000  # spans; bij een trage collector vallen de oudste weg
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+@dataclass
+class Span:
+    """Eén afgeronde (of lopende) stap binnen een of meer traces"""
+    name: str
+    trace_ids: Tuple[str, ...]
+    span_id: str
+    parent_id: Optional[str]
+    start: float  # epoch seconds
+    duration: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    deferred: bool = False  # in een voorlopige trace: pas na adopt() exporteren
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class OTLPExporter:
+    """Stuurt afgeronde spans in batches naar {endpoint}/v1/traces (OTLP/HTTP JSON)"""
+
+    def __init__(self, endpoint: str, service_name: str = OTLP_SERVICE_NAME):
+        self.url = f"{endpoint}/v1/traces"
+        self.service_name = service_name
+        self._queue: Deque[Tuple[str, Span]] = deque(maxlen=OTLP_QUEUE_SIZE)
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.exported = 0
+        self.failed = 0
+
+    def submit(self, trace_id: str, span: Span):
+        self._queue.append((trace_id, span))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(OTLP_EXPORT_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while self._queue:
+            batch.append(self._queue.popleft())
+        if not batch:
+            return
+        body = json.dumps(self._encode(batch)).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.warning(f"OTLP export of {len(batch)} spans to {self.url} failed: {e}")
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _encode(self, batch: Sequence[Tuple[str, Span]]) -> Dict[str, Any]:
+        spans = []
+        for trace_id, span in batch:
+            end = span.start + (span.duration or 0.0)
+            encoded = {
+                "traceId": trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(int(span.start * 1e9)),
+                "endTimeUnixNano": str(int(end * 1e9)),
+                "attributes": [self._attribute(key, value) for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+            }
+            if span.parent_id:
+                encoded["parentSpanId"] = span.parent_id
+            spans.append(encoded)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "remarkable-ocr"}, "spans": spans}]
+        }]}
+
+
+class Tracer:
+    """Verzamelt spans per trace in een begrensde, in-memory buffer"""
+
+    def __init__(self, max_traces: int = TRACE_MAX_TRACES, exporter: Optional[OTLPExporter] = None):
+        self.max_traces = max_traces
+        self.exporter = exporter
+        self._traces: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def span(self, name: str, trace_ids: Sequence[Optional[str]] = (), deferred: bool = False,
+             **attributes: Any) -> Iterator[Span]:
+        """Meet een stap; zonder trace_ids wordt het een child van de huidige span.
+
+        Met meerdere trace_ids (bijv. een digest voor meerdere attachments)
+        komt de span, met al zijn children, in elk van die traces. Een
+        deferred root span start een voorlopige trace die pas met adopt()
+        zijn definitieve trace ID(s) krijgt. Faalt die root span, dan komt
+        adopt() niet meer en blijft de trace onder zijn voorlopige ID.
+        """
+        parent = _current_span.get()
+        ids = tuple(trace_id for trace_id in trace_ids if trace_id)
+        if not ids:
+            ids = parent.trace_ids if parent is not None else (new_trace_id(),)
+        child = parent is not None and parent.trace_ids == ids
+        span = Span(
+            name=name,
+            trace_ids=ids,
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if child else None,
+            start=time.time(),
+            attributes=attributes,
+            deferred=parent.deferred if child else deferred and parent is None
+        )
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(span)
+            if span.deferred and span.error and not child:
+                self.adopt(ids[0], ())
+
+    def record(self, name: str, duration: float, **attributes: Any):
+        """Voeg een al gemeten stap toe als child van de huidige span (bijv. opgetelde base64 tijd)"""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        self._finish(Span(
+            name=name,
+            trace_ids=parent.trace_ids,
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id,
+            start=time.time() - duration,
+            duration=duration,
+            attributes=attributes,
+            deferred=parent.deferred
+        ))
+
+    def adopt(self, source: str, trace_ids: Sequence[str]):
+        """Verplaats de spans van een voorlopige trace naar de definitieve traces.
+
+        Een bericht wordt opgehaald voordat bekend is welke attachments het
+        heeft; daarna krijgt elke attachment de fetch spans in zijn eigen trace.
+        Zonder trace_ids blijft de voorlopige trace gewoon bestaan.
+        """
+        targets = tuple(trace_ids) or (source,)
+        with self._lock:
+            spans = self._traces.pop(source, [])
+            for span in spans:
+                span.trace_ids = targets
+                span.deferred = False
+        for span in spans:
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            for trace_id in span.trace_ids:
+                spans = self._traces.get(trace_id)
+                if spans is None:
+                    spans = self._traces[trace_id] = []
+                    while len(self._traces) > self.max_traces:
+                        self._traces.popitem(last=False)
+                else:
+                    self._traces.move_to_end(trace_id)
+                if len(spans) < TRACE_MAX_SPANS:
+                    spans.append(span)
+        if self.exporter is not None and not span.deferred:
+            for trace_id in span.trace_ids:
+                self.exporter.submit(trace_id, span)
+
+    def get_trace(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Alle spans van een trace, op starttijd"""
+        with self._lock:
+            spans = list(self._traces.get(trace_id, ()))
+        if not spans:
+            return None
+        spans.sort(key=lambda span: span.start)
+        return {"trace_id": trace_id, **self._summary(spans), "spans": [span.to_dict() for span in spans]}
+
+    def recent(self, limit: int = 50, account: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Samenvatting van de laatste traces: document, totale duur en traagste stap"""
+        with self._lock:
+            traces = [(trace_id, list(spans)) for trace_id, spans in reversed(self._traces.items())]
+        result = []
+        for trace_id, spans in traces:
+            summary = self._summary(spans)
+            if account and summary.get("account") != account:
+                continue
+            result.append({"trace_id": trace_id, **summary})
+            if len(result) >= limit:
+                break
+        return result
+
+    @staticmethod
+    def _summary(spans: List[Span]) -> Dict[str, Any]:
+        attributes: Dict[str, Any] = {}
+        for span in spans:
+            for key in ("account", "filename"):
+                if key in span.attributes and key not in attributes:
+                    attributes[key] = span.attributes[key]
+        start = min(span.start for span in spans)
+        end = max(span.start + (span.duration or 0.0) for span in spans)
+        # Alleen bladeren (stappen zonder children) tellen als kandidaat voor de traagste stap
+        parents = {span.parent_id for span in spans}
+        leaves = [span for span in spans if span.span_id not in parents and span.duration is not None]
+        slowest = max(leaves, key=lambda span: span.duration, default=None)
+        return {
+            **attributes,
+            "start": round(start, 3),
+            "duration": round(end - start, 3),
+            "spans": len(spans),
+            "errors": sum(1 for span in spans if span.error),
+            "slowest_step": {"name": slowest.name, "duration": round(slowest.duration, 3)} if slowest else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"traces": len(self._traces), "otlp_endpoint": OTLP_ENDPOINT or None}
+        if self.exporter is not None:
+            stats.update(otlp_exported=self.exporter.exported, otlp_failed=self.exporter.failed)
+        return stats
+
+
+# Process-wide tracer
+tracer = Tracer(exporter=OTLPExporter(OTLP_ENDPOINT) if OTLP_ENDPOINT else None)
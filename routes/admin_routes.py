@@ -4,9 +4,23 @@ Handles health checks, debug info and system status
 """
 
 import os
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
-from config.app_config import get_stats, active_handlers
+from typing import Optional
+from fastapi import APIRouter, Form
+from fastapi.responses import JSONResponse, Response
+from config.app_config import get_stats, get_history, active_handlers
+from core.ocr_scheduler import ocr_scheduler
+from core.ocr_cache import ocr_cache
+from core.ocr_processor import OCR_PROMPT
+from core.http_pool import openrouter_pool
+from core.rate_limiter import openrouter_limits
+from core.job_workers import job_workers
+from core.smtp_pool import smtp_delivery
+from core.mailbox_coordinator import mailbox_coordinator
+from core.poll_scheduler import poll_scheduler
+from core.storage import state_store
+from core.metrics import MEDIA_TYPE, metrics
+from core.blocking_io import run_blocking
+from core.tracing import tracer
 
 router = APIRouter()
 
@@ -17,6 +31,12 @@ async def health_check():
     return {"status": "healthy", "service": "remarkable-ocr"}
 
 
+@router.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics van dit proces (pijplijn latencies, fouten, tokens, queue diepte)"""
+    return Response(await run_blocking(metrics.render), media_type=MEDIA_TYPE)
+
+
 @router.get("/debug/polling")
 async def debug_polling():
     """Debug endpoint voor polling status"""
@@ -24,14 +44,26 @@ async def debug_polling():
     debug_info = {
         "active_handlers": stats["active_handlers"],
         "configured_users": stats["configured_users"],
+        "ocr_scheduler": ocr_scheduler.get_stats(),
+        "http_pool": openrouter_pool.get_stats(),
+        "openrouter_limits": openrouter_limits.get_stats(),
+        "job_workers": job_workers.get_stats(),
+        "smtp": smtp_delivery.get_stats(),
+        "coordinator": mailbox_coordinator.get_stats(),
+        "poll_scheduler": poll_scheduler.get_stats(),
+        "mailbox_owners": state_store.lease_owners(),
         "handlers": {}
     }
     
     for email, handler in active_handlers.items():
         debug_info["handlers"][email] = {
             "is_polling": handler.is_polling,
-            "processed_messages": len(handler.processed_messages),
-            "allowed_senders": handler.config.allowed_senders
+            "watch_mode": handler.watch_mode,
+            "imap_session": handler.session.get_stats(),
+            "processed_messages": handler.processed_count,
+            "last_uid": handler.mailbox_state.last_uid if handler.mailbox_state else None,
+            "allowed_senders": handler.config.allowed_senders,
+            "sender_policy": handler.sender_policy.get_stats()
         }
     
     return JSONResponse(debug_info)
@@ -47,3 +79,45 @@ async def get_status():
         "users": stats["users"],
         "environment": os.getenv("DEBUG", "False")
     }
+
+
+@router.get("/debug/history/{email}")
+async def debug_history(email: str, limit: int = 50):
+    """Recent verwerkte attachments voor een gebruiker"""
+    return JSONResponse({"email": email, "history": get_history(email, limit)})
+
+
+@router.get("/debug/traces")
+async def debug_traces(limit: int = 50, account: Optional[str] = None):
+    """Laatste traces per document met totale duur en traagste stap"""
+    return JSONResponse({**tracer.get_stats(), "recent": tracer.recent(limit, account)})
+
+
+@router.get("/debug/traces/{trace_id}")
+async def debug_trace(trace_id: str):
+    """Alle spans van één document (fetch → OCR → notificatie)"""
+    trace = tracer.get_trace(trace_id)
+    if trace is None:
+        return JSONResponse({"error": f"Trace {trace_id} niet gevonden"}, status_code=404)
+    return JSONResponse(trace)
+
+
+@router.get("/debug/ocr-cache")
+async def debug_ocr_cache():
+    """Debug endpoint voor OCR cache statistieken"""
+    if ocr_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **await run_blocking(ocr_cache.get_stats)})
+
+
+@router.post("/debug/ocr-cache/invalidate")
+async def invalidate_ocr_cache(model: Optional[str] = Form(None), stale_only: bool = Form(False)):
+    """Leeg de OCR cache, of alleen entries van andere modellen/prompts (stale_only)"""
+    if ocr_cache is None:
+        return JSONResponse({"enabled": False, "removed": 0})
+    
+    if stale_only:
+        removed = await run_blocking(ocr_cache.invalidate, model, OCR_PROMPT, True)
+    else:
+        removed = await run_blocking(ocr_cache.invalidate, model)
+    return JSONResponse({"enabled": True, "removed": removed})
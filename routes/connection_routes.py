@@ -3,16 +3,36 @@ Connection testing routes
 Handles IMAP/SMTP connectivity testing
 """
 
-import ssl
+import asyncio
 import imaplib
 import smtplib
 from fastapi import APIRouter, Form
 from fastapi.responses import JSONResponse
 from config.app_config import set_user_config
+from core.imap_session import get_ssl_context
+from core.blocking_io import run_blocking, IMAP_TIMEOUT, SMTP_TIMEOUT, get_server_timeout
 
 router = APIRouter()
 
 
+def _test_imap(email: str, password: str, imap_server: str, imap_port: int):
+    """Test IMAP login en INBOX toegang (blokkerend, draait in de I/O pool)"""
+    timeout = get_server_timeout(imap_server, IMAP_TIMEOUT)
+    with imaplib.IMAP4_SSL(imap_server, imap_port, ssl_context=get_ssl_context(), timeout=timeout) as imap:
+        imap.login(email, password)
+        imap.select("INBOX")
+        # Test basic functionality
+        imap.search(None, "ALL")
+
+
+def _test_smtp(email: str, password: str, smtp_server: str, smtp_port: int):
+    """Test SMTP STARTTLS en login (blokkerend, draait in de I/O pool)"""
+    timeout = get_server_timeout(smtp_server, SMTP_TIMEOUT)
+    with smtplib.SMTP(smtp_server, smtp_port, timeout=timeout) as smtp:
+        smtp.starttls(context=get_ssl_context())
+        smtp.login(email, password)
+
+
 @router.post("/test-connection")
 async def test_connection(
     email: str = Form(...),
@@ -37,19 +57,9 @@ async def test_connection(
                 "details": "Vul minimaal één email adres in bij toegestane afzenders"
             }, status_code=400)
         
-        # Test IMAP verbinding
-        context = ssl.create_default_context()
-        
-        with imaplib.IMAP4_SSL(imap_server, imap_port, ssl_context=context) as imap:
-            imap.login(email, password)
-            imap.select("INBOX")
-            # Test basic functionality
-            status, messages = imap.search(None, "ALL")
-            
-        # Test SMTP verbinding
-        with smtplib.SMTP(smtp_server, smtp_port) as smtp:
-            smtp.starttls(context=context)
-            smtp.login(email, password)
+        # Test IMAP en SMTP verbinding buiten de event loop
+        await run_blocking(_test_imap, email, password, imap_server, imap_port)
+        await run_blocking(_test_smtp, email, password, smtp_server, smtp_port)
         
         # Sla configuratie tijdelijk op (in-memory voor MVP)
         config = {
@@ -89,6 +99,13 @@ async def test_connection(
             "details": "Controleer SMTP server, poort en inloggegevens"
         }, status_code=400)
     
+    except (TimeoutError, asyncio.TimeoutError):
+        return JSONResponse({
+            "status": "error",
+            "message": "❌ Time-out bij verbinden",
+            "details": "De mailserver reageerde niet op tijd. Controleer server en poort"
+        }, status_code=504)
+    
     except Exception as e:
         return JSONResponse({
             "status": "error",
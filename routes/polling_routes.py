@@ -3,24 +3,20 @@ Polling management routes
 Handles mailbox polling start/stop/status
 """
 
-from fastapi import APIRouter, Form, BackgroundTasks
+from fastapi import APIRouter, Form
 from fastapi.responses import JSONResponse
-from core.email_handler import EmailHandler, create_email_config, validate_email_config
-from core.notification_handler import NotificationHandler
+from core.email_handler import create_email_config, validate_email_config
+from core.mailbox_coordinator import mailbox_coordinator, runs_mail_workers
 from config.app_config import (
-    get_user_config, is_user_configured, get_active_handler, 
-    set_active_handler, remove_active_handler, is_polling_active,
-    set_notification_handler, set_user_config
+    get_user_config, is_user_configured, is_polling_active,
+    set_polling_active, set_user_config
 )
 
 router = APIRouter()
 
 
 @router.post("/start-polling")
-async def start_polling(
-    background_tasks: BackgroundTasks,
-    email: str = Form(...)
-):
+async def start_polling(email: str = Form(...)):
     """Start mailbox polling voor geconfigureerde gebruiker"""
     if not is_user_configured(email):
         return JSONResponse({
@@ -49,41 +45,20 @@ async def start_polling(
                 "message": f"❌ Configuratie fout: {error_msg}"
             }, status_code=400)
         
-        # Create and start handler
-        handler = EmailHandler(email_config)
-        set_active_handler(email, handler)
-        
-        # Initialize notification handler if notification email is set
-        notification_email = config_data.get("notification_email")
-        if notification_email:
-            # Create SMTP config for notification handler
-            smtp_config = {
-                "email": email,
-                "password": config_data["password"],
-                "smtp_server": config_data["smtp_server"],
-                "smtp_port": config_data["smtp_port"]
-            }
-            
-            # Create notification handler
-            notification_handler = NotificationHandler(
-                smtp_config, 
-                notification_email
-            )
-            set_notification_handler(email, notification_handler)
-            
-            print(f"Notification handler initialized for {email} with target: {notification_email}")
-        
-        # Start polling in background
-        background_tasks.add_task(handler.start_polling, 30)  # Poll every 30 seconds
-        
-        # Update status
+        # Update status; de mailbox coordinator (hier of in een worker proces) start de handler
         config_data["status"] = "polling"
         set_user_config(email, config_data)
+        set_polling_active(email, True)
+        mailbox_coordinator.wake()
+        
+        details = f"Monitoring inbox via IDLE push (fallback: polling vanaf 30 seconden). Toegestane afzenders: {', '.join(config_data['allowed_senders'])}"
+        if not runs_mail_workers():
+            details += " De mailbox wordt opgepakt door een worker proces."
         
         return JSONResponse({
             "status": "success",
             "message": f"📧 Mailbox polling gestart voor {email}",
-            "details": f"Monitoring inbox elke 30 seconden. Toegestane afzenders: {', '.join(config_data['allowed_senders'])}"
+            "details": details
         })
         
     except Exception as e:
@@ -104,10 +79,9 @@ async def stop_polling(email: str = Form(...)):
         })
     
     try:
-        # Stop handler
-        handler = get_active_handler(email)
-        handler.stop_polling()
-        remove_active_handler(email)
+        # De eigenaar van de mailbox stopt de handler bij de volgende check
+        set_polling_active(email, False)
+        mailbox_coordinator.wake()
         
         # Update status
         if is_user_configured(email):
@@ -0,0 +1,63 @@
+"""
+Remarkable 2 naar Tekst Converter - Worker proces
+Bewaakt mailboxes en voert OCR jobs uit, naast een API met APP_MODE=control.
+
+Start meerdere workers voor meer doorvoer; mailboxes worden via leases in de
+gedeelde state store (DATA_DIR) verdeeld en OCR jobs via de job queue.
+"""
+
+import signal
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables (voor de core imports, die env bij import lezen)
+load_dotenv()
+
+from config.app_config import active_handlers
+from core.http_pool import openrouter_pool
+from core.imap_session import session_manager
+from core.job_workers import job_workers
+from core.smtp_pool import smtp_delivery
+from core.poll_scheduler import poll_scheduler
+from core.mailbox_coordinator import mailbox_coordinator
+from core.metrics import start_metrics_server
+from core import blocking_io
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    """Draai coordinator en job workers tot SIGINT/SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    metrics_server = start_metrics_server()
+    await openrouter_pool.start()
+    await job_workers.start()
+    await poll_scheduler.start()
+    await mailbox_coordinator.start()
+    logger.info(f"Worker {mailbox_coordinator.worker_id} running")
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info(f"Worker {mailbox_coordinator.worker_id} shutting down")
+        await mailbox_coordinator.stop()
+        for handler in list(active_handlers.values()):
+            await handler.stop_polling()
+        await poll_scheduler.stop()
+        await job_workers.stop()
+        await smtp_delivery.close()
+        await openrouter_pool.close()
+        await blocking_io.run_blocking(session_manager.close_all)
+        blocking_io.shutdown()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())